@@ -0,0 +1,49 @@
+"""
+PostgreSQL с пулом соединений в каждом процессе.
+
+Django 4.2 закрывает соединение в конце запроса (CONN_MAX_AGE=0) - с этим
+бэкендом оно возвращается в пул процесса, а следующий запрос берет готовое.
+Настройки пула - ключ POOL в DATABASES (см. app/settings.py).
+"""
+from django.db.backends.postgresql import base
+
+from .creation import DatabaseCreation
+from .pool import get_pool
+
+POOL_DEFAULTS = {
+    'MAX_SIZE': 10,
+    'TIMEOUT': 10,
+    'CHECK_AFTER': 30,
+    'MAX_LIFETIME': 3600,
+}
+
+
+class DatabaseWrapper(base.DatabaseWrapper):
+    creation_class = DatabaseCreation
+    pool = None
+
+    def pool_for(self, conn_params):
+        options = {**POOL_DEFAULTS, **self.settings_dict.get('POOL', {})}
+        return get_pool(
+            (self.alias, conn_params.get('dbname') or conn_params.get('database')),
+            lambda: super(DatabaseWrapper, self).get_new_connection(conn_params),
+            max_size=options['MAX_SIZE'],
+            timeout=options['TIMEOUT'],
+            check_after=options['CHECK_AFTER'],
+            max_lifetime=options['MAX_LIFETIME'],
+        )
+
+    def get_new_connection(self, conn_params):
+        self.pool = self.pool_for(conn_params)
+        try:
+            return self.pool.getconn()
+        except base.Database.Error:
+            raise
+        except Exception as error:
+            # Ожидание пула - ошибка соединения с БД, как и отказ самого Postgres
+            raise base.Database.OperationalError(str(error)) from error
+
+    def _close(self):
+        if self.connection is not None:
+            with self.wrap_database_errors:
+                self.pool.putconn(self.connection)
@@ -0,0 +1,10 @@
+from django.db.backends.postgresql.creation import DatabaseCreation as BaseDatabaseCreation
+
+from .pool import close_pools
+
+
+class DatabaseCreation(BaseDatabaseCreation):
+    def _destroy_test_db(self, test_database_name, verbosity):
+        # Postgres не удалит базу, пока к ней открыты соединения, в том числе свободные в пуле
+        close_pools(test_database_name)
+        super()._destroy_test_db(test_database_name, verbosity)
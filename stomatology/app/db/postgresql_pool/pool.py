@@ -0,0 +1,231 @@
+import os
+import threading
+import time
+
+from psycopg2 import extensions
+
+
+class PoolTimeout(Exception):
+    """
+    Свободное соединение не появилось за отведенное время
+    """
+
+
+class PooledConnection:
+    def __init__(self, connection):
+        self.connection = connection
+        self.created = time.monotonic()
+        self.returned = self.created
+
+
+class ConnectionPool:
+    """
+    Пул соединений psycopg2 одного процесса.
+
+    Не больше max_size открытых соединений. Запрос, которому соединения не
+    хватило, ждет до timeout секунд. Ожидание построено на
+    threading.Condition: в воркере gevent оно зеленое и не блокирует другие
+    гринлеты. Порядок ожидающих не гарантирован: возвращенное соединение
+    может забрать только что пришедший запрос раньше, чем проснется
+    ожидающий, - тогда тот ждет дальше в пределах своего timeout.
+
+    Соединение, пролежавшее без дела дольше check_after секунд, перед выдачей
+    проверяется запросом SELECT 1. Соединения старше max_lifetime и
+    сломанные соединения закрываются при возврате в пул.
+    """
+    def __init__(self, connect, max_size=10, timeout=10, check_after=30, max_lifetime=3600):
+        self.connect = connect
+        self.max_size = max_size
+        self.timeout = timeout
+        self.check_after = check_after
+        self.max_lifetime = max_lifetime
+        self.pid = os.getpid()
+
+        self._condition = threading.Condition()
+        self._idle = []
+        self._in_use = {}
+        self._opening = 0
+        self._waiting = 0
+        self._stats = {
+            'connections_opened': 0,
+            'connections_closed': 0,
+            'checks_failed': 0,
+            'requests': 0,
+            'waits': 0,
+            'wait_time_total': 0.0,
+            'wait_time_max': 0.0,
+            'timeouts': 0,
+        }
+
+    @property
+    def _open(self):
+        return len(self._idle) + len(self._in_use) + self._opening
+
+    def getconn(self):
+        started = time.monotonic()
+        with self._condition:
+            self._stats['requests'] += 1
+            waited = False
+            while not self._idle and self._open >= self.max_size:
+                remaining = self.timeout - (time.monotonic() - started)
+                if remaining <= 0:
+                    self._stats['timeouts'] += 1
+                    raise PoolTimeout(
+                        f"Нет свободного соединения с БД за {self.timeout} с (в пуле {self.max_size})"
+                    )
+                waited = True
+                self._waiting += 1
+                try:
+                    self._condition.wait(remaining)
+                finally:
+                    self._waiting -= 1
+            if waited:
+                wait_time = time.monotonic() - started
+                self._stats['waits'] += 1
+                self._stats['wait_time_total'] += wait_time
+                self._stats['wait_time_max'] = max(self._stats['wait_time_max'], wait_time)
+            if self._idle:
+                pooled = self._idle.pop()
+                # Место в пуле занято сразу, еще до проверки соединения
+                self._in_use[id(pooled.connection)] = pooled
+            else:
+                pooled = None
+                self._opening += 1
+
+        if pooled is not None and not self._healthy(pooled):
+            with self._condition:
+                del self._in_use[id(pooled.connection)]
+                self._opening += 1
+                self._stats['connections_closed'] += 1
+            self._close_quietly(pooled.connection)
+            pooled = None
+        if pooled is None:
+            # Соединение открывается вне блокировки: пока идет подключение,
+            # другие запросы могут брать и возвращать соединения
+            try:
+                pooled = PooledConnection(self.connect())
+            except BaseException:
+                with self._condition:
+                    self._opening -= 1
+                    self._condition.notify()
+                raise
+            with self._condition:
+                self._opening -= 1
+                self._stats['connections_opened'] += 1
+                self._in_use[id(pooled.connection)] = pooled
+        return pooled.connection
+
+    def putconn(self, connection):
+        with self._condition:
+            pooled = self._in_use.pop(id(connection), None)
+        if pooled is None:
+            # Соединение не из пула (например, открытое до форка процесса)
+            connection.close()
+            return
+
+        if self._reset(pooled):
+            pooled.returned = time.monotonic()
+            with self._condition:
+                self._idle.append(pooled)
+                self._condition.notify()
+        else:
+            self._discard(pooled)
+
+    def _healthy(self, pooled):
+        if pooled.connection.closed:
+            return False
+        if time.monotonic() - pooled.returned < self.check_after:
+            return True
+        try:
+            with pooled.connection.cursor() as cursor:
+                cursor.execute("SELECT 1")
+            return True
+        except Exception:
+            with self._condition:
+                self._stats['checks_failed'] += 1
+            return False
+
+    def _reset(self, pooled):
+        """
+        Подготовка соединения к следующему запросу. False - соединение нужно закрыть
+        """
+        connection = pooled.connection
+        if connection.closed or time.monotonic() - pooled.created > self.max_lifetime:
+            return False
+        status = connection.info.transaction_status
+        if status == extensions.TRANSACTION_STATUS_UNKNOWN:
+            return False
+        if status != extensions.TRANSACTION_STATUS_IDLE:
+            # Запрос закончился посреди транзакции (ошибка или отмена): ее нужно откатить
+            try:
+                connection.rollback()
+            except Exception:
+                return False
+        return True
+
+    @staticmethod
+    def _close_quietly(connection):
+        try:
+            connection.close()
+        except Exception:
+            pass
+
+    def _discard(self, pooled):
+        self._close_quietly(pooled.connection)
+        with self._condition:
+            self._stats['connections_closed'] += 1
+            # Освободилось место для нового соединения
+            self._condition.notify()
+
+    def close(self):
+        """
+        Закрывает свободные соединения. Занятые закроются при возврате
+        """
+        with self._condition:
+            idle, self._idle = self._idle, []
+            self.max_lifetime = -1
+        for pooled in idle:
+            self._discard(pooled)
+
+    def stats(self):
+        with self._condition:
+            return {
+                'max_size': self.max_size,
+                'open': self._open,
+                'in_use': len(self._in_use),
+                'idle': len(self._idle),
+                'waiting': self._waiting,
+                **self._stats,
+            }
+
+
+_pools = {}
+_pools_lock = threading.Lock()
+
+
+def get_pool(key, connect, **options):
+    """
+    Пул процесса для key. После форка (воркеры gunicorn) создается новый пул:
+    сокеты соединений родителя нельзя использовать в дочернем процессе
+    """
+    with _pools_lock:
+        pool = _pools.get(key)
+        if pool is None or pool.pid != os.getpid():
+            pool = _pools[key] = ConnectionPool(connect, **options)
+        return pool
+
+
+def close_pools(database=None):
+    """
+    Закрывает пулы соединений с database (или все): например, перед удалением тестовой БД
+    """
+    with _pools_lock:
+        keys = [key for key in _pools if database is None or key[1] == database]
+        pools = [_pools.pop(key) for key in keys]
+    for pool in pools:
+        pool.close()
+
+
+def pool_stats():
+    with _pools_lock:
+        return {f'{alias}:{database}': pool.stats() for (alias, database), pool in _pools.items()}
@@ -33,6 +33,7 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'stomatology.instrumentation.QueryStatsMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -46,10 +47,17 @@ ROOT_URLCONF = 'app.urls'
 
 TEMPLATES = [
     {
-        'BACKEND': 'django.template.backends.django.DjangoTemplates',
+        'BACKEND': 'stomatology.instrumentation.InstrumentedTemplates',
         'DIRS': [],
-        'APP_DIRS': True,
         'OPTIONS': {
+            # Разобранные шаблоны хранятся в памяти процесса независимо от DEBUG;
+            # при DEBUG автоперезагрузка runserver сбрасывает их при правке файлов
+            'loaders': [
+                ('django.template.loaders.cached.Loader', [
+                    'django.template.loaders.filesystem.Loader',
+                    'django.template.loaders.app_directories.Loader',
+                ]),
+            ],
             'context_processors': [
                 'django.template.context_processors.debug',
                 'django.template.context_processors.request',
@@ -66,18 +74,51 @@ WSGI_APPLICATION = 'app.wsgi.application'
 # Database
 # https://docs.djangoproject.com/en/4.2/ref/settings/#databases
 
+# Соединения берутся из пула процесса (app/db/postgresql_pool): не больше
+# DATABASE_POOL_SIZE на воркер, запрос ждет свободное соединение до DATABASE_POOL_TIMEOUT секунд.
+# Всего соединений с Postgres - воркеры gunicorn * DATABASE_POOL_SIZE, это должно
+# быть меньше max_connections.
+
 DATABASES = {
     'default': {
-        'ENGINE': 'django.db.backends.postgresql',
+        'ENGINE': 'app.db.postgresql_pool',
         'NAME': environ.get('DATABASE_NAME'),
         'USER': environ.get('DATABASE_USERNAME'),
         'PASSWORD': environ.get('DATABASE_PASSWORD'),
         'HOST': environ.get('DATABASE_HOST'),
         'PORT': environ.get('DATABASE_PORT'),
+        'POOL': {
+            'MAX_SIZE': int(environ.get('DATABASE_POOL_SIZE', 10)),
+            'TIMEOUT': float(environ.get('DATABASE_POOL_TIMEOUT', 10)),
+            # Соединение, простоявшее дольше CHECK_AFTER секунд, проверяется перед выдачей
+            'CHECK_AFTER': 30,
+            'MAX_LIFETIME': 3600,
+        },
     }
 }
 
 
+# Cache
+# https://docs.djangoproject.com/en/4.2/topics/cache/
+# Версии для сброса кэша поиска должны быть общими для всех воркеров gunicorn,
+# поэтому в compose используется Redis. Кэш в памяти процесса годится
+# только для разработки с одним процессом.
+
+if environ.get('REDIS_URL'):
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+            'LOCATION': environ.get('REDIS_URL'),
+        }
+    }
+else:
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        }
+    }
+
+
 # Password validation
 # https://docs.djangoproject.com/en/4.2/ref/settings/#auth-password-validators
 
@@ -119,3 +160,19 @@ STATIC_ROOT = os.path.join(BASE_DIR, 'static/')
 # https://docs.djangoproject.com/en/4.2/ref/settings/#default-auto-field
 
 DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
+
+
+# Количество строк на одной странице списков (курсорная пагинация)
+
+LIST_PAGE_SIZE = int(environ.get('LIST_PAGE_SIZE', 50))
+
+# Поиск: сколько лучших результатов показывать сразу
+# и сколько миллисекунд дается одному поисковому запросу
+
+SEARCH_RESULTS = int(environ.get('SEARCH_RESULTS', 20))
+
+SEARCH_STATEMENT_TIMEOUT = int(environ.get('SEARCH_STATEMENT_TIMEOUT', 500))
+
+# Сколько секунд хранится страница результатов поиска в кэше
+
+SEARCH_CACHE_TIMEOUT = int(environ.get('SEARCH_CACHE_TIMEOUT', 300))
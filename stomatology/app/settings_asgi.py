@@ -0,0 +1,7 @@
+"""
+Настройки для запуска под ASGI (gunicorn -c gunicorn_asgi.py app.asgi).
+Списки и поиск обслуживают асинхронные представления (stomatology/async_views.py).
+"""
+from .settings import *  # noqa: F401,F403
+
+ROOT_URLCONF = 'app.urls_asgi'
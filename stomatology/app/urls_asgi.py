@@ -0,0 +1,10 @@
+"""
+URL configuration for the ASGI entry point (app/asgi.py, settings_asgi.py)
+"""
+from django.contrib import admin
+from django.urls import path, include
+
+urlpatterns = [
+    path('admin/', admin.site.urls),
+    path('', include('stomatology.urls_asgi'))
+]
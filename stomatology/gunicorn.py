@@ -15,4 +15,12 @@ env = {
 }
 
 reload = True
-name = 'stomatology'
\ No newline at end of file
+name = 'stomatology'
+
+
+def post_fork(server, worker):
+    # psycopg2 по умолчанию ждет ответа Postgres блокирующим вызовом, и пока идет
+    # запрос, стоят все гринлеты воркера. С wait callback из psycogreen ожидание
+    # идет через цикл событий gevent, и воркер обслуживает другие запросы.
+    from psycogreen.gevent import patch_psycopg
+    patch_psycopg()
@@ -0,0 +1,19 @@
+from multiprocessing import cpu_count
+from os import environ
+
+def max_workers():
+    return cpu_count()
+
+
+# Запуск под ASGI: gunicorn -c gunicorn_asgi.py app.asgi
+bind = '0.0.0.0:' + environ.get('PORT', '8000')
+max_requests = 1000
+worker_class = 'uvicorn_worker.UvicornWorker'
+workers = max_workers()
+
+env = {
+    'DJANGO_SETTINGS_MODULE': 'app.settings_asgi'
+}
+
+reload = True
+name = 'stomatology'
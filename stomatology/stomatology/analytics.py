@@ -0,0 +1,207 @@
+"""
+Загрузка врачей: сколько минут из рабочего времени по расписанию занято
+приемами - по врачам, неделям и месяцам, за периоды в несколько лет.
+
+Расписание и приемы читаются из БД одним COPY на таблицу в двоичном формате
+прямо в массивы NumPy (по одному на столбец), без объектов моделей и без
+кортежей Python на строку. Дальше все считается над массивами целиком:
+минуты по расписанию на неделю и месяц - произведением матрицы "врач x день
+недели" на число таких дней в каждом периоде, минуты приемов - bincount.
+"""
+import datetime
+import io
+
+import numpy as np
+from django.core.cache import cache
+from django.db import connection
+
+from .cache import entity_versions
+from .catalog import CATALOGS
+from .models import RECEPTION_DURATION
+
+# Самый длинный период отчета
+UTILIZATION_MAX_DAYS = 366 * 10
+# Результат зависит только от версий сущностей в ключе, время жизни лишь ограничивает память кэша
+UTILIZATION_CACHE_TIMEOUT = 60 * 60
+UTILIZATION_DEPENDENCIES = ('schedule', 'reception', 'doctor')
+
+MINUTES_IN_DAY = 24 * 60
+
+SCHEDULE_SQL = """
+    SELECT doctor_id::int4, day_week::int4,
+           (extract(epoch FROM start_reception) / 60)::int4, (extract(epoch FROM end_reception) / 60)::int4
+    FROM shedule
+    WHERE doctor_id IS NOT NULL AND end_reception > start_reception AND day_week BETWEEN 1 AND 7 {doctor}
+"""
+RECEPTION_SQL = """
+    SELECT doctor_id::int4, (date_reception - %(start)s)::int4, (extract(epoch FROM time_reception) / 60)::int4
+    FROM reception
+    WHERE doctor_id IS NOT NULL AND date_reception BETWEEN %(start)s AND %(end)s {doctor}
+"""
+
+
+def int_columns(sql, params, count):
+    """
+    Столбцы результата sql (count столбцов int4 без NULL) как массивы NumPy.
+
+    COPY ... (FORMAT binary) отдает строки фиксированной длины: число полей
+    (int16), затем у каждого поля длина (int32) и значение (int32), все в
+    сетевом порядке байт. Такой поток читается np.frombuffer без разбора строк.
+    """
+    buffer = io.BytesIO()
+    with connection.cursor() as cursor:
+        copy = cursor.mogrify(f"COPY ({sql}) TO STDOUT WITH (FORMAT binary)", params).decode()
+        cursor.copy_expert(copy, buffer)
+    data = buffer.getbuffer()
+    # Заголовок: подпись (11 байт), флаги (4), длина расширения (4) и само расширение; в конце - признак конца (2)
+    header = 19 + int.from_bytes(data[15:19], 'big')
+    dtype = np.dtype([('fields', '>i2')] + [
+        field for column in range(count) for field in ((f'length{column}', '>i4'), (f'value{column}', '>i4'))
+    ])
+    rows = np.frombuffer(data[header:len(data) - 2], dtype)
+    return [rows[f'value{column}'].astype(np.int32) for column in range(count)]
+
+
+def _merge_shifts(group, start, end):
+    """
+    Смены [start, end) без пересечений внутри группы (врач и день недели):
+    после сортировки по группе и началу начало каждой смены сдвигается за
+    конец предыдущих смен той же группы, поглощенные смены получают длину 0
+    """
+    order = np.lexsort((start, group))
+    group, start, end = group[order], start[order], end[order]
+    # Группы идут по возрастанию, поэтому накопленный максимум group * шаг + конец
+    # не переходит из одной группы в другую: это максимум концов внутри группы
+    step = MINUTES_IN_DAY + 1
+    reached = np.maximum.accumulate(group.astype(np.int64) * step + end) - group.astype(np.int64) * step
+    previous = np.zeros_like(start)
+    previous[1:] = reached[:-1]
+    # У первой смены группы предыдущих нет
+    first = np.ones(len(group), dtype=bool)
+    first[1:] = group[1:] != group[:-1]
+    previous[first] = 0
+    start = np.minimum(np.maximum(start, previous), end)
+    return group, start, end
+
+
+def _hour_overlap(start, end):
+    """
+    Минуты интервалов [start, end) в каждом часе суток: матрица (интервалы x 24)
+    """
+    hours = np.arange(24) * 60
+    return np.clip(np.minimum(end[:, None], hours + 60) - np.maximum(start[:, None], hours), 0, None)
+
+
+def _ratio(booked, scheduled):
+    with np.errstate(divide='ignore', invalid='ignore'):
+        return np.where(scheduled > 0, booked / scheduled, np.nan)
+
+
+def _plain(array, digits=3):
+    # nan (нет рабочего времени) - None, чтобы результат переводился в JSON
+    return [None if np.isnan(value) else round(float(value), digits) for value in np.asarray(array, float).ravel()]
+
+
+def utilization(start, end, doctor=None, duration=None):
+    """
+    Загрузка врачей за даты [start, end]. Прием занимает duration минут
+    (по умолчанию RECEPTION_DURATION). Незанятое время - минуты по расписанию
+    без приемов: окна, которые можно было заполнить
+    """
+    duration = duration or RECEPTION_DURATION
+    filter_sql = 'AND doctor_id = %(doctor)s' if doctor else ''
+    params = {'start': start, 'end': end, 'doctor': doctor}
+    shift_doctor, shift_weekday, shift_start, shift_end = int_columns(SCHEDULE_SQL.format(doctor=filter_sql), params, 4)
+    visit_doctor, visit_day, visit_minute = int_columns(RECEPTION_SQL.format(doctor=filter_sql), params, 3)
+
+    doctor_ids = np.union1d(shift_doctor, visit_doctor)
+    doctors = len(doctor_ids)
+    shift_doctor = np.searchsorted(doctor_ids, shift_doctor)
+    visit_doctor = np.searchsorted(doctor_ids, visit_doctor)
+
+    # Календарь периода: день недели (0 - понедельник), неделя и месяц каждого дня
+    days = np.arange((end - start).days + 1)
+    weekday = (start.weekday() + days) % 7
+    week = (start.weekday() + days) // 7
+    months = (np.datetime64(start) + days).astype('datetime64[M]')
+    month = (months - months[0]).astype(np.int64)
+    weeks_count, months_count = week[-1] + 1, month[-1] + 1
+    # Сколько раз каждый день недели встречается в каждой неделе и каждом месяце
+    weekdays_in_week = np.bincount(weekday * weeks_count + week, minlength=7 * weeks_count).reshape(7, weeks_count)
+    weekdays_in_month = np.bincount(weekday * months_count + month, minlength=7 * months_count).reshape(7, months_count)
+
+    # Минуты по расписанию: врач x день недели, затем по неделям и месяцам
+    group, shift_start, shift_end = _merge_shifts(shift_doctor * 7 + shift_weekday - 1, shift_start, shift_end)
+    weekly = np.bincount(group, weights=shift_end - shift_start, minlength=doctors * 7).reshape(doctors, 7)
+    scheduled_week = weekly @ weekdays_in_week
+    scheduled_month = weekly @ weekdays_in_month
+
+    booked_week = np.bincount(
+        visit_doctor * weeks_count + week[visit_day], minlength=doctors * weeks_count
+    ).reshape(doctors, weeks_count) * duration
+    booked_month = np.bincount(
+        visit_doctor * months_count + month[visit_day], minlength=doctors * months_count
+    ).reshape(doctors, months_count) * duration
+
+    # Тепловая карта день недели x час: приемы, минуты по расписанию и занятые минуты
+    visit_weekday = weekday[visit_day]
+    visits_heatmap = np.bincount(
+        visit_weekday * 24 + np.minimum(visit_minute // 60, 23), minlength=7 * 24
+    ).reshape(7, 24)
+    scheduled_heatmap = np.zeros((7, 24))
+    np.add.at(scheduled_heatmap, group % 7, _hour_overlap(shift_start, shift_end))
+    scheduled_heatmap *= np.bincount(weekday, minlength=7)[:, None]
+    # Прием делится между часами, в которые попадает: час начала и следующие
+    booked_heatmap = np.zeros(7 * 24)
+    visit_end = np.minimum(visit_minute + duration, MINUTES_IN_DAY)
+    for hour_offset in range(duration // 60 + 2):
+        hour = visit_minute // 60 + hour_offset
+        minutes = np.clip(np.minimum(visit_end, (hour + 1) * 60) - np.maximum(visit_minute, hour * 60), 0, None)
+        inside = (hour < 24) & (minutes > 0)
+        booked_heatmap += np.bincount(
+            visit_weekday[inside] * 24 + hour[inside], weights=minutes[inside], minlength=7 * 24
+        )
+    booked_heatmap = booked_heatmap.reshape(7, 24)
+
+    names = {pk: obj.full_name for pk, obj in CATALOGS['doctor'].get_many(doctor_ids.tolist()).items()}
+    scheduled_total, booked_total = scheduled_week.sum(axis=1), booked_week.sum(axis=1)
+    first_monday = start - datetime.timedelta(days=start.weekday())
+    return {
+        'start': start.isoformat(),
+        'end': end.isoformat(),
+        'duration': duration,
+        'weeks': [(first_monday + datetime.timedelta(weeks=int(number))).isoformat() for number in range(weeks_count)],
+        'months': [str(value) for value in np.unique(months)],
+        'doctors': [
+            {
+                'id': int(doctor_id),
+                'name': names.get(int(doctor_id), ''),
+                'scheduled_minutes': int(scheduled_total[index]),
+                'booked_minutes': int(booked_total[index]),
+                'idle_minutes': int(max(scheduled_total[index] - booked_total[index], 0)),
+                'utilization': _plain([_ratio(booked_total[index], scheduled_total[index])])[0],
+                'weeks': _plain(_ratio(booked_week[index], scheduled_week[index])),
+                'months': _plain(_ratio(booked_month[index], scheduled_month[index])),
+                'idle_months': np.clip(scheduled_month[index] - booked_month[index], 0, None).astype(int).tolist(),
+            }
+            for index, doctor_id in enumerate(doctor_ids)
+        ],
+        'heatmap': {
+            'visits': visits_heatmap.tolist(),
+            'utilization': [_plain(row) for row in _ratio(booked_heatmap, scheduled_heatmap)],
+        },
+    }
+
+
+def cached_utilization(start, end, doctor=None):
+    """
+    utilization() из кэша: ключ включает версии расписания, приемов и врачей,
+    поэтому любое их изменение (см. signals.py) дает новый расчет
+    """
+    versions = '.'.join(str(version) for version in entity_versions(UTILIZATION_DEPENDENCIES))
+    key = f'analytics:utilization:{start}:{end}:{doctor or ""}:{versions}'
+    result = cache.get(key)
+    if result is None:
+        result = utilization(start, end, doctor)
+        cache.set(key, result, UTILIZATION_CACHE_TIMEOUT)
+    return result
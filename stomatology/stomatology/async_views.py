@@ -0,0 +1,123 @@
+"""
+Асинхронные версии списков для запуска под ASGI (gunicorn_asgi.py).
+
+Списки без поиска читаются асинхронным ORM. Поиск задает порог pg_trgm и
+statement_timeout через SET LOCAL, а транзакции в асинхронном ORM Django 4.2
+недоступны, поэтому страница поиска, как и отрисовка шаблона, выполняется
+в потоке через sync_to_async. Асинхронно работает только выборка списка
+без поиска; проверка прав (request.user и его права загружаются из БД
+синхронно), поиск и шаблоны остаются синхронными. Бюджет запросов и
+условный GET - те же, что у представлений views.py.
+"""
+from asgiref.sync import sync_to_async
+from django.core.exceptions import PermissionDenied
+from django.http import HttpResponse
+
+from .conditional import conditional_list
+from .export import aexport_chunks
+from .instrumentation import query_budget
+from .listing import list_values
+from .pagination import akeyset_page
+from .singleflight import Abandoned
+from .views import (
+    DOCTOR_SIMILARITY_THRESHOLD, PATIENT_SIMILARITY_THRESHOLD, RECEPTION_SIMILARITY_THRESHOLD,
+    SCHEDULE_SIMILARITY_THRESHOLD, SERVICE_RENDERED_SIMILARITY_THRESHOLD, SERVICE_SIMILARITY_THRESHOLD,
+    doctor_search, export_params, export_response, list_page, list_response, patient_search, reception_search, schedule_search,
+    service_rendered_search, service_search,
+)
+
+
+async def arender_list(request, queryset, ordering, name, context_name, similarity_threshold=None):
+    """
+    render_list() для асинхронных представлений
+    """
+    try:
+        if request.GET.get('q'):
+            page, search_timeout = await sync_to_async(list_page)(
+                request, queryset, ordering, similarity_threshold
+            )
+        else:
+            page = await akeyset_page(list_values(queryset, ordering), ordering, request.GET.get('cursor'))
+            search_timeout = False
+    except Abandoned:
+        return HttpResponse(status=204)
+    return await sync_to_async(list_response)(request, page, search_timeout, name, context_name)
+
+
+@query_budget(3, search=5)
+@conditional_list('doctor')
+async def doctors_get(request):
+    doctors, ordering = doctor_search(request.GET.get('q'))
+    return await arender_list(
+        request, doctors, ordering, 'doctors/doctor', 'doctors',
+        similarity_threshold=DOCTOR_SIMILARITY_THRESHOLD
+    )
+
+
+@query_budget(3, search=5)
+@conditional_list('patient')
+async def patients_get(request):
+    patients, ordering = patient_search(request.GET.get('q'))
+    return await arender_list(
+        request, patients, ordering, 'patients/patient', 'patients',
+        similarity_threshold=PATIENT_SIMILARITY_THRESHOLD
+    )
+
+
+@query_budget(3, search=5)
+@conditional_list('schedule')
+async def schedules_get(request):
+    schedules, ordering = schedule_search(request.GET.get('q'))
+    return await arender_list(
+        request, schedules, ordering, 'schedules/schedule', 'schedules',
+        similarity_threshold=SCHEDULE_SIMILARITY_THRESHOLD
+    )
+
+
+@query_budget(3, search=5)
+@conditional_list('service')
+async def services_get(request):
+    services, ordering = service_search(request.GET.get('q'))
+    return await arender_list(
+        request, services, ordering, 'services/service', 'services',
+        similarity_threshold=SERVICE_SIMILARITY_THRESHOLD
+    )
+
+
+@query_budget(3, search=5)
+@conditional_list('service_rendered')
+async def service_rendereds_get(request):
+    services_rendered, ordering = service_rendered_search(request.GET.get('q'))
+    return await arender_list(
+        request, services_rendered, ordering, 'services_rendered/service_rendered', 'services_rendered',
+        similarity_threshold=SERVICE_RENDERED_SIMILARITY_THRESHOLD
+    )
+
+
+@query_budget(3, search=5)
+@conditional_list('reception')
+async def receptions_get(request):
+    receptions, ordering = reception_search(request.GET.get('q'))
+    return await arender_list(
+        request, receptions, ordering, 'receptions/reception', 'receptions',
+        similarity_threshold=RECEPTION_SIMILARITY_THRESHOLD
+    )
+
+
+async def aexport(request, entity, permission, name):
+    """
+    Выгрузка, которая читает строки асинхронным ORM по мере отправки
+    """
+    # request.user загружается из сессии запросом к БД
+    if not await sync_to_async(lambda: request.user.has_perm(permission))():
+        raise PermissionDenied
+    queryset, export, dates = export_params(request, entity)
+    return export_response(request, aexport_chunks(queryset, export), export, name, dates)
+
+
+async def receptions_export(request):
+    return await aexport(request, 'reception', 'stomatology.view_reception', 'receptions')
+
+
+async def services_rendered_export(request):
+    return await aexport(request, 'service_rendered', 'stomatology.view_service_rendered', 'services_rendered')
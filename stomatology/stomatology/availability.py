@@ -0,0 +1,147 @@
+"""
+Свободное время врачей.
+
+Время внутри дня хранится в минутах от полуночи, рабочее и занятое время -
+отсортированные списки полуинтервалов [начало, конец). Расписание на каждый
+день диапазона и приемы за тот же диапазон приходят одним запросом.
+"""
+import datetime
+
+from django.db import connection
+from psycopg2 import errorcodes
+
+from .models import RECEPTION_DURATION, RECEPTION_OVERLAP_CONSTRAINT, Reception, Schedule
+
+# Рабочие интервалы по расписанию на каждый день диапазона (ISODOW: понедельник = 1,
+# как в Schedule.DAY_WEEK_CHOICES) и занятые приемами минуты за те же дни
+AVAILABILITY_SQL = f"""
+    SELECT s.doctor_id, d.day::date, s.start_reception, s.end_reception, NULL::time
+    FROM {Schedule._meta.db_table} s
+    CROSS JOIN generate_series(%(start)s::date, %(end)s::date, interval '1 day') AS d(day)
+    WHERE s.doctor_id IS NOT NULL AND s.day_week = EXTRACT(ISODOW FROM d.day) {{schedule_doctor}}
+    UNION ALL
+    SELECT r.doctor_id, r.date_reception, NULL, NULL, r.time_reception
+    FROM {Reception._meta.db_table} r
+    WHERE r.doctor_id IS NOT NULL AND r.date_reception BETWEEN %(start)s AND %(end)s {{reception_doctor}} {{exclude}}
+"""
+
+
+def booking_conflict(error):
+    """
+    IntegrityError от ограничения reception_doctor_no_overlap: врач уже занят в это время
+    """
+    cause = error.__cause__
+    return (
+        getattr(cause, 'pgcode', None) == errorcodes.EXCLUSION_VIOLATION
+        and cause.diag.constraint_name == RECEPTION_OVERLAP_CONSTRAINT
+    )
+
+
+def day_minutes(value):
+    # Время как число минут от полуночи
+    return value.hour * 60 + value.minute
+
+
+def _time(minutes):
+    return datetime.time(minutes // 60, minutes % 60)
+
+
+def merge(intervals):
+    """
+    Объединение пересекающихся и смежных интервалов
+    """
+    result = []
+    for start, end in sorted(intervals):
+        if result and start <= result[-1][1]:
+            result[-1] = (result[-1][0], max(result[-1][1], end))
+        else:
+            result.append((start, end))
+    return result
+
+
+def subtract(free, busy):
+    """
+    free без busy; оба списка отсортированы и не пересекаются внутри себя
+    """
+    result = []
+    i = 0
+    for start, end in free:
+        while i < len(busy) and busy[i][1] <= start:
+            i += 1
+        j = i
+        while j < len(busy) and busy[j][0] < end:
+            if busy[j][0] > start:
+                result.append((start, busy[j][0]))
+            start = max(start, busy[j][1])
+            j += 1
+        if start < end:
+            result.append((start, end))
+    return result
+
+
+def free_intervals(start, end, doctor=None, exclude=None, duration=None):
+    """
+    {id врача: {дата: [(начало, конец), ...]}} - свободное время в минутах от полуночи.
+
+    Каждый прием занимает duration минут (по умолчанию RECEPTION_DURATION),
+    exclude - id приема, который не считается занятым (при его изменении).
+    """
+    duration = duration or RECEPTION_DURATION
+    params = {'start': start, 'end': end}
+    filters = {'schedule_doctor': '', 'reception_doctor': '', 'exclude': ''}
+    if doctor is not None:
+        params['doctor'] = doctor
+        filters['schedule_doctor'] = 'AND s.doctor_id = %(doctor)s'
+        filters['reception_doctor'] = 'AND r.doctor_id = %(doctor)s'
+    if exclude is not None:
+        params['exclude'] = exclude
+        filters['exclude'] = 'AND r.id <> %(exclude)s'
+
+    working, busy = {}, {}
+    with connection.cursor() as cursor:
+        cursor.execute(AVAILABILITY_SQL.format(**filters), params)
+        for doctor_id, day, shift_start, shift_end, reception_time in cursor.fetchall():
+            if reception_time is None:
+                working.setdefault((doctor_id, day), []).append((day_minutes(shift_start), day_minutes(shift_end)))
+            else:
+                begin = day_minutes(reception_time)
+                busy.setdefault((doctor_id, day), []).append((begin, begin + duration))
+
+    result = {}
+    for (doctor_id, day), shifts in sorted(working.items()):
+        free = subtract(merge(shifts), merge(busy.get((doctor_id, day), [])))
+        if free:
+            result.setdefault(doctor_id, {})[day] = free
+    return result
+
+
+def free_slots(start, end, doctor=None, duration=None, after=None):
+    """
+    {id врача: [(дата, время), ...]} - начала свободных окон длиной duration минут.
+
+    Окна идут подряд от начала каждого свободного интервала;
+    after (datetime без часового пояса) отбрасывает уже прошедшие.
+    """
+    duration = duration or RECEPTION_DURATION
+    result = {}
+    for doctor_id, days in free_intervals(start, end, doctor).items():
+        slots = []
+        for day, intervals in days.items():
+            for begin, finish in intervals:
+                for minute in range(begin, finish - duration + 1, duration):
+                    slot = (day, _time(minute))
+                    if after is None or datetime.datetime.combine(*slot) >= after:
+                        slots.append(slot)
+        if slots:
+            result[doctor_id] = slots
+    return result
+
+
+def is_free(doctor, day, time, exclude=None):
+    """
+    Помещается ли прием врача doctor в day с time целиком в его свободное время
+    """
+    begin = day_minutes(time)
+    finish = begin + RECEPTION_DURATION
+    intervals = free_intervals(day, day, doctor, exclude).get(doctor, {}).get(day, [])
+    return any(start <= begin and finish <= end for start, end in intervals)
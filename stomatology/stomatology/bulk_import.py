@@ -0,0 +1,225 @@
+"""
+Импорт пациентов и приемов из CSV (перенос из прежней системы).
+
+Файл читается порциями по IMPORT_BATCH_SIZE строк. Каждая строка проверяется
+формой, все проверки, которым нужна БД, выполняются одним запросом на порцию,
+а прошедшие проверку строки загружаются в таблицу одной командой COPY.
+Ошибочные строки попадают в отчет с номерами и не мешают загрузке остальных.
+Файл, который дальше не читается (не UTF-8, например CSV из Excel в cp1251,
+или испорченные кавычки), прерывает импорт: загруженные к этому моменту
+порции остаются, а отчет говорит, до какой строки файл загружен.
+"""
+import csv
+import io
+from itertools import islice
+
+from django.db import IntegrityError, connection, transaction
+
+from .availability import booking_conflict, day_minutes
+from .cache import bump_version
+from .forms import PatientImportForm, ReceptionImportForm
+from .models import RECEPTION_DURATION, Doctor, Patient, Reception
+
+IMPORT_BATCH_SIZE = 1000
+
+PHONE_TAKEN = "Этот номер телефона уже используется"
+
+
+class ImportResult:
+    def __init__(self):
+        self.imported = 0
+        # (номер строки файла, сообщение)
+        self.errors = []
+
+    def error(self, line, message):
+        self.errors.append((line, message))
+
+
+def _ids_by_phone(model, phones):
+    """
+    {телефон E.164: id} строк model с телефонами из phones. Телефоны уже
+    проверены формой, поэтому передаются строками одним параметром-массивом:
+    phone_number__in заново разбирал бы каждый номер при построении запроса
+    """
+    table = connection.ops.quote_name(model._meta.db_table)
+    with connection.cursor() as cursor:
+        cursor.execute(f"SELECT phone_number, id FROM {table} WHERE phone_number = ANY(%s)", [list(phones)])
+        return dict(cursor.fetchall())
+
+
+def _form_errors(form):
+    return '; '.join(
+        f"{field}: {' '.join(messages)}" if field != '__all__' else ' '.join(messages)
+        for field, messages in form.errors.items()
+    )
+
+
+class PatientImporter:
+    """
+    Пациенты: full_name, phone_number, patient_address
+    """
+    model = Patient
+    # Колонки CSV и колонки таблицы, в которые идут проверенные значения
+    fields = ('full_name', 'phone_number', 'patient_address')
+    columns = ('full_name', 'phone_number', 'patient_address')
+
+    def __init__(self):
+        # Телефоны из уже прочитанных строк файла: дубликат внутри файла - тоже ошибка
+        self.seen = set()
+
+    def validate(self, rows, result):
+        valid = []
+        for line, row in rows:
+            form = PatientImportForm(data=row)
+            if not form.is_valid():
+                result.error(line, _form_errors(form))
+                continue
+            data = form.cleaned_data
+            valid.append((line, (data['full_name'], data['phone_number'].as_e164, data['patient_address'])))
+
+        taken = _ids_by_phone(Patient, {values[1] for _, values in valid})
+        accepted = []
+        for line, values in valid:
+            if values[1] in taken or values[1] in self.seen:
+                result.error(line, f"phone_number: {PHONE_TAKEN}")
+                continue
+            self.seen.add(values[1])
+            accepted.append((line, values))
+        return accepted
+
+
+class ReceptionImporter:
+    """
+    Приемы: date_reception, time_reception, doctor_phone, patient_phone.
+    Приемы одного врача не должны пересекаться ни с уже записанными, ни между собой
+    """
+    model = Reception
+    fields = ('date_reception', 'time_reception', 'doctor_phone', 'patient_phone')
+    columns = ('date_reception', 'time_reception', 'doctor_id', 'patient_id')
+
+    def validate(self, rows, result):
+        valid = []
+        for line, row in rows:
+            form = ReceptionImportForm(data=row)
+            if form.is_valid():
+                valid.append((line, form.cleaned_data))
+            else:
+                result.error(line, _form_errors(form))
+        if not valid:
+            return []
+
+        doctors = _ids_by_phone(Doctor, {data['doctor_phone'].as_e164 for _, data in valid})
+        patients = _ids_by_phone(Patient, {data['patient_phone'].as_e164 for _, data in valid})
+
+        # Занятое время врачей порции за ее диапазон дат - одним запросом
+        dates = [data['date_reception'] for _, data in valid]
+        busy = {}
+        for doctor_id, day, time in Reception.objects.filter(
+            doctor_id__in=doctors.values(), date_reception__range=(min(dates), max(dates))
+        ).values_list('doctor_id', 'date_reception', 'time_reception'):
+            busy.setdefault((doctor_id, day), []).append(day_minutes(time))
+
+        duration = RECEPTION_DURATION
+        accepted = []
+        for line, data in valid:
+            doctor_id = doctors.get(data['doctor_phone'].as_e164)
+            patient_id = patients.get(data['patient_phone'].as_e164)
+            if doctor_id is None:
+                result.error(line, "doctor_phone: Врач с таким телефоном не найден")
+                continue
+            if patient_id is None:
+                result.error(line, "patient_phone: Пациент с таким телефоном не найден")
+                continue
+            start = day_minutes(data['time_reception'])
+            day_busy = busy.setdefault((doctor_id, data['date_reception']), [])
+            if any(abs(start - other) < duration for other in day_busy):
+                result.error(line, "time_reception: Врач в это время уже занят")
+                continue
+            day_busy.append(start)
+            accepted.append((line, (data['date_reception'], data['time_reception'], doctor_id, patient_id)))
+        return accepted
+
+
+IMPORTERS = {
+    'patients': PatientImporter,
+    'receptions': ReceptionImporter,
+}
+
+
+def _copy(model, columns, rows):
+    """
+    Загрузка строк в таблицу модели командой COPY
+    """
+    buffer = io.StringIO()
+    csv.writer(buffer).writerows(values for _, values in rows)
+    buffer.seek(0)
+    table = connection.ops.quote_name(model._meta.db_table)
+    column_list = ', '.join(connection.ops.quote_name(column) for column in columns)
+    with connection.cursor() as cursor:
+        cursor.copy_expert(f"COPY {table} ({column_list}) FROM STDIN WITH (FORMAT csv)", buffer)
+
+
+def _insert_one(model, columns, line, values, result):
+    try:
+        with transaction.atomic():
+            model.objects.create(**dict(zip(columns, values)))
+    except IntegrityError as error:
+        message = "Врач в это время уже занят" if booking_conflict(error) else str(error.__cause__ or error).strip()
+        result.error(line, message)
+        return False
+    return True
+
+
+def load(importer, rows, result):
+    """
+    COPY всей порции; если ее отклонило ограничение БД (строку успели записать
+    параллельно), порция загружается построчно, чтобы найти и пропустить ошибочные строки
+    """
+    if not rows:
+        return
+    try:
+        with transaction.atomic():
+            _copy(importer.model, importer.columns, rows)
+        result.imported += len(rows)
+    except IntegrityError:
+        for line, values in rows:
+            result.imported += _insert_one(importer.model, importer.columns, line, values, result)
+
+
+def _read_error(error):
+    if isinstance(error, UnicodeDecodeError):
+        return "Файл не в кодировке UTF-8: сохраните его как \"CSV UTF-8\" и загрузите снова"
+    return f"Файл не удалось разобрать как CSV: {error}"
+
+
+def import_csv(file, kind, batch_size=IMPORT_BATCH_SIZE):
+    """
+    Импорт открытого текстового CSV-файла с заголовком; kind - ключ IMPORTERS
+    """
+    importer = IMPORTERS[kind]()
+    result = ImportResult()
+    reader = csv.DictReader(file)
+    # Последняя строка файла в уже загруженных порциях
+    loaded_through = 1
+    try:
+        missing = set(importer.fields) - set(reader.fieldnames or ())
+        if missing:
+            result.error(1, f"В заголовке нет колонок: {', '.join(sorted(missing))}")
+            return result
+
+        # Первая строка файла - заголовок
+        rows = enumerate(reader, start=2)
+        while batch := list(islice(rows, batch_size)):
+            load(importer, importer.validate(batch, result), result)
+            loaded_through = batch[-1][0]
+    except (UnicodeDecodeError, csv.Error) as error:
+        # Текст декодируется блоками, поэтому номер строки с ошибкой неточен: указывается первая непрочитанная
+        done = f"строки 2-{loaded_through} обработаны, " if loaded_through > 1 else ""
+        result.error(
+            loaded_through + 1, f"{_read_error(error)}. Импорт остановлен: {done}загружено строк: {result.imported}"
+        )
+    finally:
+        # bulk-загрузка не отправляет post_save: кэш поиска сбрасывается один раз в конце
+        if result.imported:
+            bump_version(importer.model._meta.model_name)
+    return result
@@ -0,0 +1,211 @@
+import hashlib
+import threading
+import time
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import OperationalError, connection
+
+from .singleflight import Abandoned, Group
+
+# Поиск по сущности показывает поля связанных таблиц (ФИО врача в приеме,
+# название услуги в оказанной услуге), поэтому ее результаты зависят и от их версий
+SEARCH_DEPENDENCIES = {
+    'doctor': ('doctor',),
+    'patient': ('patient',),
+    'schedule': ('schedule', 'doctor'),
+    'service': ('service',),
+    'service_rendered': ('service_rendered', 'service', 'reception'),
+    'reception': ('reception', 'doctor', 'patient'),
+}
+
+
+def _version_key(entity):
+    return f'search:version:{entity}'
+
+
+def entity_versions(entities):
+    """
+    Текущие версии сущностей.
+
+    Версия, которой нет в кэше (первый запуск или вытеснение), начинается
+    с текущего времени, а не с нуля: иначе она могла бы совпасть с версией
+    старых записей и вернуть их к жизни.
+    """
+    keys = [_version_key(entity) for entity in entities]
+    versions = cache.get_many(keys)
+    for key in keys:
+        if key not in versions:
+            cache.add(key, time.time_ns(), timeout=None)
+            versions[key] = cache.get(key)
+    return [versions[key] for key in keys]
+
+
+def bump_version(entity):
+    """
+    Новая версия сущности: все закэшированные результаты поиска, которые от нее зависят, устаревают
+    """
+    try:
+        cache.incr(_version_key(entity))
+    except ValueError:
+        cache.add(_version_key(entity), time.time_ns(), timeout=None)
+
+
+def normalize_query(search):
+    return ' '.join(search.lower().split())
+
+
+def permissions_key(user):
+    """
+    Набор прав пользователя: от него зависит, какие кнопки видны в строках списка
+    """
+    if user.is_superuser:
+        return 'superuser'
+    return ','.join(sorted(user.get_all_permissions()))
+
+
+def search_cache_key(entity, search, cursor, user, versions=None):
+    """
+    Ключ страницы результатов. versions - уже прочитанные версии SEARCH_DEPENDENCIES[entity]
+    """
+    if versions is None:
+        versions = entity_versions(SEARCH_DEPENDENCIES[entity])
+    parts = [normalize_query(search), cursor or '', permissions_key(user)]
+    digest = hashlib.sha1('\x00'.join(parts).encode()).hexdigest()
+    return f"search:{entity}:{'.'.join(map(str, versions))}:{digest}"
+
+
+def _count(entity, counter):
+    # Счетчик уже есть почти всегда: одно обращение к кэшу вместо add и incr
+    key = f'search:{counter}:{entity}'
+    try:
+        cache.incr(key)
+    except ValueError:
+        if not cache.add(key, 1, timeout=None):
+            cache.incr(key)
+
+
+# Одинаковые поиски, идущие одновременно в воркере, ждут один запрос к БД
+flights = Group()
+
+
+class SearchRequest:
+    """
+    Поисковый запрос одной сессии к одному списку.
+
+    Каждый новый запрос сессии к тому же списку (следующее нажатие клавиши)
+    делает предыдущий ненужным: тот перестает ждать результат, а если
+    выполняет SQL-запрос, который больше никто не ждет, - прерывает его.
+    """
+    def __init__(self):
+        self.wakeup = threading.Event()
+        self.abandoned = False
+        self.key = None
+        self.call = None
+        self.cancel = None
+        # running - SQL-запрос поиска еще выполняется. Флаг меняется под lock,
+        # и пока abandon() отправляет cancel, поиск не может завершиться и
+        # начать следующий запрос того же соединения
+        self.lock = threading.Lock()
+        self.running = False
+
+    def abandon(self):
+        self.abandoned = True
+        self.wakeup.set()
+        with self.lock:
+            if self.running and flights.abandon(self.key, self.call):
+                self.cancel()
+
+
+_latest = {}
+_latest_lock = threading.Lock()
+
+
+def start_search(slot):
+    search_request = SearchRequest()
+    if slot is None:
+        return search_request
+    with _latest_lock:
+        previous = _latest.get(slot)
+        _latest[slot] = search_request
+    if previous is not None:
+        previous.abandon()
+    return search_request
+
+
+def finish_search(slot, search_request):
+    with _latest_lock:
+        if _latest.get(slot) is search_request:
+            del _latest[slot]
+
+
+def _run_search(entity, key, search_request, call, compute):
+    _count(entity, 'misses')
+    connection.ensure_connection()
+    with search_request.lock:
+        # Пока считались промахи и бралось соединение, запрос сессии мог смениться.
+        # Если к поиску уже присоединились другие запросы, он выполняется для них
+        if search_request.abandoned and flights.abandon(key, call):
+            raise Abandoned
+        search_request.key, search_request.call = key, call
+        search_request.cancel = connection.connection.cancel
+        search_request.running = True
+    try:
+        page = compute()
+    finally:
+        with search_request.lock:
+            search_request.running = False
+            search_request.cancel = None
+    cache.set(key, page, settings.SEARCH_CACHE_TIMEOUT)
+    return page
+
+
+def cached_search(request, entity, search, cursor, compute):
+    """
+    Страница результатов поиска из кэша, а при промахе - compute().
+
+    Одновременные одинаковые промахи в воркере выполняют compute() один раз.
+    Запрос, который сменил более новый запрос той же сессии, бросает Abandoned.
+    """
+    # Анонимные пользователи без сессии не различимы, их запросы не вытесняют друг друга
+    slot = (request.session.session_key, entity) if request.session.session_key else None
+    search_request = start_search(slot)
+    try:
+        # Версии, по которым conditional_list уже посчитал ETag, второй раз из кэша не читаются
+        versions = getattr(request, 'list_versions', {}).get(entity)
+        key = search_cache_key(entity, search, cursor, request.user, versions)
+        page = cache.get(key)
+        if page is not None:
+            _count(entity, 'hits')
+            return page
+        page = flights.do(
+            key, lambda call: _run_search(entity, key, search_request, call, compute), search_request.wakeup
+        )
+        # call есть только у запроса, который сам выполнил поиск
+        if search_request.call is None:
+            _count(entity, 'coalesced')
+        elif search_request.abandoned:
+            # Поиск выполнен для присоединившихся, самой сессии он уже не нужен
+            raise Abandoned
+        return page
+    except OperationalError:
+        if search_request.abandoned:
+            raise Abandoned
+        raise
+    finally:
+        finish_search(slot, search_request)
+
+
+def search_cache_stats():
+    """
+    Счетчики попаданий, промахов и объединенных с другими запросов по сущностям
+    """
+    keys = {
+        (entity, counter): f'search:{counter}:{entity}'
+        for entity in SEARCH_DEPENDENCIES for counter in ('hits', 'misses', 'coalesced')
+    }
+    values = cache.get_many(keys.values())
+    stats = {}
+    for (entity, counter), key in keys.items():
+        stats.setdefault(entity, {})[counter] = values.get(key, 0)
+    return stats
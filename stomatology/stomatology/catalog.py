@@ -0,0 +1,223 @@
+"""
+Справочники врачей и услуг в памяти процесса.
+
+Врачи и прайс-лист нужны почти каждой форме (проверка выбранного врача или
+услуги, подпись в поле выбора) и меняются редко. Каждый воркер gunicorn
+читает справочник из Postgres один раз и держит его у себя.
+
+Сброс - через LISTEN/NOTIFY: триггеры таблиц doctor и service (миграция
+0010_catalog_notify) после каждой команды отправляют уведомление в канал
+CATALOG_CHANNEL, Postgres доставляет его всем слушающим воркерам на всех
+серверах после фиксации транзакции. Воркер слушает канал отдельным
+соединением и перед каждым обращением к справочнику без блокировки
+забирает пришедшие уведомления (poll), поэтому следующий запрос после
+изменения уже не видит старых данных. Если соединение слушателя
+потеряно, уведомления могли пропасть: справочники сбрасываются целиком,
+а пока слушателя нет - читаются из БД без кэша.
+
+Справочник заполняется только вне транзакции: внутри нее запрос может
+видеть свои же незафиксированные изменения, а после отката они остались
+бы в памяти.
+"""
+import os
+import sys
+import threading
+
+import psycopg2
+from django import forms
+from django.core.exceptions import ValidationError
+from django.db import connection
+
+from .models import Doctor, Service
+
+CATALOG_CHANNEL = 'catalog_changed'
+# Таблица больше этого - уже не справочник: держать ее в памяти каждого воркера дорого
+CATALOG_MAX_ROWS = 5000
+
+
+class Catalog:
+    """
+    Все строки модели {pk: объект}. Объекты общие для всех запросов процесса - только для чтения
+    """
+    def __init__(self, model):
+        self.model = model
+        self.rows = None
+        # Поколение растет при каждом сбросе: загрузка, начатая до сброса, не сохраняется
+        self.generation = 0
+        self.too_large = False
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+        self.loads = 0
+        self.invalidations = 0
+
+    def invalidate(self):
+        self.generation += 1
+        self.rows = None
+        self.size = 0
+        self.too_large = False
+        self.invalidations += 1
+
+    def _load(self):
+        objects = list(self.model.objects.order_by('pk')[:CATALOG_MAX_ROWS + 1])
+        self.loads += 1
+        return {obj.pk: obj for obj in objects}, len(objects) > CATALOG_MAX_ROWS
+
+    def _cached_rows(self):
+        """
+        Строки из памяти или только что загруженные; None - кэшировать нельзя
+        """
+        if connection.in_atomic_block or not _listener.poll():
+            return None
+        if self.rows is not None:
+            self.hits += 1
+            return self.rows
+        if self.too_large:
+            return None
+        self.misses += 1
+        generation = self.generation
+        rows, too_large = self._load()
+        if generation == self.generation:
+            self.too_large = too_large
+            if not too_large:
+                self.rows = rows
+                self.size = _approximate_size(rows)
+        return None if too_large else rows
+
+    def get(self, pk):
+        rows = self._cached_rows()
+        if rows is None:
+            return self.model.objects.filter(pk=pk).first()
+        return rows.get(pk)
+
+    def get_many(self, pks):
+        rows = self._cached_rows()
+        if rows is None:
+            return self.model.objects.in_bulk(pks)
+        return {pk: rows[pk] for pk in pks if pk in rows}
+
+    def stats(self):
+        return {
+            'rows': None if self.rows is None else len(self.rows),
+            'bytes': self.size,
+            'too_large': self.too_large,
+            'hits': self.hits,
+            'misses': self.misses,
+            'loads': self.loads,
+            'invalidations': self.invalidations,
+        }
+
+
+def _approximate_size(rows):
+    # Словарь, объекты и значения их полей; строки и числа - по sys.getsizeof
+    size = sys.getsizeof(rows)
+    for obj in rows.values():
+        size += sys.getsizeof(obj) + sys.getsizeof(obj.__dict__)
+        size += sum(sys.getsizeof(value) for value in obj.__dict__.values())
+    return size
+
+
+CATALOGS = {
+    'doctor': Catalog(Doctor),
+    'service': Catalog(Service),
+}
+
+
+def catalog_for(model):
+    return CATALOGS.get(model._meta.model_name)
+
+
+def invalidate(table=None):
+    """
+    Сброс справочника таблицы table (db_table) или всех
+    """
+    for catalog in CATALOGS.values():
+        if table is None or catalog.model._meta.db_table == table:
+            catalog.invalidate()
+
+
+class Listener:
+    """
+    Соединение процесса, слушающее CATALOG_CHANNEL
+    """
+    def __init__(self):
+        self.connection = None
+        self.pid = None
+        self.lock = threading.Lock()
+        self.notifications = 0
+        self.reconnects = 0
+
+    def _connect(self):
+        self.connection = psycopg2.connect(**connection.get_connection_params())
+        self.connection.autocommit = True
+        with self.connection.cursor() as cursor:
+            cursor.execute(f"LISTEN {CATALOG_CHANNEL}")
+        self.pid = os.getpid()
+        self.reconnects += 1
+        # Пока слушателя не было, изменения могли пройти незамеченными
+        invalidate()
+
+    def close(self):
+        if self.connection is not None:
+            try:
+                self.connection.close()
+            except psycopg2.Error:
+                pass
+        self.connection = None
+        invalidate()
+
+    def poll(self):
+        """
+        Применить пришедшие уведомления. False - слушателя нет, справочникам верить нельзя
+        """
+        with self.lock:
+            try:
+                # После fork соединение родителя не используется
+                if self.connection is None or self.connection.closed or self.pid != os.getpid():
+                    self._connect()
+                self.connection.poll()
+            except psycopg2.Error:
+                self.close()
+                return False
+            while self.connection.notifies:
+                notify = self.connection.notifies.pop()
+                self.notifications += 1
+                invalidate(notify.payload)
+            return True
+
+    def stats(self):
+        return {
+            'connected': self.connection is not None and not self.connection.closed,
+            'notifications': self.notifications,
+            'reconnects': self.reconnects,
+        }
+
+
+_listener = Listener()
+
+
+def catalog_stats():
+    return {
+        'listener': _listener.stats(),
+        'catalogs': {name: catalog.stats() for name, catalog in CATALOGS.items()},
+    }
+
+
+class CatalogChoiceField(forms.ModelChoiceField):
+    """
+    ModelChoiceField, который берет выбранного врача или услугу из справочника
+    процесса, а не отдельным запросом при каждой отправке формы
+    """
+    def to_python(self, value):
+        catalog = catalog_for(self.queryset.model)
+        key = self.queryset.model._meta.pk.attname
+        if (value in self.empty_values or catalog is None or self.to_field_name not in (None, key)
+                or self.queryset.query.has_filters()):
+            return super().to_python(value)
+        try:
+            obj = catalog.get(int(value))
+        except (TypeError, ValueError):
+            obj = None
+        if obj is None:
+            raise ValidationError(self.error_messages['invalid_choice'], code='invalid_choice')
+        return obj
@@ -0,0 +1,97 @@
+"""
+Условные GET для списков: ETag из версий таблиц.
+
+Версии таблиц лежат в кэше и растут при каждой записи (signals.py, импорт,
+восстановление из снимка). Ответ списка зависит от версий его таблиц
+(SEARCH_DEPENDENCIES), адреса с параметрами q и cursor, того, HTMX ли это
+запрос (таблица или вся страница), пользователя и его прав, а если в поиске
+есть дата без года ("март", "12.10") - еще и от сегодняшней даты. Если браузер
+прислал тот же ETag, представление не выполняется: ответ 304 без тела
+стоит одного чтения кэша.
+
+Last-Modified не отправляется: время изменения таблицы не учитывает ни
+пользователя, ни запрос, ни сегодняшнюю дату, и по одному If-Modified-Since
+браузер получил бы 304 со старой страницей.
+"""
+import asyncio
+import hashlib
+from functools import wraps
+
+from asgiref.sync import sync_to_async
+from django.contrib.messages import get_messages
+from django.utils.cache import get_conditional_response, patch_cache_control, patch_vary_headers, quote_etag
+from django.utils import timezone
+
+from .cache import SEARCH_DEPENDENCIES, entity_versions, permissions_key
+from .search import parse_query
+
+
+def list_etag(request, versions):
+    parts = [
+        '.'.join(map(str, versions)),
+        request.get_full_path(),
+        request.headers.get('HX-Request', ''),
+        str(request.user.pk),
+        permissions_key(request.user),
+    ]
+    # "Март" в январе и в декабре - разные годы: ответ, сохраненный вчера, сегодня может устареть
+    search = request.GET.get('q', '')
+    if search and parse_query(search).relative_dates:
+        parts.append(timezone.localdate().isoformat())
+    return quote_etag(hashlib.sha1('\x00'.join(parts).encode()).hexdigest())
+
+
+def _precondition(request, entity):
+    """
+    (ETag, ответ 304 или None); None вместо всего - условный GET не применяется
+    """
+    # Страница с сообщением после сохранения формы показывается один раз
+    if request.method not in ('GET', 'HEAD') or len(get_messages(request)):
+        return None
+    versions = entity_versions(SEARCH_DEPENDENCIES[entity])
+    # Ключ кэша поиска (cache.cached_search) строится по тем же версиям, что и ETag
+    request.list_versions = {entity: versions}
+    etag = list_etag(request, versions)
+    return etag, get_conditional_response(request, etag=etag)
+
+
+def _finish(response, etag):
+    # Поиск, прерванный по времени, при повторе может успеть - такой ответ не запоминается
+    if response.status_code == 200 and not getattr(response, 'search_timeout', False):
+        response['ETag'] = etag
+    # Браузер хранит ответ, но каждый раз сверяет его с сервером
+    patch_cache_control(response, private=True, no_cache=True)
+    patch_vary_headers(response, ('HX-Request', 'Cookie'))
+    return response
+
+
+def conditional_list(entity):
+    """
+    Декоратор представления списка entity: ответ 304, если с прошлого раза ничего не изменилось.
+    Подходит и для асинхронных представлений (async_views.py)
+    """
+    def decorator(view):
+        if asyncio.iscoroutinefunction(view):
+            @wraps(view)
+            async def async_wrapper(request, *args, **kwargs):
+                # Сессия, права пользователя и кэш читаются синхронно
+                condition = await sync_to_async(_precondition)(request, entity)
+                if condition is None:
+                    return await view(request, *args, **kwargs)
+                etag, response = condition
+                if response is None:
+                    response = await view(request, *args, **kwargs)
+                return _finish(response, etag)
+            return async_wrapper
+
+        @wraps(view)
+        def wrapper(request, *args, **kwargs):
+            condition = _precondition(request, entity)
+            if condition is None:
+                return view(request, *args, **kwargs)
+            etag, response = condition
+            if response is None:
+                response = view(request, *args, **kwargs)
+            return _finish(response, etag)
+        return wrapper
+    return decorator
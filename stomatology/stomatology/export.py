@@ -0,0 +1,302 @@
+"""
+Выгрузка приемов и оказанных услуг для бухгалтерии и для печати.
+
+Строки читаются серверным курсором (QuerySet.iterator) порциями по
+EXPORT_CHUNK_SIZE и сразу уходят клиенту через StreamingHttpResponse:
+память процесса не зависит от числа строк, а первые байты отправляются
+до того, как прочитана вся выборка. Таблица для печати (format=html) так же
+отдает начало страницы до первого запроса к БД, а затем строки порциями;
+ее заголовок и строки - шаблоны таблицы списка (*_head.html, *_row.html).
+Если клиент принимает gzip, поток сжимается по мере отправки.
+"""
+import csv
+import datetime
+import io
+import json
+import re
+import zlib
+from itertools import islice
+
+from asgiref.sync import sync_to_async
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db.models import ExpressionWrapper, F, FloatField
+from django.template.context import make_context
+from django.template.loader import get_template, render_to_string
+from django.utils.safestring import mark_safe
+
+from .instrumentation import template_timer
+from .listing import list_values
+from .models import Reception, Service_rendered
+
+# Сколько строк читается из курсора и отправляется клиенту за раз
+EXPORT_CHUNK_SIZE = 2000
+# Сжимать выгрузку, если клиент присылает Accept-Encoding: gzip
+EXPORT_GZIP = True
+EXPORT_GZIP_LEVEL = 6
+
+# (поле, заголовок CSV) для каждой выгрузки; связанные таблицы - через JOIN того же запроса
+EXPORT_COLUMNS = {
+    'reception': [
+        ('id', 'Номер приема'),
+        ('date_reception', 'Дата'),
+        ('time_reception', 'Время'),
+        ('doctor__full_name', 'Врач'),
+        ('doctor__office_number', 'Кабинет'),
+        ('patient__full_name', 'Пациент'),
+        ('patient__phone_number', 'Телефон пациента'),
+    ],
+    'service_rendered': [
+        ('id', 'Номер'),
+        ('number_reception_id', 'Номер приема'),
+        ('number_reception__date_reception', 'Дата'),
+        ('number_reception__time_reception', 'Время'),
+        ('number_reception__doctor__full_name', 'Врач'),
+        ('number_reception__patient__full_name', 'Пациент'),
+        ('service__service_name', 'Услуга'),
+        ('service__cost', 'Стоимость'),
+        ('quantity', 'Количество'),
+        ('total', 'Сумма'),
+    ],
+}
+
+# Вычисляемые колонки считает сама БД
+EXPORT_EXPRESSIONS = {
+    'service_rendered': {
+        'total': ExpressionWrapper(F('service__cost') * F('quantity'), output_field=FloatField()),
+    },
+}
+
+# Модель, поле даты, по которому выбирается диапазон и сортируется выгрузка, и поле врача
+EXPORT_SOURCES = {
+    'reception': (Reception, 'date_reception', 'doctor'),
+    'service_rendered': (Service_rendered, 'number_reception__date_reception', 'number_reception__doctor'),
+}
+
+# Шаблоны таблицы списка без суффикса (_head.html, _row.html) для таблицы для печати
+PRINT_TEMPLATES = {
+    'reception': 'receptions/reception',
+    'service_rendered': 'services_rendered/service_rendered',
+}
+
+
+def export_queryset(entity, start=None, end=None, doctor=None):
+    """
+    Выборка entity за даты [start, end] (и одного врача) в порядке выгрузки;
+    колонки выбирает формат (values())
+    """
+    model, date_field, doctor_field = EXPORT_SOURCES[entity]
+    queryset = model.objects.all()
+    if start:
+        queryset = queryset.filter(**{f'{date_field}__gte': start})
+    if end:
+        queryset = queryset.filter(**{f'{date_field}__lte': end})
+    if doctor:
+        queryset = queryset.filter(**{f'{doctor_field}_id': doctor})
+    return queryset.order_by(date_field, 'id')
+
+
+def export_values(queryset):
+    """
+    Строки выгрузки - кортежи в порядке EXPORT_COLUMNS
+    """
+    entity = queryset.model._meta.model_name
+    return queryset.annotate(**EXPORT_EXPRESSIONS.get(entity, {})).values_list(
+        *[name for name, _ in EXPORT_COLUMNS[entity]]
+    )
+
+
+def _plain(value):
+    # Телефон (PhoneNumber) - строкой в формате E.164, даты и время - ISO 8601
+    if isinstance(value, (datetime.date, datetime.time)):
+        return value.isoformat()
+    if value is None or isinstance(value, (int, float, str)):
+        return value
+    return str(value)
+
+
+# Ячейку с таким началом Excel и LibreOffice считают формулой: ФИО или название
+# услуги "=HYPERLINK(...)" выполнилось бы у бухгалтера при открытии файла
+CSV_FORMULA_PREFIXES = ('=', '+', '-', '@', '\t', '\r')
+
+
+def _csv_cell(value):
+    # Апостроф в начале - текст, а не формула; числа (в том числе отрицательные) не меняются
+    if isinstance(value, str) and value.startswith(CSV_FORMULA_PREFIXES):
+        return "'" + value
+    return value
+
+
+class CsvExport:
+    content_type = 'text/csv; charset=utf-8'
+    extension = 'csv'
+    disposition = 'attachment'
+
+    def __init__(self, request, entity):
+        self.columns = EXPORT_COLUMNS[entity]
+
+    def values(self, queryset):
+        return export_values(queryset)
+
+    def _lines(self, rows):
+        buffer = io.StringIO()
+        writer = csv.writer(buffer)
+        writer.writerows([_csv_cell(_plain(value)) for value in row] for row in rows)
+        return buffer.getvalue()
+
+    def header(self):
+        # BOM - чтобы Excel открыл файл в UTF-8
+        return '\ufeff' + self._lines([[title for _, title in self.columns]])
+
+    def chunk(self, rows, first):
+        return self._lines(rows)
+
+    def footer(self):
+        return ''
+
+
+class JsonExport:
+    """
+    Массив объектов с ключами - именами полей из EXPORT_COLUMNS
+    """
+    content_type = 'application/json'
+    extension = 'json'
+    disposition = 'attachment'
+
+    def __init__(self, request, entity):
+        self.names = [name for name, _ in EXPORT_COLUMNS[entity]]
+
+    def values(self, queryset):
+        return export_values(queryset)
+
+    def header(self):
+        return '['
+
+    def chunk(self, rows, first):
+        objects = (
+            json.dumps(dict(zip(self.names, map(_plain, row))), ensure_ascii=False, cls=DjangoJSONEncoder)
+            for row in rows
+        )
+        return ('\n' if first else ',\n') + ',\n'.join(objects)
+
+    def footer(self):
+        return '\n]\n'
+
+
+class HtmlExport:
+    """
+    Страница с таблицей для печати. Шаблон export/print.html отрисовывается
+    один раз с меткой на месте строк и делится по ней на начало и конец
+    страницы. Колонки и оформление - как у таблицы списка: заголовок
+    включается из *_head.html, строки выбираются list_values() и
+    отрисовываются шаблоном *_row.html. Кэш строк (fragments.py) не
+    используется: выгрузка читается один раз, а ее строки вытеснили бы
+    из кэша строки списков
+    """
+    content_type = 'text/html; charset=utf-8'
+    extension = 'html'
+    disposition = 'inline'
+    ROWS_MARKER = '<!-- rows -->'
+
+    def __init__(self, request, entity):
+        self.request = request
+        self.entity = entity
+        self.model = EXPORT_SOURCES[entity][0]
+        self.template = PRINT_TEMPLATES[entity]
+        self.tail = ''
+
+    def values(self, queryset):
+        return list_values(queryset, ())
+
+    def header(self):
+        # Без request: начало страницы уходит клиенту, не дожидаясь чтения сессии и прав из БД
+        page = render_to_string('export/print.html', {
+            'title': self.model._meta.verbose_name_plural,
+            'head_template': f'{self.template}_head.html',
+            'rows': mark_safe(self.ROWS_MARKER),
+        })
+        head, self.tail = page.split(self.ROWS_MARKER)
+        return head
+
+    def chunk(self, rows, first):
+        template = get_template(f'{self.template}_row.html').template
+        context = make_context({'printing': True}, self.request)
+        rendered = []
+        with template_timer(), context.bind_template(template):
+            for row in rows:
+                with context.push({self.entity: row}):
+                    rendered.append(template.render(context))
+        return '\n'.join(rendered) + '\n'
+
+    def footer(self):
+        return self.tail
+
+
+EXPORT_FORMATS = {
+    'csv': CsvExport,
+    'json': JsonExport,
+    'html': HtmlExport,
+}
+
+
+def export_chunks(queryset, export):
+    """
+    Текст выгрузки порциями: заголовок, по одной порции на EXPORT_CHUNK_SIZE строк, окончание
+    """
+    yield export.header()
+    rows = queryset.iterator(chunk_size=EXPORT_CHUNK_SIZE)
+    first = True
+    while batch := list(islice(rows, EXPORT_CHUNK_SIZE)):
+        yield export.chunk(batch, first)
+        first = False
+    yield export.footer()
+
+
+async def aexport_chunks(queryset, export):
+    """
+    export_chunks() для ASGI: синхронный итератор StreamingHttpResponse
+    Django 4.2 под ASGI сначала прочитал бы целиком. Порции читаются из того же
+    серверного курсора в потоке (QuerySet.aiterator() в Django 4.2 выполняет
+    запрос values_list() прямо в цикле событий).
+    """
+    rows = queryset.iterator(chunk_size=EXPORT_CHUNK_SIZE)
+    next_batch = sync_to_async(lambda: list(islice(rows, EXPORT_CHUNK_SIZE)))
+    yield export.header()
+    first = True
+    while batch := await next_batch():
+        # Порция таблицы для печати собирается заметное время - не в цикле событий
+        yield await sync_to_async(export.chunk)(batch, first)
+        first = False
+    yield export.footer()
+
+
+GZIP_ACCEPTED = re.compile(r'\bgzip\b')
+
+
+def accepts_gzip(request):
+    return EXPORT_GZIP and bool(GZIP_ACCEPTED.search(request.headers.get('Accept-Encoding', '')))
+
+
+def _gzip_compressor():
+    # wbits=31 - формат gzip, а не голый zlib
+    return zlib.compressobj(EXPORT_GZIP_LEVEL, zlib.DEFLATED, 31)
+
+
+def gzip_chunks(chunks):
+    """
+    Сжатие потока по порциям: каждая порция дожимается Z_SYNC_FLUSH и
+    уходит сразу, а не копится в буфере компрессора до конца выгрузки
+    """
+    compressor = _gzip_compressor()
+    for chunk in chunks:
+        yield compressor.compress(chunk.encode()) + compressor.flush(zlib.Z_SYNC_FLUSH)
+    yield compressor.flush()
+
+
+async def agzip_chunks(chunks):
+    """
+    gzip_chunks() для асинхронного потока
+    """
+    compressor = _gzip_compressor()
+    async for chunk in chunks:
+        yield compressor.compress(chunk.encode()) + compressor.flush(zlib.Z_SYNC_FLUSH)
+    yield compressor.flush()
@@ -2,9 +2,13 @@ from django import forms
 from django.contrib.auth.forms import UserCreationForm, AuthenticationForm
 from django.contrib.auth.models import User
 from django.forms import ModelForm, TextInput, TimeInput, DateInput
+from phonenumber_field.formfields import PhoneNumberField
 
 
+from .availability import is_free
+from .catalog import CatalogChoiceField
 from .models import Doctor, Patient, Schedule, Service, Service_rendered, Reception
+from .widgets import AutocompleteSelect
 
 import re
 
@@ -150,13 +154,29 @@ class PatientForm(ModelForm):
         
         return phone_number
 
+class PatientImportForm(PatientForm):
+    """
+    Проверка строки импорта пациентов по правилам PatientForm. Уникальность
+    телефона проверяется сразу для всей порции строк (см. bulk_import.py),
+    а не запросом на каждую строку
+    """
+    def clean_phone_number(self):
+        return self.cleaned_data.get('phone_number')
+
+    def _post_clean(self):
+        # Экземпляр модели не нужен: строка идет в COPY, а поля модели
+        # повторили бы проверки полей формы (разбор телефона - самое дорогое)
+        pass
+
 class ScheduleForm(ModelForm):
     class Meta:
         model = Schedule
         fields = ["doctor", "day_week", "start_reception", "end_reception"]
         error_css_class = 'error-field'  # CSS-класс для поля с ошибкой
 
+        field_classes = {"doctor": CatalogChoiceField}
         widgets = {
+            "doctor": AutocompleteSelect('doctor_autocomplete', placeholder="Выберите врача"),
             "start_reception": TimeInput(format='%H:%M', attrs={"type": "time"}),
             "end_reception": TimeInput(format='%H:%M', attrs={"type": "time"}),
         }
@@ -170,14 +190,10 @@ class ScheduleForm(ModelForm):
                 'autocomplete': 'off'
             })
 
-        self.fields['doctor'].widget.attrs.update({
-            'class': 'form-select',
-        })
         self.fields['day_week'].widget.attrs.update({
             'class': 'form-select',
         })
 
-        self.fields['doctor'].empty_label = "Выберите врача"
         self.fields["day_week"].choices = [("", "Выберите день недели")] + list(
             self.fields["day_week"].choices
         )
@@ -207,6 +223,12 @@ class Service_renderedForm(ModelForm):
         model = Service_rendered
         fields = ["service", "quantity", "number_reception"]
 
+        field_classes = {"service": CatalogChoiceField}
+        widgets = {
+            "service": AutocompleteSelect('service_autocomplete', placeholder="Выберите услугу"),
+            "number_reception": AutocompleteSelect('reception_autocomplete', placeholder="Выберите прием"),
+        }
+
         error_css_class = 'error-field'  # CSS-класс для поля с ошибкой
 
     def __init__(self, *args, **kwargs):
@@ -218,25 +240,18 @@ class Service_renderedForm(ModelForm):
                 'autocomplete': 'off'
             })
 
-        self.fields['service'].widget.attrs.update({
-            'class': 'form-select',
-        })
-        self.fields['number_reception'].widget.attrs.update({
-            'class': 'form-select',
-        })
-
-        self.fields['service'].empty_label = "Выберите услугу"
-        self.fields['number_reception'].empty_label = "Выберите прием"
-
 class ReceptionForm(ModelForm):
     class Meta:
         model = Reception
         fields = ["date_reception", "time_reception", "doctor", "patient"]
         error_css_class = 'error-field'  # CSS-класс для поля с ошибкой
 
+        field_classes = {"doctor": CatalogChoiceField}
         widgets = {
             "date_reception": DateInput(format='%Y-%m-%d', attrs={'type': "date"}),
             "time_reception": TimeInput(format='%H:%M', attrs={"type": "time"}),
+            "doctor": AutocompleteSelect('doctor_autocomplete', placeholder="Выберите врача"),
+            "patient": AutocompleteSelect('patient_autocomplete', placeholder="Выберите пациента"),
         }
 
     def __init__(self, *args, **kwargs):
@@ -248,14 +263,41 @@ class ReceptionForm(ModelForm):
                 'autocomplete': 'off'
             })
 
-        self.fields['doctor'].widget.attrs.update({
-            'class': 'form-select',
-        })
-        self.fields['doctor'].empty_label = "Выберите врача"
+    def clean(self):
+        """
+        Прием должен целиком попадать в свободное время врача по расписанию
+        """
+        cleaned_data = super().clean()
+        doctor = cleaned_data.get('doctor')
+        date_reception = cleaned_data.get('date_reception')
+        time_reception = cleaned_data.get('time_reception')
+        # Изменение пациента у уже назначенного приема время не проверяет
+        moved = not self.instance.pk or {'doctor', 'date_reception', 'time_reception'} & set(self.changed_data)
+        if doctor and date_reception and time_reception and moved:
+            if not is_free(doctor.pk, date_reception, time_reception, exclude=self.instance.pk):
+                self.add_error('time_reception', "Врач в это время не принимает или уже занят")
+        return cleaned_data
+
+
+class ReceptionImportForm(forms.Form):
+    """
+    Строка импорта приемов: врач и пациент указываются телефонами, потому что
+    номера записей в прежней системе не совпадают с нашими
+    """
+    date_reception = forms.DateField()
+    time_reception = forms.TimeField()
+    doctor_phone = PhoneNumberField(region="RU")
+    patient_phone = PhoneNumberField(region="RU")
 
-        self.fields['patient'].widget.attrs.update({
-            'class': 'form-select',
-        })
-        self.fields['patient'].empty_label = "Выберите пациента"
 
-        
\ No newline at end of file
+class ImportForm(forms.Form):
+    """
+    Загрузка CSV-файла для импорта
+    """
+    kind = forms.ChoiceField(label="Что загружаем", choices=[("patients", "Пациенты"), ("receptions", "Приемы")])
+    file = forms.FileField(label="CSV-файл")
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.fields['kind'].widget.attrs.update({'class': 'form-select'})
+        self.fields['file'].widget.attrs.update({'class': 'form-control', 'accept': '.csv,text/csv'})
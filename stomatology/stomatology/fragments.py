@@ -0,0 +1,70 @@
+"""
+Кэш отрисованных строк таблиц.
+
+Строка <tr> каждого списка - отдельный шаблон (*_row.html). Страница
+списка, следующая страница прокрутки и строки живой доски (live.py)
+собираются из готовых строк: все ключи страницы читаются из кэша одним
+get_many, через шаблонизатор проходят только недостающие строки, и они
+записываются одним set_many. Таблица для печати (export.py) отрисовывает
+тот же шаблон строки без кэша: ее строки больше никто не читает.
+
+Ключ строки - модель, id, версия строки, права пользователя на изменение и
+удаление (от них зависят кнопки) и версия шаблона строки. Версия строки -
+хэш показываемых колонок (LIST_COLUMNS), в том числе полей связанных
+таблиц: правка через *Edit меняет ключ только у этой строки, а, например,
+переименование врача - у строк с его именем. Старые строки никто не
+читает, они вытесняются из кэша по ROW_CACHE_TIMEOUT.
+"""
+import hashlib
+
+from django.core.cache import cache
+from django.template.context import make_context
+from django.template.loader import get_template
+from django.utils.safestring import mark_safe
+
+from .instrumentation import template_timer
+from .listing import LIST_COLUMNS
+
+ROW_CACHE_TIMEOUT = 24 * 60 * 60
+
+
+def _digest(value):
+    return hashlib.blake2b(value.encode(), digest_size=8).hexdigest()
+
+
+def row_version(entity, row):
+    return _digest(repr([row[column] for column in LIST_COLUMNS[entity]]))
+
+
+def permission_flags(user, entity):
+    """
+    Права, которые проверяет шаблон строки: изменить и удалить
+    """
+    return ''.join(
+        '1' if user.has_perm(f'stomatology.{action}_{entity}') else '0' for action in ('change', 'delete')
+    )
+
+
+def render_rows(request, entity, template_name, rows, oob=''):
+    """
+    HTML строк rows (словари из list_values) по шаблону template_name, в котором
+    строка называется entity. oob - значение hx-swap-oob для живой доски
+    """
+    template = get_template(template_name).template
+    prefix = ':'.join((
+        'row', entity, _digest(template.source), permission_flags(request.user, entity), oob,
+    ))
+    keys = [f"{prefix}:{row['id']}:{row_version(entity, row)}" for row in rows]
+    fragments = cache.get_many(keys)
+    missing = {key: row for key, row in zip(keys, rows) if key not in fragments}
+    if missing:
+        # Контекст с правами и request строится один раз на все недостающие строки
+        context = make_context({'live_oob': oob}, request)
+        rendered = {}
+        with template_timer(), context.bind_template(template):
+            for key, row in missing.items():
+                with context.push({entity: row}):
+                    rendered[key] = str(template.render(context))
+        cache.set_many(rendered, ROW_CACHE_TIMEOUT)
+        fragments.update(rendered)
+    return [mark_safe(fragments[key]) for key in keys]
@@ -0,0 +1,212 @@
+"""
+Статистика SQL-запросов и отрисовки шаблонов для каждого запроса к сайту.
+
+QueryStatsMiddleware считает запросы к БД, их суммарное время, время
+отрисовки шаблонов и повторы одного и того же запроса (признак N+1).
+Итог уходит в лог stomatology.queries, а сотрудникам - и в заголовок
+Server-Timing (его показывает вкладка Network в браузере).
+"""
+import logging
+import re
+import time
+from collections import Counter
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction, sync_to_async
+from django.conf import settings
+from django.db import connections
+from django.db.backends.signals import connection_created
+from django.template import TemplateDoesNotExist
+from django.utils.functional import empty
+from django.template.backends.django import DjangoTemplates, Template, reraise
+
+logger = logging.getLogger('stomatology.queries')
+
+# Один и тот же запрос, повторенный столько раз за запрос к сайту, - вероятный N+1
+N_PLUS_ONE_THRESHOLD = 3
+
+_current = ContextVar('query_stats', default=None)
+
+# Точки сохранения atomic() - управление транзакцией, а не запрос к данным;
+# BEGIN и COMMIT psycopg2 тоже выполняет мимо execute_wrapper
+TRANSACTION_CONTROL = re.compile(r'^\s*(?:SAVEPOINT|RELEASE SAVEPOINT|ROLLBACK TO SAVEPOINT)\b', re.IGNORECASE)
+
+
+def sql_signature(sql):
+    """
+    Запрос без конкретных значений: одинаковые запросы с разными параметрами дают одну подпись
+    """
+    sql = re.sub(r"'(?:[^']|'')*'", '?', sql)
+    sql = re.sub(r'\b\d+(?:\.\d+)?\b', '?', sql)
+    sql = re.sub(r'(?:%s|\?)(?:\s*,\s*(?:%s|\?))+', '...', sql)
+    return ' '.join(sql.split())
+
+
+class QueryStats:
+    def __init__(self):
+        self.count = 0
+        self.sql_time = 0.0
+        self.template_time = 0.0
+        self.signatures = Counter()
+
+    def __call__(self, execute, sql, params, many, context):
+        # Через обертку _record проходит каждый запрос к БД
+        if TRANSACTION_CONTROL.match(sql):
+            return execute(sql, params, many, context)
+        started = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.sql_time += time.perf_counter() - started
+            self.count += 1
+            self.signatures[sql_signature(sql)] += 1
+
+    def repeated(self):
+        """
+        Запросы, повторенные не меньше N_PLUS_ONE_THRESHOLD раз, и число повторов
+        """
+        return {sql: count for sql, count in self.signatures.items() if count >= N_PLUS_ONE_THRESHOLD}
+
+
+def _record(execute, sql, params, many, context):
+    """
+    Обертка execute каждого соединения процесса: запрос учитывается в QueryStats
+    текущего запроса к сайту. Под ASGI SQL выполняется в потоках sync_to_async со
+    своими соединениями, а контекст (_current) они получают от асинхронного кода
+    """
+    stats = _current.get()
+    if stats is None:
+        return execute(sql, params, many, context)
+    return stats(execute, sql, params, many, context)
+
+
+def _install(connection, **kwargs):
+    if _record not in connection.execute_wrappers:
+        connection.execute_wrappers.append(_record)
+
+
+# Соединения, которые откроются позже (в том числе в других потоках), и уже открытые в этом потоке
+connection_created.connect(_install)
+for _connection in connections.all():
+    _install(_connection)
+
+
+def _user_loaded(request):
+    """
+    request.user уже загружен (или его нет): обращение к нему не пойдет в БД
+    """
+    user = getattr(request, 'user', None)
+    return getattr(user, '_wrapped', None) is not empty
+
+
+class QueryStatsMiddleware:
+    """
+    Работает и под WSGI, и под ASGI (async_views.py) без перехода в другой поток.
+    Server-Timing раскрывает устройство сайта, поэтому отдается только
+    сотрудникам (is_staff) и при DEBUG; лог пишется для всех запросов
+    """
+    async_capable = True
+    sync_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        stats = QueryStats()
+        token = _current.set(stats)
+        started = time.perf_counter()
+        try:
+            response = self.get_response(request)
+        finally:
+            _current.reset(token)
+        return self.report(request, response, stats, started, self.show_timing(request))
+
+    async def __acall__(self, request):
+        stats = QueryStats()
+        token = _current.set(stats)
+        started = time.perf_counter()
+        try:
+            response = await self.get_response(request)
+        finally:
+            _current.reset(token)
+        if settings.DEBUG or _user_loaded(request):
+            show_timing = self.show_timing(request)
+        else:
+            # Представление не обращалось к пользователю: его загрузка из сессии - синхронный запрос к БД
+            show_timing = await sync_to_async(self.show_timing)(request)
+        return self.report(request, response, stats, started, show_timing)
+
+    @staticmethod
+    def show_timing(request):
+        user = getattr(request, 'user', None)
+        return settings.DEBUG or (user is not None and user.is_staff)
+
+    @staticmethod
+    def report(request, response, stats, started, show_timing):
+        total = time.perf_counter() - started
+        if show_timing:
+            response['Server-Timing'] = (
+                f'db;dur={stats.sql_time * 1000:.1f};desc="{stats.count} SQL", '
+                f'tpl;dur={stats.template_time * 1000:.1f}, '
+                f'total;dur={total * 1000:.1f}'
+            )
+        response.query_stats = stats
+        logger.info(
+            "%s %s: %d SQL за %.1f мс, шаблоны %.1f мс, всего %.1f мс",
+            request.method, request.path, stats.count, stats.sql_time * 1000,
+            stats.template_time * 1000, total * 1000,
+        )
+        for sql, count in stats.repeated().items():
+            logger.warning("%s %s: возможный N+1, запрос выполнен %d раз: %s", request.method, request.path, count, sql)
+        return response
+
+
+@contextmanager
+def template_timer():
+    """
+    Учесть время блока как время отрисовки шаблонов текущего запроса
+    """
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        stats = _current.get()
+        if stats is not None:
+            stats.template_time += time.perf_counter() - started
+
+
+class InstrumentedTemplate(Template):
+    def render(self, context=None, request=None):
+        with template_timer():
+            return super().render(context, request)
+
+
+class InstrumentedTemplates(DjangoTemplates):
+    """
+    Шаблонизатор Django, который учитывает время отрисовки в QueryStats запроса
+    """
+    def from_string(self, template_code):
+        return InstrumentedTemplate(self.engine.from_string(template_code), self)
+
+    def get_template(self, template_name):
+        try:
+            return InstrumentedTemplate(self.engine.get_template(template_name), self)
+        except TemplateDoesNotExist as exc:
+            reraise(exc, self)
+
+
+def query_budget(queries, search=None):
+    """
+    Сколько SQL-запросов разрешено представлению (search - при поиске).
+    Проверяется тестами (QueryBudgetTests), для классов - атрибут query_budget
+    """
+    def decorator(view):
+        view.query_budget = queries
+        view.search_query_budget = search
+        return view
+    return decorator
@@ -0,0 +1,38 @@
+from django.db.models import Case, CharField, Value, When
+
+from .models import Schedule
+
+# Колонки, которые показывает таблица каждого списка. Поля связанных таблиц
+# приходят тем же запросом через JOIN, а не отдельным запросом на каждую строку
+LIST_COLUMNS = {
+    'doctor': ('id', 'full_name', 'phone_number', 'office_number'),
+    'patient': ('id', 'full_name', 'phone_number', 'patient_address'),
+    'schedule': ('id', 'doctor__full_name', 'day_week_display', 'start_reception', 'end_reception'),
+    'service': ('id', 'service_name', 'cost'),
+    'service_rendered': (
+        'id', 'service__service_name', 'service__cost', 'quantity',
+        'number_reception_id', 'number_reception__date_reception', 'number_reception__time_reception',
+    ),
+    'reception': ('id', 'date_reception', 'time_reception', 'doctor__full_name', 'patient__full_name'),
+}
+
+# Вычисляемые колонки: название дня недели берется из choices модели в самом запросе
+LIST_EXPRESSIONS = {
+    'schedule': {
+        'day_week_display': Case(
+            *[When(day_week=day, then=Value(name)) for day, name in Schedule.DAY_WEEK_CHOICES],
+            output_field=CharField()
+        ),
+    },
+}
+
+
+def list_values(queryset, ordering):
+    """
+    Строки списка в виде словарей только с показываемыми колонками
+    и полями сортировки, нужными для курсора страницы
+    """
+    entity = queryset.model._meta.model_name
+    columns = LIST_COLUMNS[entity]
+    keys = [name.lstrip('-') for name in ordering if name.lstrip('-') not in columns]
+    return queryset.annotate(**LIST_EXPRESSIONS.get(entity, {})).values(*columns, *keys)
@@ -0,0 +1,269 @@
+"""
+Живая доска приемов и оказанных услуг: изменения строк без перезагрузки таблицы.
+
+Триггеры (миграция 0011_live_notify) после каждой команды над reception и
+service_rendered шлют в канал LIVE_CHANNEL id измененных строк. В каждом
+воркере канал слушает одно соединение (Hub) и раздает уведомления очередям
+подписчиков - открытых потоков Server-Sent Events (views.live_rows). Под
+gevent-воркерами gunicorn (gunicorn.py) слушатель и подписчики - гринлеты:
+threading, queue и select там уже переведены на цикл событий.
+
+Поток перечитывает только изменившиеся строки и отправляет их фрагментами
+HTMX с hx-swap-oob: новые встают в начало таблицы, измененные заменяют
+строку с тем же id, удаленные убираются. Таблица с результатами поиска
+подключается к потоку со своим q: новая строка может не подходить под
+запрос, поэтому вместо нее показывается, сколько строк добавилось.
+
+Слушатель спит в select() на сокете соединения и на канале пробуждения,
+в который пишет последний отписавшийся поток; раз в LIVE_KEEPALIVE секунд
+тишины он проверяет соединение запросом.
+"""
+import json
+import os
+import queue
+import select
+import threading
+
+import psycopg2
+from django.db import connection
+from django.template.loader import render_to_string
+
+from .fragments import render_rows
+from .listing import list_values
+from .models import Reception, Service_rendered
+
+LIVE_CHANNEL = 'live_changed'
+# Пустой комментарий SSE раз в столько секунд: прокси не закрывают поток, а
+# отключившийся клиент обнаруживается при записи
+LIVE_HEARTBEAT = 15
+# Через сколько секунд без уведомлений слушатель проверяет, живо ли соединение
+LIVE_KEEPALIVE = 60
+# Сколько ждать LISTEN при подписке
+LIVE_CONNECT_TIMEOUT = 10
+# Уведомления, не забранные медленным клиентом; дальше он получает предложение обновить таблицу
+LIVE_QUEUE_SIZE = 1000
+
+# Доски: модель и шаблон строки
+LIVE_BOARDS = {
+    'reception': (Reception, 'receptions/reception_row.html'),
+    'service_rendered': (Service_rendered, 'services_rendered/service_rendered_row.html'),
+}
+
+
+class Subscriber:
+    def __init__(self):
+        self.queue = queue.Queue(LIVE_QUEUE_SIZE)
+        # Часть уведомлений потеряна: очередь переполнена или слушатель переподключался
+        self.lost = False
+
+    def wait(self, timeout):
+        """
+        Все накопившиеся уведомления; пустой список - за timeout ничего не пришло
+        """
+        try:
+            events = [self.queue.get(timeout=timeout)]
+        except queue.Empty:
+            return []
+        while True:
+            try:
+                events.append(self.queue.get_nowait())
+            except queue.Empty:
+                return events
+
+
+class Hub:
+    """
+    Слушатель LIVE_CHANNEL процесса. Работает, пока есть подписчики
+    """
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.subscribers = set()
+        self.thread = None
+        self.pid = None
+        self.listening = threading.Event()
+        # Канал (os.pipe), которым отписка будит слушателя; есть, пока работает слушатель
+        self.wakeup = None
+        self.notifications = 0
+
+    def subscribe(self):
+        subscriber = Subscriber()
+        with self.lock:
+            # После fork поток родителя в этом процессе не существует
+            if self.thread is None or self.pid != os.getpid():
+                self.listening = threading.Event()
+                self.wakeup = os.pipe()
+                self.thread = threading.Thread(
+                    target=self._run, args=(connection.get_connection_params(), self.listening, self.wakeup),
+                    name='live-listener', daemon=True,
+                )
+                self.pid = os.getpid()
+                self.thread.start()
+            self.subscribers.add(subscriber)
+            listening = self.listening
+        # Изменения, сделанные до LISTEN, подписчик не увидит - ждем, пока слушатель подключится
+        listening.wait(LIVE_CONNECT_TIMEOUT)
+        return subscriber
+
+    def unsubscribe(self, subscriber):
+        with self.lock:
+            self.subscribers.discard(subscriber)
+            if not self.subscribers and self.wakeup is not None:
+                os.write(self.wakeup[1], b'.')
+
+    def publish(self, event):
+        with self.lock:
+            subscribers = list(self.subscribers)
+        for subscriber in subscribers:
+            try:
+                subscriber.queue.put_nowait(event)
+            except queue.Full:
+                subscriber.lost = True
+
+    def _lose_all(self):
+        with self.lock:
+            for subscriber in self.subscribers:
+                subscriber.lost = True
+
+    def _stop(self):
+        # Под lock: после этого отписка уже не пишет в канал пробуждения, и его можно закрыть
+        self.thread = None
+        self.wakeup = None
+
+    def _run(self, conn_params, listening, wakeup):
+        listener = None
+        try:
+            listener = psycopg2.connect(**conn_params)
+            listener.autocommit = True
+            with listener.cursor() as cursor:
+                cursor.execute(f"LISTEN {LIVE_CHANNEL}")
+            listening.set()
+            while True:
+                with self.lock:
+                    if not self.subscribers:
+                        self._stop()
+                        return
+                readable, _, _ = select.select([listener, wakeup[0]], [], [], LIVE_KEEPALIVE)
+                if wakeup[0] in readable:
+                    os.read(wakeup[0], 512)
+                if listener in readable:
+                    listener.poll()
+                    while listener.notifies:
+                        self.notifications += 1
+                        self.publish(json.loads(listener.notifies.pop(0).payload))
+                elif not readable:
+                    # Оборванное соединение молчит так же, как пустой канал
+                    with listener.cursor() as cursor:
+                        cursor.execute("SELECT 1")
+        except psycopg2.Error:
+            # Уведомления за время без слушателя пропали: следующая подписка запустит новый
+            with self.lock:
+                self._stop()
+            self._lose_all()
+            listening.set()
+        finally:
+            if listener is not None:
+                listener.close()
+            for fd in wakeup:
+                os.close(fd)
+
+    def stats(self):
+        return {
+            'listening': self.thread is not None,
+            'subscribers': len(self.subscribers),
+            'notifications': self.notifications,
+        }
+
+
+hub = Hub()
+
+
+def changes(entity, events):
+    """
+    Итог уведомлений для таблицы доски: {id: операция} и признак, что
+    изменено слишком много строк и таблицу надо перечитать целиком
+    """
+    model = LIVE_BOARDS[entity][0]
+    operations, overflow = {}, False
+    for event in events:
+        if event['table'] != model._meta.db_table:
+            continue
+        if event['ids'] is None:
+            overflow = True
+            continue
+        for pk in event['ids']:
+            # Строка, добавленная и затем измененная, для доски все еще новая
+            if event['op'] == 'UPDATE' and operations.get(pk) == 'INSERT':
+                continue
+            operations[pk] = event['op']
+    return operations, overflow
+
+
+def render_changes(request, entity, operations, overflow=False, new_rows=0):
+    """
+    Фрагмент с hx-swap-oob для измененных строк: одна выборка на все строки.
+    При overflow вместо строк - предложение обновить таблицу, new_rows - сколько
+    новых строк не показано в результатах поиска
+    """
+    if overflow:
+        return render_to_string('main/live_rows.html', {'entity': entity, 'overflow': True})
+    model, template = LIVE_BOARDS[entity]
+    changed = [pk for pk, operation in operations.items() if operation != 'DELETE']
+    rows = {
+        row['id']: row
+        for row in list_values(model.objects.filter(id__in=changed), ('id',))
+    } if changed else {}
+
+    def render(pks, oob):
+        return render_rows(request, entity, template, [rows[pk] for pk in sorted(pks, reverse=True)], oob)
+
+    inserted = [pk for pk in rows if operations[pk] == 'INSERT']
+    updated = [pk for pk in rows if operations[pk] != 'INSERT']
+    # Строки, удаленные до того, как их успели перечитать, тоже убираются
+    deleted = [pk for pk in operations if pk not in rows]
+    return render_to_string('main/live_rows.html', {
+        'entity': entity,
+        'inserted': render(inserted, ''),
+        'updated': render(updated, 'outerHTML'),
+        'deleted': deleted,
+        'new_rows': new_rows,
+        'q': request.GET.get('q', ''),
+    })
+
+
+def sse_event(name, data):
+    lines = ''.join(f'data: {line}\n' for line in data.splitlines() or [''])
+    return f'event: {name}\n{lines}\n'
+
+
+def stream(request, entity):
+    """
+    Поток SSE доски entity: события rows с фрагментами строк.
+    Для таблицы с поиском (?q=) новые строки только считаются
+    """
+    search = bool(request.GET.get('q'))
+    new_rows = 0
+    subscriber = hub.subscribe()
+    try:
+        yield 'retry: 3000\n\n'
+        while True:
+            events = subscriber.wait(LIVE_HEARTBEAT)
+            if subscriber.lost:
+                # Клиент переподключится сам, а пропущенные изменения покажет обновление таблицы
+                yield sse_event('rows', render_changes(request, entity, {}, overflow=True))
+                return
+            if not events:
+                yield ': ping\n\n'
+                continue
+            operations, overflow = changes(entity, events)
+            inserted = []
+            if search:
+                inserted = [pk for pk, operation in operations.items() if operation == 'INSERT']
+                for pk in inserted:
+                    del operations[pk]
+                new_rows += len(inserted)
+            if operations or overflow or inserted:
+                yield sse_event('rows', render_changes(request, entity, operations, overflow, new_rows))
+                # Поток открыт часами: соединение с БД возвращается в пул сразу после выборки
+                connection.close()
+    finally:
+        hub.unsubscribe(subscriber)
@@ -0,0 +1,153 @@
+import datetime
+import random
+import statistics
+import threading
+import time
+
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, connections
+from django.test import Client, override_settings
+from django.urls import reverse
+
+from stomatology.models import RECEPTION_DURATION, Doctor, Patient, Reception, Schedule
+
+BENCH_SETTINGS = {
+    'ALLOWED_HOSTS': ['testserver'],
+}
+
+# Пересекающиеся приемы врачей нагрузочного теста: после прогона их быть не должно
+OVERLAPS_SQL = """
+    SELECT count(*)
+    FROM reception a
+    JOIN reception b ON a.doctor_id = b.doctor_id AND a.id < b.id
+    WHERE a.doctor_id = ANY(%s)
+      AND tsrange(a.date_reception + a.time_reception, a.date_reception + a.time_reception + %s * interval '1 minute')
+       && tsrange(b.date_reception + b.time_reception, b.date_reception + b.time_reception + %s * interval '1 minute')
+"""
+
+
+class Command(BaseCommand):
+    help = (
+        "Нагрузочная проверка записи на прием: несколько регистратур одновременно "
+        "записывают пациентов к немногим врачам через форму ReceptionAdd, "
+        "после прогона в БД не должно быть пересекающихся приемов"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--concurrency', type=int, default=8, help="Сколько регистратур записывают одновременно")
+        parser.add_argument('--bookings', type=int, default=50, help="Сколько попыток записи делает каждая")
+        parser.add_argument('--doctors', type=int, default=3, help="Среди скольких врачей выбирается время")
+        parser.add_argument('--days', type=int, default=2, help="На сколько дней открыта запись")
+
+    def setup(self, doctors, days):
+        """
+        Врачи с расписанием 9:00-18:00 на каждый день, пациент и пользователь для записи.
+        Неделя записи - через десять лет, чтобы не задеть настоящие приемы
+        """
+        today = datetime.date.today()
+        first_day = today + datetime.timedelta(days=7 - today.weekday() + 7 * 52 * 10)
+        stamp = time.time_ns()
+        user = User.objects.create_superuser(f'bench_booking_{stamp}', password=str(stamp))
+        patient = Patient.objects.create(
+            full_name='Нагрузочный Тест Пациент', phone_number='+79690000000', patient_address='-'
+        )
+        doctors = Doctor.objects.bulk_create(
+            Doctor(full_name=f'Нагрузочный Тест Врач{i}', phone_number=f'+7969{i:07d}', office_number='0')
+            for i in range(1, doctors + 1)
+        )
+        Schedule.objects.bulk_create(
+            Schedule(
+                doctor=doctor, day_week=(first_day + datetime.timedelta(days=day)).isoweekday(),
+                start_reception=datetime.time(9, 0), end_reception=datetime.time(18, 0),
+            )
+            for doctor in doctors for day in range(min(days, 7))
+        )
+        return user, patient, doctors, [first_day + datetime.timedelta(days=day) for day in range(days)]
+
+    def cleanup(self, user, patient, doctors):
+        Reception.objects.filter(doctor__in=doctors).delete()
+        Schedule.objects.filter(doctor__in=doctors).delete()
+        Doctor.objects.filter(id__in=[doctor.id for doctor in doctors]).delete()
+        patient.delete()
+        user.delete()
+
+    def run(self, cookies, patient, doctors, days, concurrency, bookings):
+        """
+        Ответы (код, отклонено ли ограничением в БД, время ответа) всех попыток записи и общее время прогона
+        """
+        barrier = threading.Barrier(concurrency)
+        results = []
+        # Время на сетке 15 минут при приеме 30 минут: соседние попытки часто пересекаются
+        times = [datetime.time(9 + minute // 60, minute % 60) for minute in range(0, 9 * 60 - 30 + 1, 15)]
+
+        def desk(seed):
+            rnd = random.Random(seed)
+            client = Client()
+            client.cookies = cookies
+            url = reverse('reception_add')
+            try:
+                barrier.wait()
+                for _ in range(bookings):
+                    data = {
+                        'date_reception': rnd.choice(days).isoformat(),
+                        'time_reception': rnd.choice(times).strftime('%H:%M'),
+                        'doctor': rnd.choice(doctors).id,
+                        'patient': patient.id,
+                    }
+                    started = time.perf_counter()
+                    response = client.post(url, data)
+                    # Ошибку "уже занят" без "не принимает" дает ограничение в БД, а не проверка формы
+                    text = response.content.decode()
+                    race = 'Врач в это время уже занят' in text and 'не принимает' not in text
+                    results.append((response.status_code, race, time.perf_counter() - started))
+            finally:
+                connections.close_all()
+
+        threads = [threading.Thread(target=desk, args=(seed,)) for seed in range(concurrency)]
+        started = time.perf_counter()
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        return results, time.perf_counter() - started
+
+    def handle(self, *args, **options):
+        user, patient, doctors, days = self.setup(options['doctors'], options['days'])
+        try:
+            client = Client()
+            client.force_login(user)
+            with override_settings(**BENCH_SETTINGS):
+                results, elapsed = self.run(
+                    client.cookies, patient, doctors, days, options['concurrency'], options['bookings']
+                )
+            booked = Reception.objects.filter(doctor__in=doctors).count()
+            with connection.cursor() as cursor:
+                cursor.execute(
+                    OVERLAPS_SQL, [[doctor.id for doctor in doctors], RECEPTION_DURATION, RECEPTION_DURATION]
+                )
+                overlaps = cursor.fetchone()[0]
+        finally:
+            self.cleanup(user, patient, doctors)
+
+        statuses = [status for status, _, _ in results]
+        races = sum(race for _, race, _ in results)
+        latencies = sorted(latency for _, _, latency in results)
+        accepted = statuses.count(302)
+        rejected = statuses.count(200)
+        self.stdout.write(
+            f"Попыток записи: {len(results)} ({options['concurrency']} регистратур), "
+            f"врачей: {len(doctors)}, дней: {len(days)}"
+        )
+        self.stdout.write(
+            f"Записано: {accepted}, отклонено (врач занят): {rejected}, из них ограничением в БД "
+            f"после успешной проверки формы: {races}, другие ответы: {len(results) - accepted - rejected}"
+        )
+        self.stdout.write(f"Пропускная способность: {len(results) / elapsed:.1f} попыток/с за {elapsed:.2f} с")
+        self.stdout.write(
+            f"Время ответа, мс: p50 {statistics.median(latencies) * 1000:.1f}, "
+            f"p95 {latencies[int(len(latencies) * 0.95) - 1] * 1000:.1f}, max {latencies[-1] * 1000:.1f}"
+        )
+        if overlaps or booked != accepted or accepted + rejected != len(results):
+            raise CommandError(f"Нарушена корректность: пересечений {overlaps}, приемов в БД {booked}, записано {accepted}")
+        self.stdout.write(self.style.SUCCESS(f"Пересекающихся приемов нет, в БД {booked} приемов"))
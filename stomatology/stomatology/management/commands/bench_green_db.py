@@ -0,0 +1,111 @@
+import time
+
+import gevent
+import psycopg2
+import psycopg2.extensions
+from django.core.management.base import BaseCommand
+from django.db import connection
+from django.test import Client, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from psycogreen.gevent import patch_psycopg
+
+# Поиск выполняется без кэша и без ограничения времени, чтобы каждый раз шел в БД
+BENCH_SETTINGS = {
+    'CACHES': {'default': {'BACKEND': 'django.core.cache.backends.dummy.DummyCache'}},
+    'SEARCH_STATEMENT_TIMEOUT': 0,
+    'ALLOWED_HOSTS': ['testserver'],
+}
+
+
+class Command(BaseCommand):
+    help = (
+        "Сравнивает N одновременных поисков в одном процессе gevent "
+        "с блокирующим psycopg2 и с wait callback из psycogreen (как в gunicorn.py)"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--list', default='patients', help="Имя URL списка, например patients или receptions")
+        parser.add_argument('--search', default='Шубина', help="Строка поиска")
+        parser.add_argument('--concurrency', type=int, default=10, help="Сколько поисков идет одновременно")
+        parser.add_argument(
+            '--latency', type=float, default=0,
+            help="Дополнительное ожидание БД на каждый поиск в секундах (pg_sleep), как у удаленного сервера"
+        )
+
+    def capture_queries(self, list_name, search):
+        """
+        SQL, который выполняет представление списка при поиске
+        """
+        with override_settings(**BENCH_SETTINGS), CaptureQueriesContext(connection) as queries:
+            response = Client().get(reverse(list_name), {'q': search})
+        if response.status_code != 200:
+            raise RuntimeError(f"Список {list_name} ответил {response.status_code}")
+        return [query['sql'] for query in queries.captured_queries]
+
+    def run(self, queries, concurrency):
+        """
+        Время, за которое concurrency гринлетов выполнят queries, каждый в своем
+        соединении, и самая долгая пауза, на которую за это время замирал процесс
+        """
+        params = connection.get_connection_params()
+        connections = [psycopg2.connect(**params) for _ in range(concurrency)]
+        stall = 0
+        last_beat = None
+
+        def search(conn):
+            with conn.cursor() as cursor:
+                for sql in queries:
+                    cursor.execute(sql)
+
+        def heartbeat():
+            # Гринлет, которому нужно просыпаться каждые 10 мс, как другим запросам воркера
+            nonlocal stall, last_beat
+            while True:
+                last_beat = time.perf_counter()
+                gevent.sleep(0.01)
+                stall = max(stall, time.perf_counter() - last_beat - 0.01)
+
+        try:
+            pulse = gevent.spawn(heartbeat)
+            gevent.sleep(0)
+            started = time.perf_counter()
+            gevent.joinall([gevent.spawn(search, conn) for conn in connections], raise_error=True)
+            finished = time.perf_counter()
+            pulse.kill()
+            # Пауза, которая еще длилась к концу поисков
+            return finished - started, max(stall, finished - last_beat - 0.01)
+        finally:
+            for conn in connections:
+                conn.close()
+
+    def handle(self, *args, **options):
+        concurrency = options['concurrency']
+        # BEGIN/COMMIT транзакции поиска psycopg2 выполняет сам
+        queries = [
+            sql for sql in self.capture_queries(options['list'], options['search'])
+            if sql not in ('BEGIN', 'COMMIT')
+        ]
+
+        if options['latency']:
+            queries.insert(0, f"SELECT pg_sleep({options['latency']})")
+
+        psycopg2.extensions.set_wait_callback(None)
+        single, _ = self.run(queries, 1)
+        blocking, blocking_stall = self.run(queries, concurrency)
+        patch_psycopg()
+        try:
+            green, green_stall = self.run(queries, concurrency)
+        finally:
+            psycopg2.extensions.set_wait_callback(None)
+
+        self.stdout.write(f"Поиск {options['search']!r} в {options['list']}, запросов к БД: {len(queries)}")
+        self.stdout.write(f"Один поиск: {single:.3f} с")
+        self.stdout.write(f"{'':12} {concurrency} поисков, с   наибольшая пауза процесса, с")
+        self.stdout.write(f"{'блокирующий':12} {blocking:<16.3f} {blocking_stall:.3f}")
+        self.stdout.write(f"{'psycogreen':12} {green:<16.3f} {green_stall:.3f}")
+        # Сами поиски не ускоряются, если Postgres упирается в процессор,
+        # но процесс больше не замирает на время каждого запроса
+        self.stdout.write(self.style.SUCCESS(
+            f"Общее время: {blocking / green:.1f}x, пауза процесса: {blocking_stall / max(green_stall, 0.001):.0f}x"
+        ))
@@ -0,0 +1,134 @@
+import http.client
+import os
+import random
+import shutil
+import statistics
+import subprocess
+import threading
+import time
+from urllib.parse import urlencode
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from stomatology.models import Doctor, Patient
+
+SERVERS = {
+    'wsgi (gevent)': ('gunicorn.py', 'app.wsgi'),
+    'asgi (uvicorn)': ('gunicorn_asgi.py', 'app.asgi'),
+}
+
+
+class Command(BaseCommand):
+    help = (
+        "Нагрузочное сравнение поиска под gevent WSGI (gunicorn.py) и ASGI (gunicorn_asgi.py): "
+        "пользователи набирают фамилии по букве, каждое нажатие - HTMX-запрос поиска"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--users', type=int, default=20, help="Сколько пользователей печатают одновременно")
+        parser.add_argument('--words', type=int, default=5, help="Сколько фамилий набирает каждый пользователь")
+        parser.add_argument('--pause', type=float, default=0.3, help="Пауза между запросами пользователя, с")
+        parser.add_argument('--workers', type=int, default=1, help="Воркеров gunicorn у каждого сервера")
+        parser.add_argument('--port', type=int, default=8101, help="Первый из портов для серверов")
+
+    def start_server(self, config, app, port, workers):
+        gunicorn = shutil.which('gunicorn')
+        if gunicorn is None:
+            raise CommandError("gunicorn не установлен")
+        process = subprocess.Popen(
+            [gunicorn, '-c', config, app, '--bind', f'127.0.0.1:{port}', '--workers', str(workers)],
+            cwd=settings.BASE_DIR,
+            env={**os.environ, 'DJANGO_ALLOWED_HOSTS': '127.0.0.1 localhost'},
+            stdout=subprocess.DEVNULL,
+            stderr=subprocess.DEVNULL,
+        )
+        deadline = time.monotonic() + 30
+        while time.monotonic() < deadline:
+            try:
+                connection = http.client.HTTPConnection('127.0.0.1', port, timeout=5)
+                connection.request('GET', '/')
+                connection.getresponse().read()
+                return process
+            except OSError:
+                time.sleep(0.2)
+        process.terminate()
+        raise CommandError(f"Сервер {app} не запустился на порту {port}")
+
+    def typing_sessions(self, users, words):
+        """
+        Для каждого пользователя - последовательность запросов (путь, строка поиска)
+        """
+        surnames = [
+            name.split()[0]
+            for model in (Patient, Doctor)
+            for name in model.objects.order_by('?').values_list('full_name', flat=True)[:users * words]
+        ]
+        lists = {Patient: '/patients/', Doctor: '/doctors/'}
+        rnd = random.Random(0)
+        sessions = []
+        for _ in range(users):
+            requests = []
+            for surname in rnd.sample(surnames, words):
+                path = rnd.choice(list(lists.values()))
+                requests += [(path, surname[:length]) for length in range(2, len(surname) + 1)]
+            sessions.append(requests)
+        return sessions
+
+    def load(self, port, sessions, pause):
+        latencies = []
+        errors = []
+        lock = threading.Lock()
+
+        def user(requests):
+            connection = http.client.HTTPConnection('127.0.0.1', port, timeout=30)
+            for path, search in requests:
+                started = time.perf_counter()
+                try:
+                    connection.request('GET', f"{path}?{urlencode({'q': search})}", headers={'HX-Request': 'true'})
+                    response = connection.getresponse()
+                    response.read()
+                    status = response.status
+                except OSError as error:
+                    connection.close()
+                    connection = http.client.HTTPConnection('127.0.0.1', port, timeout=30)
+                    status = str(error)
+                elapsed = time.perf_counter() - started
+                with lock:
+                    if status == 200:
+                        latencies.append(elapsed)
+                    else:
+                        errors.append(status)
+                time.sleep(pause)
+
+        started = time.perf_counter()
+        threads = [threading.Thread(target=user, args=(requests,)) for requests in sessions]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        return latencies, errors, time.perf_counter() - started
+
+    def handle(self, *args, **options):
+        sessions = self.typing_sessions(options['users'], options['words'])
+        self.stdout.write(
+            f"{options['users']} пользователей, {sum(map(len, sessions))} запросов поиска, "
+            f"воркеров: {options['workers']}"
+        )
+        self.stdout.write(f"{'':16}{'запр/с':>8}{'p50, мс':>10}{'p95, мс':>10}{'p99, мс':>10}{'макс, мс':>10}  ошибки")
+        for i, (title, (config, app)) in enumerate(SERVERS.items()):
+            port = options['port'] + i
+            process = self.start_server(config, app, port, options['workers'])
+            try:
+                latencies, errors, elapsed = self.load(port, sessions, options['pause'])
+            finally:
+                process.terminate()
+                process.wait()
+            if len(latencies) < 2:
+                self.stdout.write(f"{title:16}нет успешных ответов, ошибки: {errors[:5]}")
+                continue
+            quantiles = statistics.quantiles([value * 1000 for value in latencies], n=100)
+            self.stdout.write(
+                f"{title:16}{len(latencies) / elapsed:>8.1f}{quantiles[49]:>10.0f}{quantiles[94]:>10.0f}"
+                f"{quantiles[98]:>10.0f}{max(latencies) * 1000:>10.0f}  {len(errors)}"
+            )
@@ -0,0 +1,36 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from stomatology.bulk_import import IMPORT_BATCH_SIZE, IMPORTERS, import_csv
+
+
+class Command(BaseCommand):
+    help = (
+        "Импорт пациентов или приемов из CSV-файла с заголовком. "
+        "Пациенты: full_name, phone_number, patient_address; "
+        "приемы: date_reception, time_reception, doctor_phone, patient_phone"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('kind', choices=sorted(IMPORTERS), help="Что загружаем")
+        parser.add_argument('path', help="Путь к CSV-файлу в UTF-8")
+        parser.add_argument('--batch-size', type=int, default=IMPORT_BATCH_SIZE, help="Строк в одной порции")
+        parser.add_argument('--max-errors', type=int, default=100, help="Сколько ошибок вывести (0 - все)")
+
+    def handle(self, *args, **options):
+        started = time.perf_counter()
+        # utf-8-sig: файл из Excel или из выгрузки может начинаться с BOM
+        with open(options['path'], encoding='utf-8-sig', newline='') as file:
+            result = import_csv(file, options['kind'], options['batch_size'])
+        elapsed = time.perf_counter() - started
+
+        errors = result.errors[:options['max_errors'] or None]
+        for line, message in errors:
+            self.stderr.write(f"Строка {line}: {message}")
+        if len(errors) < len(result.errors):
+            self.stderr.write(f"... и еще {len(result.errors) - len(errors)} ошибок")
+        self.stdout.write(self.style.SUCCESS(
+            f"Загружено: {result.imported}, с ошибками: {len(result.errors)}, "
+            f"за {elapsed:.1f} с ({result.imported / max(elapsed, 0.001):.0f} строк/с)"
+        ))
@@ -0,0 +1,21 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from stomatology.models import RevenueDaily, RevenueDailyService
+from stomatology.revenue import rebuild
+
+
+class Command(BaseCommand):
+    help = (
+        "Полный пересчет сводок выручки из приемов и оказанных услуг. Обычно сводки "
+        "обновляют триггеры БД, пересчет нужен, если данные правились с отключенными триггерами"
+    )
+
+    def handle(self, *args, **options):
+        started = time.perf_counter()
+        rebuild()
+        self.stdout.write(self.style.SUCCESS(
+            f"Сводки пересчитаны за {time.perf_counter() - started:.1f} с: "
+            f"{RevenueDaily.objects.count()} дней врачей, {RevenueDailyService.objects.count()} строк по услугам"
+        ))
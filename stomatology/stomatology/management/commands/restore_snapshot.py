@@ -0,0 +1,39 @@
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from stomatology.snapshot import SnapshotError, read_manifest, restore
+
+
+class Command(BaseCommand):
+    help = (
+        "Замена данных всех таблиц приложения снимком, сделанным командой snapshot. "
+        "Снимок должен быть сделан на той же миграции, что применена в базе"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', help="Каталог снимка")
+        parser.add_argument('--noinput', '--no-input', action='store_false', dest='interactive', help="Не спрашивать подтверждение")
+
+    def handle(self, *args, **options):
+        try:
+            manifest = read_manifest(options['path'])
+        except SnapshotError as error:
+            raise CommandError(error)
+        if options['interactive']:
+            answer = input(
+                f"Данные таблиц {', '.join(table['table'] for table in manifest['tables'])} будут заменены "
+                f"снимком от {manifest['created']}. Продолжить? [y/N] "
+            )
+            if answer.lower() != 'y':
+                raise CommandError("Восстановление отменено")
+
+        started = time.perf_counter()
+        try:
+            restore(options['path'])
+        except SnapshotError as error:
+            raise CommandError(error)
+        rows = sum(table['rows'] for table in manifest['tables'])
+        self.stdout.write(self.style.SUCCESS(
+            f"Восстановлено {rows} строк в {len(manifest['tables'])} таблицах за {time.perf_counter() - started:.1f} с"
+        ))
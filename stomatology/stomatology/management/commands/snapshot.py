@@ -0,0 +1,29 @@
+import os
+import time
+
+from django.core.management.base import BaseCommand
+
+from stomatology.snapshot import SNAPSHOT_COMPRESS_LEVEL, dump
+
+
+class Command(BaseCommand):
+    help = (
+        "Снимок таблиц приложения в каталог: двоичный COPY каждой таблицы, сжатый gzip, "
+        "и manifest.json. Восстанавливается командой restore_snapshot"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', help="Каталог снимка (создается, файлы в нем перезаписываются)")
+        parser.add_argument(
+            '--level', type=int, default=SNAPSHOT_COMPRESS_LEVEL, choices=range(1, 10), help="Уровень сжатия gzip"
+        )
+
+    def handle(self, *args, **options):
+        started = time.perf_counter()
+        manifest = dump(options['path'], options['level'])
+        for table in manifest['tables']:
+            size = os.path.getsize(os.path.join(options['path'], table['file']))
+            self.stdout.write(f"{table['table']}: {table['rows']} строк, {size / 1024:.0f} КБ")
+        self.stdout.write(self.style.SUCCESS(
+            f"Снимок {options['path']} (миграция {manifest['migration']}) за {time.perf_counter() - started:.1f} с"
+        ))
@@ -0,0 +1,33 @@
+# Generated by Django 4.2.30 on 2026-10-18 14:53
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('stomatology', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='doctor',
+            index=models.Index(fields=['full_name', 'id'], name='doctor_full_name_id_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='patient',
+            index=models.Index(fields=['full_name', 'id'], name='patient_full_name_id_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='reception',
+            index=models.Index(fields=['date_reception', 'id'], name='reception_date_id_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='schedule',
+            index=models.Index(fields=['day_week', 'id'], name='shedule_day_week_id_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='service',
+            index=models.Index(fields=['service_name', 'id'], name='service_name_id_idx'),
+        ),
+    ]
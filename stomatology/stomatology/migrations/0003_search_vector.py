@@ -0,0 +1,213 @@
+# Generated by Django 4.2.30 on 2026-10-18 14:54
+
+import django.contrib.postgres.indexes
+import django.contrib.postgres.search
+from django.db import migrations
+
+
+# Поисковые векторы заполняются триггерами: у Reception и Schedule в вектор
+# входят ФИО врача и пациента из связанных таблиц, поэтому GENERATED-столбец
+# здесь невозможен, а при смене ФИО векторы связанных строк пересчитываются.
+SEARCH_VECTOR_SQL = """
+CREATE FUNCTION doctor_search_vector_update() RETURNS trigger AS $$
+BEGIN
+    NEW.search_vector :=
+        setweight(to_tsvector('russian', coalesce(NEW.full_name, '')), 'A') ||
+        setweight(to_tsvector('russian', coalesce(NEW.phone_number, '')), 'B') ||
+        setweight(to_tsvector('russian', coalesce(NEW.office_number, '')), 'C');
+    RETURN NEW;
+END
+$$ LANGUAGE plpgsql;
+
+CREATE TRIGGER doctor_search_vector_trigger
+    BEFORE INSERT OR UPDATE ON doctor
+    FOR EACH ROW EXECUTE FUNCTION doctor_search_vector_update();
+
+CREATE FUNCTION patient_search_vector_update() RETURNS trigger AS $$
+BEGIN
+    NEW.search_vector :=
+        setweight(to_tsvector('russian', coalesce(NEW.full_name, '')), 'A') ||
+        setweight(to_tsvector('russian', coalesce(NEW.phone_number, '')), 'B') ||
+        setweight(to_tsvector('russian', coalesce(NEW.patient_address, '')), 'C');
+    RETURN NEW;
+END
+$$ LANGUAGE plpgsql;
+
+CREATE TRIGGER patient_search_vector_trigger
+    BEFORE INSERT OR UPDATE ON patient
+    FOR EACH ROW EXECUTE FUNCTION patient_search_vector_update();
+
+CREATE FUNCTION service_search_vector_update() RETURNS trigger AS $$
+BEGIN
+    NEW.search_vector :=
+        setweight(to_tsvector('russian', coalesce(NEW.service_name, '')), 'A') ||
+        setweight(to_tsvector('russian', coalesce(NEW.cost::text, '')), 'C');
+    RETURN NEW;
+END
+$$ LANGUAGE plpgsql;
+
+CREATE TRIGGER service_search_vector_trigger
+    BEFORE INSERT OR UPDATE ON service
+    FOR EACH ROW EXECUTE FUNCTION service_search_vector_update();
+
+CREATE FUNCTION shedule_search_vector_update() RETURNS trigger AS $$
+BEGIN
+    NEW.search_vector :=
+        setweight(to_tsvector('russian', coalesce(
+            (SELECT full_name FROM doctor WHERE id = NEW.doctor_id), '')), 'A') ||
+        setweight(to_tsvector('russian', CASE NEW.day_week
+            WHEN 1 THEN 'понедельник' WHEN 2 THEN 'вторник' WHEN 3 THEN 'среда'
+            WHEN 4 THEN 'четверг' WHEN 5 THEN 'пятница' WHEN 6 THEN 'суббота'
+            WHEN 7 THEN 'воскресенье' ELSE '' END), 'B') ||
+        setweight(to_tsvector('simple',
+            NEW.start_reception::text || ' ' || NEW.end_reception::text), 'C');
+    RETURN NEW;
+END
+$$ LANGUAGE plpgsql;
+
+CREATE TRIGGER shedule_search_vector_trigger
+    BEFORE INSERT OR UPDATE ON shedule
+    FOR EACH ROW EXECUTE FUNCTION shedule_search_vector_update();
+
+CREATE FUNCTION reception_search_vector_update() RETURNS trigger AS $$
+BEGIN
+    NEW.search_vector :=
+        setweight(to_tsvector('russian', coalesce(
+            (SELECT full_name FROM doctor WHERE id = NEW.doctor_id), '')), 'A') ||
+        setweight(to_tsvector('russian', coalesce(
+            (SELECT full_name FROM patient WHERE id = NEW.patient_id), '')), 'A') ||
+        setweight(to_tsvector('simple',
+            NEW.date_reception::text || ' ' || NEW.time_reception::text), 'C');
+    RETURN NEW;
+END
+$$ LANGUAGE plpgsql;
+
+CREATE TRIGGER reception_search_vector_trigger
+    BEFORE INSERT OR UPDATE ON reception
+    FOR EACH ROW EXECUTE FUNCTION reception_search_vector_update();
+
+CREATE FUNCTION doctor_search_vector_propagate() RETURNS trigger AS $$
+BEGIN
+    UPDATE reception SET search_vector = NULL WHERE doctor_id = NEW.id;
+    UPDATE shedule SET search_vector = NULL WHERE doctor_id = NEW.id;
+    RETURN NULL;
+END
+$$ LANGUAGE plpgsql;
+
+CREATE TRIGGER doctor_search_vector_propagate_trigger
+    AFTER UPDATE OF full_name ON doctor
+    FOR EACH ROW WHEN (OLD.full_name IS DISTINCT FROM NEW.full_name)
+    EXECUTE FUNCTION doctor_search_vector_propagate();
+
+CREATE FUNCTION patient_search_vector_propagate() RETURNS trigger AS $$
+BEGIN
+    UPDATE reception SET search_vector = NULL WHERE patient_id = NEW.id;
+    RETURN NULL;
+END
+$$ LANGUAGE plpgsql;
+
+CREATE TRIGGER patient_search_vector_propagate_trigger
+    AFTER UPDATE OF full_name ON patient
+    FOR EACH ROW WHEN (OLD.full_name IS DISTINCT FROM NEW.full_name)
+    EXECUTE FUNCTION patient_search_vector_propagate();
+
+-- Заполнение векторов у уже существующих строк
+UPDATE doctor SET search_vector = NULL;
+UPDATE patient SET search_vector = NULL;
+UPDATE service SET search_vector = NULL;
+UPDATE shedule SET search_vector = NULL;
+UPDATE reception SET search_vector = NULL;
+"""
+
+SEARCH_VECTOR_REVERSE_SQL = """
+DROP TRIGGER patient_search_vector_propagate_trigger ON patient;
+DROP FUNCTION patient_search_vector_propagate();
+DROP TRIGGER doctor_search_vector_propagate_trigger ON doctor;
+DROP FUNCTION doctor_search_vector_propagate();
+DROP TRIGGER reception_search_vector_trigger ON reception;
+DROP FUNCTION reception_search_vector_update();
+DROP TRIGGER shedule_search_vector_trigger ON shedule;
+DROP FUNCTION shedule_search_vector_update();
+DROP TRIGGER service_search_vector_trigger ON service;
+DROP FUNCTION service_search_vector_update();
+DROP TRIGGER patient_search_vector_trigger ON patient;
+DROP FUNCTION patient_search_vector_update();
+DROP TRIGGER doctor_search_vector_trigger ON doctor;
+DROP FUNCTION doctor_search_vector_update();
+"""
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('stomatology', '0002_keyset_indexes'),
+    ]
+
+    operations = [
+        migrations.RemoveIndex(
+            model_name='doctor',
+            name='doctor_full_na_2d6d79_gin',
+        ),
+        migrations.RemoveIndex(
+            model_name='patient',
+            name='patient_full_na_4a4a56_gin',
+        ),
+        migrations.RemoveIndex(
+            model_name='reception',
+            name='reception_date_re_6f0e65_gin',
+        ),
+        migrations.RemoveIndex(
+            model_name='schedule',
+            name='shedule_doctor__faff13_gin',
+        ),
+        migrations.RemoveIndex(
+            model_name='service',
+            name='service_service_11df0f_gin',
+        ),
+        migrations.AddField(
+            model_name='doctor',
+            name='search_vector',
+            field=django.contrib.postgres.search.SearchVectorField(editable=False, null=True),
+        ),
+        migrations.AddField(
+            model_name='patient',
+            name='search_vector',
+            field=django.contrib.postgres.search.SearchVectorField(editable=False, null=True),
+        ),
+        migrations.AddField(
+            model_name='reception',
+            name='search_vector',
+            field=django.contrib.postgres.search.SearchVectorField(editable=False, null=True),
+        ),
+        migrations.AddField(
+            model_name='schedule',
+            name='search_vector',
+            field=django.contrib.postgres.search.SearchVectorField(editable=False, null=True),
+        ),
+        migrations.AddField(
+            model_name='service',
+            name='search_vector',
+            field=django.contrib.postgres.search.SearchVectorField(editable=False, null=True),
+        ),
+        migrations.AddIndex(
+            model_name='doctor',
+            index=django.contrib.postgres.indexes.GinIndex(fields=['search_vector'], name='doctor_search_vector_gin'),
+        ),
+        migrations.AddIndex(
+            model_name='patient',
+            index=django.contrib.postgres.indexes.GinIndex(fields=['search_vector'], name='patient_search_vector_gin'),
+        ),
+        migrations.AddIndex(
+            model_name='reception',
+            index=django.contrib.postgres.indexes.GinIndex(fields=['search_vector'], name='reception_search_vector_gin'),
+        ),
+        migrations.AddIndex(
+            model_name='schedule',
+            index=django.contrib.postgres.indexes.GinIndex(fields=['search_vector'], name='shedule_search_vector_gin'),
+        ),
+        migrations.AddIndex(
+            model_name='service',
+            index=django.contrib.postgres.indexes.GinIndex(fields=['search_vector'], name='service_search_vector_gin'),
+        ),
+        migrations.RunSQL(SEARCH_VECTOR_SQL, SEARCH_VECTOR_REVERSE_SQL),
+    ]
@@ -0,0 +1,25 @@
+# Generated by Django 4.2.30 on 2026-10-18 15:08
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('stomatology', '0004_trigram_indexes'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='doctor',
+            index=models.Index(fields=['office_number'], name='doctor_office_number_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='reception',
+            index=models.Index(fields=['time_reception'], name='reception_time_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='service',
+            index=models.Index(fields=['cost'], name='service_cost_idx'),
+        ),
+    ]
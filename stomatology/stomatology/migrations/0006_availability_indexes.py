@@ -0,0 +1,17 @@
+# Generated by Django 4.2.30 on 2026-10-18 15:33
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('stomatology', '0005_exact_lookup_indexes'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='reception',
+            index=models.Index(fields=['doctor', 'date_reception'], name='reception_doctor_date_idx'),
+        ),
+    ]
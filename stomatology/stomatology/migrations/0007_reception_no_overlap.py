@@ -0,0 +1,22 @@
+# Generated by Django 4.2.30 on 2026-10-18 15:36
+
+import django.contrib.postgres.constraints
+from django.contrib.postgres.operations import BtreeGistExtension
+from django.db import migrations
+import stomatology.models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('stomatology', '0006_availability_indexes'),
+    ]
+
+    operations = [
+        # Равенство по doctor_id в GiST-индексе ограничения
+        BtreeGistExtension(),
+        migrations.AddConstraint(
+            model_name='reception',
+            constraint=django.contrib.postgres.constraints.ExclusionConstraint(expressions=[('doctor', '='), (stomatology.models.ReceptionPeriod('date_reception', 'time_reception', 30), '&&')], name='reception_doctor_no_overlap', violation_error_message='Врач в это время уже занят'),
+        ),
+    ]
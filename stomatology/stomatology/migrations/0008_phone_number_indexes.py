@@ -0,0 +1,21 @@
+# Generated by Django 4.2.30 on 2026-10-18 15:50
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('stomatology', '0007_reception_no_overlap'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='doctor',
+            index=models.Index(fields=['phone_number'], name='doctor_phone_number_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='patient',
+            index=models.Index(fields=['phone_number'], name='patient_phone_number_idx'),
+        ),
+    ]
@@ -0,0 +1,223 @@
+# Generated by Django 4.2.30 on 2026-10-18 16:02
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+
+# Сводки ведут триггеры на уровне команды (FOR EACH STATEMENT) с таблицами
+# переходов: одна команда - один пересчет, поэтому так же дешево обрабатываются
+# COPY импорта и массовые UPDATE. Триггер не пересчитывает строку сводки
+# целиком, а прибавляет к ней разницу, которую внесла команда: одновременные
+# изменения одного врача за один день не затирают друг друга.
+#
+# Вклад строк в сводку (врач, день, услуга, приемы, оказано раз, количество,
+# выручка) со знаком sign: у приемов - сам прием и его оказанные услуги,
+# у оказанных услуг - они сами, у услуг - выручка по их стоимости.
+RECEPTION_CONTRIBUTION = """
+    SELECT r.doctor_id, r.date_reception AS day, NULL::bigint AS service_id,
+           {sign} AS visits, 0 AS rendered, 0 AS quantity, 0::numeric AS revenue
+    FROM {rows} r WHERE r.doctor_id IS NOT NULL
+    UNION ALL
+    SELECT r.doctor_id, r.date_reception, sr.service_id,
+           0, {sign}, {sign} * sr.quantity, {sign} * round((s.cost * sr.quantity)::numeric, 2)
+    FROM {rows} r
+    JOIN service_rendered sr ON sr.number_reception_id = r.id
+    JOIN service s ON s.id = sr.service_id
+    WHERE r.doctor_id IS NOT NULL
+"""
+SERVICE_RENDERED_CONTRIBUTION = """
+    SELECT r.doctor_id, r.date_reception, sr.service_id,
+           0, {sign}, {sign} * sr.quantity, {sign} * round((s.cost * sr.quantity)::numeric, 2)
+    FROM {rows} sr
+    JOIN reception r ON r.id = sr.number_reception_id
+    JOIN service s ON s.id = sr.service_id
+    WHERE r.doctor_id IS NOT NULL
+"""
+SERVICE_CONTRIBUTION = """
+    SELECT r.doctor_id, r.date_reception, sr.service_id,
+           0, 0, 0, {sign} * round((s.cost * sr.quantity)::numeric, 2)
+    FROM {rows} s
+    JOIN service_rendered sr ON sr.service_id = s.id
+    JOIN reception r ON r.id = sr.number_reception_id
+    WHERE r.doctor_id IS NOT NULL
+"""
+
+# Разница, внесенная командой, прибавляется к сводкам; обнулившиеся строки удаляются
+APPLY_DELTA = """
+        WITH contribution (doctor_id, day, service_id, visits, rendered, quantity, revenue) AS ({contribution}),
+        delta AS (
+            SELECT doctor_id, day, service_id, sum(visits) AS visits, sum(rendered) AS rendered,
+                   sum(quantity) AS quantity, sum(revenue) AS revenue
+            FROM contribution GROUP BY doctor_id, day, service_id
+        ),
+        daily AS (
+            INSERT INTO revenue_daily AS summary (doctor_id, day, visits, revenue)
+            SELECT doctor_id, day, sum(visits), sum(revenue) FROM delta GROUP BY doctor_id, day
+            HAVING sum(visits) <> 0 OR sum(revenue) <> 0
+            ON CONFLICT (doctor_id, day) DO UPDATE
+            SET visits = summary.visits + EXCLUDED.visits, revenue = summary.revenue + EXCLUDED.revenue
+        )
+        INSERT INTO revenue_daily_service AS summary (doctor_id, day, service_id, rendered, quantity, revenue)
+        SELECT doctor_id, day, service_id, rendered, quantity, revenue FROM delta
+        WHERE service_id IS NOT NULL AND (rendered <> 0 OR quantity <> 0 OR revenue <> 0)
+        ON CONFLICT (doctor_id, day, service_id) DO UPDATE
+        SET rendered = summary.rendered + EXCLUDED.rendered, quantity = summary.quantity + EXCLUDED.quantity,
+            revenue = summary.revenue + EXCLUDED.revenue;
+        DELETE FROM revenue_daily WHERE visits = 0;
+        DELETE FROM revenue_daily_service WHERE rendered = 0;
+"""
+
+
+def trigger_function(table, contribution, events):
+    """
+    Функция и триггеры, которые переносят изменения table в сводки
+    """
+    def apply(*sources):
+        return APPLY_DELTA.format(contribution=' UNION ALL '.join(
+            contribution.format(rows=rows, sign=sign) for rows, sign in sources
+        ))
+
+    branches = {
+        'INSERT': apply(('new_rows', 1)),
+        'UPDATE': apply(('new_rows', 1), ('old_rows', -1)),
+        'DELETE': apply(('old_rows', -1)),
+    }
+    referencing = {
+        'INSERT': 'NEW TABLE AS new_rows',
+        'UPDATE': 'OLD TABLE AS old_rows NEW TABLE AS new_rows',
+        'DELETE': 'OLD TABLE AS old_rows',
+    }
+    body = '\n    ELS'.join(f"IF TG_OP = '{event}' THEN{branches[event]}" for event in events)
+    sql = f"""
+CREATE FUNCTION revenue_{table}_changed() RETURNS trigger AS $$
+BEGIN
+    {body}
+    END IF;
+    RETURN NULL;
+END
+$$ LANGUAGE plpgsql;
+"""
+    for event in events:
+        sql += f"""
+CREATE TRIGGER revenue_{table}_{event.lower()}
+    AFTER {event} ON {table} REFERENCING {referencing[event]}
+    FOR EACH STATEMENT EXECUTE FUNCTION revenue_{table}_changed();
+"""
+    return sql
+
+
+# Полный пересчет сводок из приемов и оказанных услуг: заполнение при миграции
+# и восстановление сводок командой rebuild_revenue_summary
+REVENUE_REBUILD_SQL = """
+CREATE FUNCTION revenue_rebuild() RETURNS void AS $$
+BEGIN
+    -- Пока сводки пересчитываются, приемы и услуги не меняются
+    LOCK TABLE reception, service_rendered, service IN SHARE MODE;
+    DELETE FROM revenue_daily;
+    DELETE FROM revenue_daily_service;
+    INSERT INTO revenue_daily (doctor_id, day, visits, revenue)
+    SELECT r.doctor_id, r.date_reception, count(*), coalesce(sum(rendered.revenue), 0)
+    FROM reception r
+    LEFT JOIN (
+        SELECT sr.number_reception_id, sum(round((s.cost * sr.quantity)::numeric, 2)) AS revenue
+        FROM service_rendered sr JOIN service s ON s.id = sr.service_id
+        GROUP BY sr.number_reception_id
+    ) rendered ON rendered.number_reception_id = r.id
+    WHERE r.doctor_id IS NOT NULL
+    GROUP BY r.doctor_id, r.date_reception;
+    INSERT INTO revenue_daily_service (doctor_id, day, service_id, rendered, quantity, revenue)
+    SELECT r.doctor_id, r.date_reception, sr.service_id, count(*), sum(sr.quantity),
+           sum(round((s.cost * sr.quantity)::numeric, 2))
+    FROM service_rendered sr
+    JOIN reception r ON r.id = sr.number_reception_id
+    JOIN service s ON s.id = sr.service_id
+    WHERE r.doctor_id IS NOT NULL
+    GROUP BY r.doctor_id, r.date_reception, sr.service_id;
+END
+$$ LANGUAGE plpgsql;
+"""
+
+REVENUE_TRIGGERS_SQL = (
+    REVENUE_REBUILD_SQL
+    + trigger_function('reception', RECEPTION_CONTRIBUTION, ('INSERT', 'UPDATE', 'DELETE'))
+    + trigger_function('service_rendered', SERVICE_RENDERED_CONTRIBUTION, ('INSERT', 'UPDATE', 'DELETE'))
+    # Новая услуга еще нигде не оказана, а перед удалением услуги Django
+    # отвязывает от нее оказанные услуги (SET_NULL): важна только смена стоимости
+    + trigger_function('service', SERVICE_CONTRIBUTION, ('UPDATE',))
+    + "\nSELECT revenue_rebuild();\n"
+)
+
+REVENUE_TRIGGERS_REVERSE_SQL = """
+DROP TRIGGER revenue_service_update ON service;
+DROP FUNCTION revenue_service_changed();
+DROP TRIGGER revenue_service_rendered_insert ON service_rendered;
+DROP TRIGGER revenue_service_rendered_update ON service_rendered;
+DROP TRIGGER revenue_service_rendered_delete ON service_rendered;
+DROP FUNCTION revenue_service_rendered_changed();
+DROP TRIGGER revenue_reception_insert ON reception;
+DROP TRIGGER revenue_reception_update ON reception;
+DROP TRIGGER revenue_reception_delete ON reception;
+DROP FUNCTION revenue_reception_changed();
+DROP FUNCTION revenue_rebuild();
+"""
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('stomatology', '0008_phone_number_indexes'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='RevenueDaily',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('day', models.DateField(verbose_name='Дата')),
+                ('visits', models.IntegerField(default=0, verbose_name='Приемов')),
+                ('revenue', models.DecimalField(decimal_places=2, default=0, max_digits=14, verbose_name='Выручка')),
+                ('doctor', models.ForeignKey(db_constraint=False, on_delete=django.db.models.deletion.DO_NOTHING, related_name='+', to='stomatology.doctor', verbose_name='Врач')),
+            ],
+            options={
+                'verbose_name': 'Выручку за день',
+                'verbose_name_plural': 'Выручка по дням',
+                'db_table': 'revenue_daily',
+            },
+        ),
+        migrations.CreateModel(
+            name='RevenueDailyService',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('day', models.DateField(verbose_name='Дата')),
+                ('rendered', models.IntegerField(default=0, verbose_name='Оказано раз')),
+                ('quantity', models.IntegerField(default=0, verbose_name='Количество')),
+                ('revenue', models.DecimalField(decimal_places=2, default=0, max_digits=14, verbose_name='Выручка')),
+                ('doctor', models.ForeignKey(db_constraint=False, on_delete=django.db.models.deletion.DO_NOTHING, related_name='+', to='stomatology.doctor', verbose_name='Врач')),
+                ('service', models.ForeignKey(db_constraint=False, on_delete=django.db.models.deletion.DO_NOTHING, related_name='+', to='stomatology.service', verbose_name='Услуга')),
+            ],
+            options={
+                'verbose_name': 'Услуги за день',
+                'verbose_name_plural': 'Услуги по дням',
+                'db_table': 'revenue_daily_service',
+                'indexes': [models.Index(fields=['day', 'doctor'], name='revenue_service_day_idx'), models.Index(condition=models.Q(('rendered', 0)), fields=['id'], name='revenue_service_empty_idx')],
+            },
+        ),
+        migrations.AddConstraint(
+            model_name='revenuedailyservice',
+            constraint=models.UniqueConstraint(fields=('doctor', 'day', 'service'), name='revenue_daily_service_key'),
+        ),
+        migrations.AddIndex(
+            model_name='revenuedaily',
+            index=models.Index(fields=['day', 'doctor'], name='revenue_daily_day_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='revenuedaily',
+            index=models.Index(condition=models.Q(('visits', 0)), fields=['id'], name='revenue_daily_empty_idx'),
+        ),
+        migrations.AddConstraint(
+            model_name='revenuedaily',
+            constraint=models.UniqueConstraint(fields=('doctor', 'day'), name='revenue_daily_doctor_day'),
+        ),
+        migrations.RunSQL(REVENUE_TRIGGERS_SQL, REVENUE_TRIGGERS_REVERSE_SQL),
+    ]
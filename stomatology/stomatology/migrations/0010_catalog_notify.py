@@ -0,0 +1,43 @@
+# Generated by Django 4.2.30 on 2026-10-18 17:40
+
+from django.db import migrations
+
+
+# Любая команда над врачами или услугами, включая COPY импорта и TRUNCATE
+# восстановления из снимка, шлет в канал catalog_changed имя таблицы.
+# Postgres доставляет уведомление слушателям только после фиксации
+# транзакции и склеивает одинаковые уведомления одной транзакции, поэтому
+# массовое изменение дает один сброс справочника в каждом воркере (см. catalog.py).
+CATALOG_NOTIFY_SQL = """
+CREATE FUNCTION catalog_notify() RETURNS trigger LANGUAGE plpgsql AS $$
+BEGIN
+    PERFORM pg_notify('catalog_changed', TG_TABLE_NAME);
+    RETURN NULL;
+END;
+$$;
+
+CREATE TRIGGER catalog_doctor_changed
+AFTER INSERT OR UPDATE OR DELETE OR TRUNCATE ON doctor
+FOR EACH STATEMENT EXECUTE FUNCTION catalog_notify();
+
+CREATE TRIGGER catalog_service_changed
+AFTER INSERT OR UPDATE OR DELETE OR TRUNCATE ON service
+FOR EACH STATEMENT EXECUTE FUNCTION catalog_notify();
+"""
+
+CATALOG_NOTIFY_REVERSE_SQL = """
+DROP TRIGGER catalog_service_changed ON service;
+DROP TRIGGER catalog_doctor_changed ON doctor;
+DROP FUNCTION catalog_notify();
+"""
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('stomatology', '0009_revenue_summary'),
+    ]
+
+    operations = [
+        migrations.RunSQL(CATALOG_NOTIFY_SQL, CATALOG_NOTIFY_REVERSE_SQL),
+    ]
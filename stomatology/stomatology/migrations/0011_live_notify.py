@@ -0,0 +1,63 @@
+# Generated by Django 4.2.30 on 2026-10-18 18:30
+
+from django.db import migrations
+
+
+# Каждая команда над приемами и оказанными услугами шлет в канал
+# live_changed JSON {"table", "op", "ids"} с id затронутых строк из таблиц
+# переходов. Уведомление не длиннее 8000 байт, поэтому при изменении больше
+# 500 строк (импорт, массовое удаление) ids = null: доска предлагает
+# обновить таблицу целиком (см. live.py).
+LIVE_NOTIFY_SQL = """
+CREATE FUNCTION live_notify() RETURNS trigger LANGUAGE plpgsql AS $$
+DECLARE
+    ids bigint[];
+BEGIN
+    IF TG_OP = 'DELETE' THEN
+        SELECT array_agg(id) INTO ids FROM (SELECT id FROM old_rows LIMIT 501) changed;
+    ELSE
+        SELECT array_agg(id) INTO ids FROM (SELECT id FROM new_rows LIMIT 501) changed;
+    END IF;
+    IF ids IS NOT NULL THEN
+        PERFORM pg_notify('live_changed', json_build_object(
+            'table', TG_TABLE_NAME,
+            'op', TG_OP,
+            'ids', CASE WHEN cardinality(ids) > 500 THEN NULL ELSE ids END
+        )::text);
+    END IF;
+    RETURN NULL;
+END;
+$$;
+"""
+
+LIVE_TRIGGER_SQL = """
+CREATE TRIGGER live_{table}_insert AFTER INSERT ON {table}
+REFERENCING NEW TABLE AS new_rows FOR EACH STATEMENT EXECUTE FUNCTION live_notify();
+CREATE TRIGGER live_{table}_update AFTER UPDATE ON {table}
+REFERENCING NEW TABLE AS new_rows FOR EACH STATEMENT EXECUTE FUNCTION live_notify();
+CREATE TRIGGER live_{table}_delete AFTER DELETE ON {table}
+REFERENCING OLD TABLE AS old_rows FOR EACH STATEMENT EXECUTE FUNCTION live_notify();
+"""
+
+LIVE_TRIGGER_REVERSE_SQL = """
+DROP TRIGGER live_{table}_insert ON {table};
+DROP TRIGGER live_{table}_update ON {table};
+DROP TRIGGER live_{table}_delete ON {table};
+"""
+
+LIVE_TABLES = ('reception', 'service_rendered')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('stomatology', '0010_catalog_notify'),
+    ]
+
+    operations = [
+        migrations.RunSQL(
+            LIVE_NOTIFY_SQL + ''.join(LIVE_TRIGGER_SQL.format(table=table) for table in LIVE_TABLES),
+            ''.join(LIVE_TRIGGER_REVERSE_SQL.format(table=table) for table in LIVE_TABLES)
+            + "DROP FUNCTION live_notify();",
+        ),
+    ]
@@ -1,18 +1,31 @@
+import datetime
+
 from django.db import models
 from phonenumber_field.modelfields import PhoneNumberField
-from django.contrib.postgres.indexes import GinIndex
+from django.db.models.expressions import CombinedExpression
+from django.db.models.functions import Upper
+from django.contrib.postgres.constraints import ExclusionConstraint
+from django.contrib.postgres.fields import DateTimeRangeField, RangeOperators
+from django.contrib.postgres.indexes import GinIndex, OpClass
+from django.contrib.postgres.search import SearchVectorField
 
 class Doctor(models.Model):
     full_name = models.CharField("ФИО", max_length=100)
     phone_number = PhoneNumberField("Номер телефона", region="RU")
     office_number = models.CharField("Номер кабинета", max_length=10)
+    search_vector = SearchVectorField(null=True, editable=False)
 
     class Meta:
         db_table = 'doctor'
         verbose_name = 'Врача'
         verbose_name_plural = 'Врачи'
         indexes = [
-            GinIndex(fields=['full_name', 'phone_number', 'office_number']),
+            GinIndex(fields=['search_vector'], name='doctor_search_vector_gin'),
+            GinIndex(fields=['full_name'], opclasses=['gin_trgm_ops'], name='doctor_full_name_trgm'),
+            GinIndex(fields=['phone_number'], opclasses=['gin_trgm_ops'], name='doctor_phone_number_trgm'),
+            models.Index(fields=['full_name', 'id'], name='doctor_full_name_id_idx'),
+            models.Index(fields=['office_number'], name='doctor_office_number_idx'),
+            models.Index(fields=['phone_number'], name='doctor_phone_number_idx'),
         ]
 
     def __str__(self):
@@ -22,23 +35,54 @@ class Patient(models.Model):
     full_name = models.CharField("ФИО", max_length=100)
     phone_number = PhoneNumberField("Номер телефона", region="RU")
     patient_address = models.CharField("Адрес проживания", max_length=100)
+    search_vector = SearchVectorField(null=True, editable=False)
 
     class Meta:
         db_table = 'patient'
         verbose_name = 'Пациента'
         verbose_name_plural = 'Пациенты'
         indexes = [
-            GinIndex(fields=['full_name', 'phone_number', 'patient_address']),
+            GinIndex(fields=['search_vector'], name='patient_search_vector_gin'),
+            GinIndex(fields=['full_name'], opclasses=['gin_trgm_ops'], name='patient_full_name_trgm'),
+            GinIndex(fields=['phone_number'], opclasses=['gin_trgm_ops'], name='patient_phone_number_trgm'),
+            GinIndex(fields=['patient_address'], opclasses=['gin_trgm_ops'], name='patient_address_trgm'),
+            # Для icontains, который Django строит как UPPER(поле) LIKE UPPER(...)
+            GinIndex(OpClass(Upper('full_name'), name='gin_trgm_ops'), name='patient_full_name_upper_trgm'),
+            GinIndex(OpClass(Upper('phone_number'), name='gin_trgm_ops'), name='patient_phone_upper_trgm'),
+            GinIndex(OpClass(Upper('patient_address'), name='gin_trgm_ops'), name='patient_address_upper_trgm'),
+            models.Index(fields=['full_name', 'id'], name='patient_full_name_id_idx'),
+            models.Index(fields=['phone_number'], name='patient_phone_number_idx'),
         ]
 
     def __str__(self):
         return self.full_name
 
+# Длительность одного приема в минутах: по ней считаются свободные окна врачей
+# и ограничение RECEPTION_OVERLAP_CONSTRAINT. Значение входит в миграцию
+# ограничения, поэтому задано в коде, а не в окружении: после изменения - makemigrations
+RECEPTION_DURATION = 30
+RECEPTION_OVERLAP_CONSTRAINT = 'reception_doctor_no_overlap'
+
+class ReceptionPeriod(models.Func):
+    """
+    Время приема как tsrange [дата + время, дата + время + minutes минут)
+    """
+    function = 'TSRANGE'
+    output_field = DateTimeRangeField()
+
+    def __init__(self, date, time, minutes):
+        start = CombinedExpression(models.F(date), '+', models.F(time), output_field=models.DateTimeField())
+        end = CombinedExpression(
+            start, '+', models.Value(datetime.timedelta(minutes=minutes)), output_field=models.DateTimeField()
+        )
+        super().__init__(start, end)
+
 class Reception(models.Model):
     date_reception = models.DateField("Дата")
     time_reception = models.TimeField("Время")
     patient = models.ForeignKey(Patient, on_delete=models.SET_NULL, null=True, verbose_name="Пациент")
     doctor = models.ForeignKey(Doctor, on_delete=models.SET_NULL, null=True, verbose_name="Врач")
+    search_vector = SearchVectorField(null=True, editable=False)
 
     class Meta:
         db_table = 'reception'
@@ -46,22 +90,53 @@ class Reception(models.Model):
         verbose_name_plural = 'Приемы'
         ordering = ['-id']
         indexes = [
-            GinIndex(fields=['date_reception', 'time_reception', 'patient', 'doctor']),
+            GinIndex(fields=['search_vector'], name='reception_search_vector_gin'),
+            models.Index(fields=['date_reception', 'id'], name='reception_date_id_idx'),
+            models.Index(fields=['time_reception'], name='reception_time_idx'),
+            models.Index(fields=['doctor', 'date_reception'], name='reception_doctor_date_idx'),
+        ]
+        constraints = [
+            # Два приема одного врача не пересекаются по времени. Проверяет сама БД
+            # при записи, поэтому одновременная запись с двух компьютеров не проходит
+            ExclusionConstraint(
+                name=RECEPTION_OVERLAP_CONSTRAINT,
+                expressions=[
+                    ('doctor', RangeOperators.EQUAL),
+                    (
+                        ReceptionPeriod('date_reception', 'time_reception', RECEPTION_DURATION),
+                        RangeOperators.OVERLAPS,
+                    ),
+                ],
+                violation_error_message="Врач в это время уже занят",
+            ),
         ]
 
     def __str__(self):
         return f"{str(self.id)} ({self.date_reception} {self.time_reception})"
 
+    def get_constraints(self):
+        # Пересечение приемов не проверяется отдельным запросом перед записью:
+        # он не защищает от одновременной записи, ее ловит само ограничение
+        # (см. availability.booking_conflict). Остальные ограничения проверяются как обычно
+        return [
+            (model, [constraint for constraint in constraints if constraint.name != RECEPTION_OVERLAP_CONSTRAINT])
+            for model, constraints in super().get_constraints()
+        ]
+
 class Service(models.Model):
     service_name = models.CharField("Услуга", max_length=50)
     cost = models.FloatField("Стоимость")
+    search_vector = SearchVectorField(null=True, editable=False)
 
     class Meta:
         db_table = 'service'
         verbose_name = 'Услугу'
         verbose_name_plural = 'Услуги'
         indexes = [
-            GinIndex(fields=['service_name', 'cost']),
+            GinIndex(fields=['search_vector'], name='service_search_vector_gin'),
+            GinIndex(fields=['service_name'], opclasses=['gin_trgm_ops'], name='service_name_trgm'),
+            models.Index(fields=['service_name', 'id'], name='service_name_id_idx'),
+            models.Index(fields=['cost'], name='service_cost_idx'),
         ]
 
     def __str__(self):
@@ -101,15 +176,74 @@ class Schedule(models.Model):
     day_week = models.PositiveIntegerField("День недели", choices=DAY_WEEK_CHOICES, default=0)
     start_reception = models.TimeField("Начало приема")
     end_reception = models.TimeField("Конец приема")
+    search_vector = SearchVectorField(null=True, editable=False)
 
     class Meta:
         db_table = 'shedule'
         verbose_name = 'Расписание'
         verbose_name_plural = 'Расписание работы врачей'
         indexes = [
-            GinIndex(fields=['doctor', 'day_week', 'start_reception', 'end_reception']),
+            GinIndex(fields=['search_vector'], name='shedule_search_vector_gin'),
+            models.Index(fields=['day_week', 'id'], name='shedule_day_week_id_idx'),
         ]
 
     def __str__(self):
         return f"{self.doctor} - {self.get_day_week_display()}"
-    
\ No newline at end of file
+    
+class RevenueDaily(models.Model):
+    """
+    Выручка и число приемов врача за день. Строки ведут триггеры БД
+    (миграция 0009_revenue_summary): приложение их только читает
+    """
+    doctor = models.ForeignKey(
+        Doctor, on_delete=models.DO_NOTHING, db_constraint=False, related_name='+', verbose_name="Врач"
+    )
+    day = models.DateField("Дата")
+    visits = models.IntegerField("Приемов", default=0)
+    revenue = models.DecimalField("Выручка", max_digits=14, decimal_places=2, default=0)
+
+    class Meta:
+        db_table = 'revenue_daily'
+        verbose_name = 'Выручку за день'
+        verbose_name_plural = 'Выручка по дням'
+        constraints = [
+            models.UniqueConstraint(fields=['doctor', 'day'], name='revenue_daily_doctor_day'),
+        ]
+        indexes = [
+            models.Index(fields=['day', 'doctor'], name='revenue_daily_day_idx'),
+            # Строки, обнулившиеся после удаления приемов, триггер удаляет по этому индексу
+            models.Index(fields=['id'], condition=models.Q(visits=0), name='revenue_daily_empty_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.doctor_id} {self.day}: {self.revenue}"
+
+class RevenueDailyService(models.Model):
+    """
+    Услуги, оказанные врачом за день: сколько раз, в каком количестве и на какую сумму
+    """
+    doctor = models.ForeignKey(
+        Doctor, on_delete=models.DO_NOTHING, db_constraint=False, related_name='+', verbose_name="Врач"
+    )
+    day = models.DateField("Дата")
+    service = models.ForeignKey(
+        Service, on_delete=models.DO_NOTHING, db_constraint=False, related_name='+', verbose_name="Услуга"
+    )
+    rendered = models.IntegerField("Оказано раз", default=0)
+    quantity = models.IntegerField("Количество", default=0)
+    revenue = models.DecimalField("Выручка", max_digits=14, decimal_places=2, default=0)
+
+    class Meta:
+        db_table = 'revenue_daily_service'
+        verbose_name = 'Услуги за день'
+        verbose_name_plural = 'Услуги по дням'
+        constraints = [
+            models.UniqueConstraint(fields=['doctor', 'day', 'service'], name='revenue_daily_service_key'),
+        ]
+        indexes = [
+            models.Index(fields=['day', 'doctor'], name='revenue_service_day_idx'),
+            models.Index(fields=['id'], condition=models.Q(rendered=0), name='revenue_service_empty_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.doctor_id} {self.day} {self.service_id}: {self.revenue}"
@@ -0,0 +1,109 @@
+import base64
+import datetime
+import json
+
+from django.conf import settings
+from django.core.exceptions import BadRequest
+from django.db.models import Q
+
+
+class KeysetPage:
+    """
+    Страница списка, выбранная по курсору (keyset), а не по OFFSET
+    """
+    def __init__(self, object_list, next_cursor):
+        self.object_list = object_list
+        self.next_cursor = next_cursor
+
+    @property
+    def has_next(self):
+        return self.next_cursor is not None
+
+
+def _value(obj, field):
+    if isinstance(obj, dict):
+        return obj[field]
+    return getattr(obj, field)
+
+
+def _to_json(value):
+    if isinstance(value, (datetime.date, datetime.time, datetime.datetime)):
+        return value.isoformat()
+    return value
+
+
+def encode_cursor(values):
+    data = json.dumps([_to_json(v) for v in values], ensure_ascii=False, separators=(',', ':'))
+    return base64.urlsafe_b64encode(data.encode()).decode().rstrip('=')
+
+
+def decode_cursor(cursor, length):
+    try:
+        data = base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4))
+        values = json.loads(data)
+    except (ValueError, TypeError):
+        raise BadRequest("Некорректный курсор страницы")
+    if not isinstance(values, list) or len(values) != length:
+        raise BadRequest("Некорректный курсор страницы")
+    # Колонки сортировки списков NOT NULL: null или вложенная структура в курсоре - подделка,
+    # а в фильтре (поле__lte=None) привела бы к ошибке 500
+    if not all(isinstance(value, (str, int, float)) and not isinstance(value, bool) for value in values):
+        raise BadRequest("Некорректный курсор страницы")
+    return values
+
+
+def keyset_filter(ordering, values):
+    """
+    Условие "строка идет после (values)" для сортировки ordering.
+
+    (a, b) > (x, y) раскрывается в a >= x AND (a > x OR (a = x AND b > y)):
+    первое слагаемое дает Postgres диапазон для индекса по (a, b).
+    """
+    fields = [(name.lstrip('-'), name.startswith('-')) for name in ordering]
+    condition = Q()
+    for i in range(len(fields) - 1, -1, -1):
+        name, desc = fields[i]
+        step = Q(**{f"{name}__{'lt' if desc else 'gt'}": values[i]})
+        if i < len(fields) - 1:
+            step |= Q(**{name: values[i]}) & condition
+        condition = step
+    name, desc = fields[0]
+    return Q(**{f"{name}__{'lte' if desc else 'gte'}": values[0]}) & condition
+
+
+def _keyset_queryset(queryset, ordering, cursor):
+    queryset = queryset.order_by(*ordering)
+    if cursor:
+        queryset = queryset.filter(keyset_filter(ordering, decode_cursor(cursor, len(ordering))))
+    return queryset
+
+
+def _keyset_result(object_list, ordering, size):
+    next_cursor = None
+    if len(object_list) > size:
+        object_list = object_list[:size]
+        last = object_list[-1]
+        next_cursor = encode_cursor([_value(last, name.lstrip('-')) for name in ordering])
+    return KeysetPage(object_list, next_cursor)
+
+
+def keyset_page(queryset, ordering, cursor=None, size=None):
+    """
+    Возвращает одну страницу queryset, отсортированного по ordering.
+
+    ordering должен заканчиваться уникальным полем (id), чтобы курсор
+    однозначно указывал на строку.
+    """
+    size = size or settings.LIST_PAGE_SIZE
+    # Берем на одну строку больше, чтобы узнать, есть ли следующая страница
+    object_list = list(_keyset_queryset(queryset, ordering, cursor)[:size + 1])
+    return _keyset_result(object_list, ordering, size)
+
+
+async def akeyset_page(queryset, ordering, cursor=None, size=None):
+    """
+    keyset_page() через асинхронный ORM
+    """
+    size = size or settings.LIST_PAGE_SIZE
+    object_list = [obj async for obj in _keyset_queryset(queryset, ordering, cursor)[:size + 1]]
+    return _keyset_result(object_list, ordering, size)
@@ -0,0 +1,48 @@
+"""
+Выручка врачей по дням.
+
+Отчет читает только сводки RevenueDaily и RevenueDailyService, а не приемы
+с оказанными услугами за всю историю. Сводки обновляют триггеры БД при
+каждом изменении приемов, оказанных услуг и стоимости услуг (миграция
+0009_revenue_summary), в том числе при импорте через COPY.
+"""
+from django.db import connection, transaction
+from django.db.models import Sum
+
+from .models import RevenueDaily, RevenueDailyService
+
+# Самый длинный период отчета
+REVENUE_MAX_DAYS = 366
+
+
+def rebuild():
+    """
+    Полный пересчет сводок из приемов и оказанных услуг. Нужен, только если
+    сводки разошлись с данными, например после ручной правки таблиц с отключенными триггерами
+    """
+    with transaction.atomic(), connection.cursor() as cursor:
+        cursor.execute("SELECT revenue_rebuild()")
+
+
+def revenue_report(start, end, doctor=None):
+    """
+    Итоги за даты [start, end] по врачам, по дням и по услугам каждого врача
+    """
+    daily = RevenueDaily.objects.filter(day__range=(start, end))
+    services = RevenueDailyService.objects.filter(day__range=(start, end))
+    if doctor:
+        daily = daily.filter(doctor_id=doctor)
+        services = services.filter(doctor_id=doctor)
+    return {
+        'doctors': list(
+            daily.values('doctor_id', 'doctor__full_name')
+            .annotate(visits=Sum('visits'), revenue=Sum('revenue'))
+            .order_by('-revenue', 'doctor__full_name')
+        ),
+        'days': list(daily.values('day').annotate(visits=Sum('visits'), revenue=Sum('revenue')).order_by('day')),
+        'services': list(
+            services.values('doctor_id', 'service__service_name')
+            .annotate(rendered=Sum('rendered'), quantity=Sum('quantity'), revenue=Sum('revenue'))
+            .order_by('doctor_id', '-revenue')
+        ),
+    }
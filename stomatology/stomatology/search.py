@@ -0,0 +1,235 @@
+import calendar
+import datetime
+import re
+from contextlib import contextmanager
+
+from django.contrib.postgres.search import SearchRank
+from django.db import connection, transaction
+from django.db.models import FloatField, Value
+from django.db.models.functions import Cast, Coalesce, Greatest
+from django.utils import timezone
+from psycopg2 import errorcodes
+
+
+def _trigrams(text):
+    # Повторяет разбиение на триграммы из pg_trgm: слова в нижнем регистре,
+    # дополненные двумя пробелами слева и одним справа
+    result = set()
+    for word in re.findall(r'\w+', text.lower()):
+        word = f'  {word} '
+        result.update(word[i:i + 3] for i in range(len(word) - 2))
+    return result
+
+
+def trigram_similarity(a, b):
+    """
+    Аналог similarity() из pg_trgm для сравнения с константами без запроса к БД
+    """
+    a, b = _trigrams(a), _trigrams(b)
+    if not a or not b:
+        return 0.0
+    return len(a & b) / len(a | b)
+
+
+def similarity_score(*expressions):
+    """
+    Наибольшая из похожестей в double precision.
+
+    similarity() возвращает real, а значение оценки попадает в курсор страницы
+    и должно сравниваться с ней же без потери точности. Похожесть по пустому
+    полю связанной таблицы (прием без пациента) - NULL, а GREATEST и сумма с
+    NULL дали бы NULL всей оценке, поэтому каждая похожесть считается как 0.
+    """
+    expressions = [Coalesce(expression, Value(0.0)) for expression in expressions]
+    score = Greatest(*expressions) if len(expressions) > 1 else expressions[0]
+    return Cast(score, FloatField())
+
+
+def search_score(vector, query, *similarities):
+    """
+    Оценка для ранжирования результатов поиска: ts_rank полнотекстового
+    совпадения плюс наибольшая из похожестей по триграммам
+    """
+    rank = Coalesce(SearchRank(vector, query), Value(0.0))
+    return Cast(rank + similarity_score(*similarities), FloatField())
+
+
+def query_canceled(error):
+    """
+    Запрос прерван по statement_timeout
+    """
+    return getattr(error.__cause__, 'pgcode', None) == errorcodes.QUERY_CANCELED
+
+
+@contextmanager
+def trigram_threshold(similarity=None, word_similarity=None, statement_timeout=None):
+    """
+    Порог для индексируемых операторов pg_trgm % и <% на время транзакции.
+
+    Запросы с этими операторами нужно выполнять внутри блока: set_config(..., true)
+    действует только до конца текущей транзакции и не "протекает" в соединение.
+    statement_timeout (мс) - предел времени каждого запроса в блоке, при его
+    превышении Postgres отменяет запрос (см. query_canceled).
+    """
+    with transaction.atomic():
+        with connection.cursor() as cursor:
+            if statement_timeout is not None:
+                cursor.execute(
+                    "SELECT set_config('statement_timeout', %s, true)", [f'{statement_timeout}ms']
+                )
+            if similarity is not None:
+                cursor.execute(
+                    "SELECT set_config('pg_trgm.similarity_threshold', %s, true)", [str(similarity)]
+                )
+            if word_similarity is not None:
+                cursor.execute(
+                    "SELECT set_config('pg_trgm.word_similarity_threshold', %s, true)", [str(word_similarity)]
+                )
+        yield
+
+
+MONTH_STEMS = {
+    'январ': 1, 'феврал': 2, 'март': 3, 'апрел': 4, 'июн': 6, 'июл': 7,
+    'август': 8, 'сентябр': 9, 'октябр': 10, 'ноябр': 11, 'декабр': 12,
+}
+
+
+def parse_month(word, abbreviated=False):
+    """
+    Номер месяца по русскому названию в любом падеже ("март", "марта").
+
+    abbreviated=True принимает и сокращения ("мар.", "сент") - только рядом с
+    числом дня или года: отдельно стоящие "сен", "дек" - скорее начало фамилии
+    или услуги, чем месяц.
+    """
+    word = word.lower().rstrip('.')
+    if word in ('май', 'мая', 'мае'):
+        return 5
+    for stem, month in MONTH_STEMS.items():
+        if word.startswith(stem) and len(word) - len(stem) <= 1:
+            return month
+        if abbreviated and len(word) >= 3 and stem.startswith(word):
+            return month
+    return None
+
+
+def _year(value):
+    if value is None:
+        return timezone.localdate().year
+    year = int(value)
+    return year + 2000 if year < 100 else year
+
+
+def _month_range(year, month):
+    return datetime.date(year, month, 1), datetime.date(year, month, calendar.monthrange(year, month)[1])
+
+
+def _exact_date(year, month, day):
+    value = datetime.date(year, month, day)
+    return value, value
+
+
+def _phone_digits(raw):
+    digits = re.sub(r'\D', '', raw)
+    # Российский номер с 8 вместо +7 хранится в формате E.164
+    if len(digits) == 11 and digits.startswith('8'):
+        digits = '7' + digits[1:]
+    return digits
+
+
+def _phone(raw):
+    """
+    Цифры телефона или None: подряд идущие цифры без "+" и разделителей короче
+    10 знаков - это код записи или номер кабинета, а не телефон
+    """
+    digits = _phone_digits(raw)
+    if raw.isdigit() and len(digits) < 10:
+        return None
+    return digits
+
+
+def _decimal(raw):
+    return float(raw.replace(',', '.'))
+
+
+MONTH_WORD = r'([а-яё]+)\.?'
+
+# Шаблоны в порядке приоритета: (вид, выражение, разбор совпадения).
+# Разбор возвращает значение или None, если совпадение оказалось не тем (например, "12 марок").
+# Год даты - группа year; даты без нее отсчитываются от текущего года
+PATTERNS = [
+    ('date', r'\b(?P<year>\d{4})-(\d{1,2})-(\d{1,2})\b',
+     lambda m: _exact_date(int(m[1]), int(m[2]), int(m[3]))),
+    ('date', rf'\b(\d{{1,2}})\s+{MONTH_WORD}(?:\s+(?P<year>\d{{4}}))?(?:\s*г\.?(?!\w))?',
+     lambda m: parse_month(m[2], True) and _exact_date(_year(m[3]), parse_month(m[2], True), int(m[1]))),
+    ('date', r'\b(\d{1,2})[./](\d{2})(?:[./](?P<year>\d{2}|\d{4}))?\b',
+     lambda m: _exact_date(_year(m[3]), int(m[2]), int(m[1]))),
+    ('date', rf'(?<!\w){MONTH_WORD}\s+(?P<year>\d{{4}})\b',
+     lambda m: parse_month(m[1], True) and _month_range(int(m[2]), parse_month(m[1], True))),
+    ('date', rf'(?<!\w){MONTH_WORD}',
+     lambda m: parse_month(m[1]) and _month_range(_year(None), parse_month(m[1]))),
+    ('time', r'\b(\d{1,2}):(\d{2})(?::(\d{2}))?\b',
+     lambda m: datetime.time(int(m[1]), int(m[2]), int(m[3] or 0))),
+    ('phone', r'\+?\d(?:[\s()-]?\d){5,}',
+     lambda m: _phone(m[0])),
+    ('decimal', r'\b\d+[.,]\d+\b',
+     lambda m: _decimal(m[0])),
+    ('number', r'\b\d+\b',
+     lambda m: int(m[0])),
+]
+
+
+class ParsedQuery:
+    """
+    Поисковый запрос, разобранный на части: даты, время, телефоны и числа
+    ищутся точным совпадением по индексам, остальное - нечетким поиском по тексту
+    """
+    def __init__(self, tokens, text, relative_dates=False):
+        self.tokens = tokens
+        self.text = text
+        # В запросе есть дата без года ("март", "12.10"): результат зависит от текущей даты
+        self.relative_dates = relative_dates
+
+    def values(self, kind):
+        return [value for token_kind, raw, value in self.tokens if token_kind == kind]
+
+    def free_text(self, *kinds):
+        """
+        Текст для нечеткого поиска: свободный текст и те части запроса,
+        которые представление не умеет искать точным совпадением (не входят в kinds)
+        """
+        parts = [raw for kind, raw, value in self.tokens if kind not in kinds]
+        return ' '.join(parts + [self.text]).strip()
+
+
+def parse_query(search, dates=True, times=True):
+    """
+    Разбор строки поиска на части.
+
+    dates=False / times=False отключают распознавание дат и времени там, где
+    "12.10" скорее стоимость, чем дата.
+    """
+    tokens = []
+    relative_dates = False
+    rest = search
+    for kind, pattern, convert in PATTERNS:
+        if (kind == 'date' and not dates) or (kind == 'time' and not times):
+            continue
+
+        def replace(match):
+            nonlocal relative_dates
+            try:
+                value = convert(match)
+            except (ValueError, OverflowError):
+                value = None
+            if not value and value != 0:
+                return match[0]
+            tokens.append((kind, match[0].strip(), value))
+            if kind == 'date' and match.groupdict().get('year') is None:
+                relative_dates = True
+            return ' '
+        rest = re.sub(pattern, replace, rest, flags=re.IGNORECASE)
+    # Знаки препинания, оставшиеся от вырезанных частей ("д.", "-"), в поиск не идут
+    return ParsedQuery(
+        tokens, ' '.join(word for word in rest.split() if re.search(r'\w', word)), relative_dates,
+    )
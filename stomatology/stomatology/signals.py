@@ -0,0 +1,38 @@
+from django.db import transaction
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from . import catalog
+from .cache import SEARCH_DEPENDENCIES, bump_version
+from .models import Doctor, Patient, Reception, Schedule, Service, Service_rendered
+
+
+@receiver(post_save, sender=Doctor)
+@receiver(post_save, sender=Patient)
+@receiver(post_save, sender=Reception)
+@receiver(post_save, sender=Schedule)
+@receiver(post_save, sender=Service)
+@receiver(post_save, sender=Service_rendered)
+@receiver(post_delete, sender=Doctor)
+@receiver(post_delete, sender=Patient)
+@receiver(post_delete, sender=Reception)
+@receiver(post_delete, sender=Schedule)
+@receiver(post_delete, sender=Service)
+@receiver(post_delete, sender=Service_rendered)
+def invalidate_search_cache(sender, **kwargs):
+    # Версия меняется после фиксации транзакции: иначе параллельный запрос
+    # успеет закэшировать под новой версией еще старые данные
+    entity = sender._meta.model_name
+    if entity in SEARCH_DEPENDENCIES:
+        transaction.on_commit(lambda: bump_version(entity))
+
+
+@receiver(post_save, sender=Doctor)
+@receiver(post_save, sender=Service)
+@receiver(post_delete, sender=Doctor)
+@receiver(post_delete, sender=Service)
+def invalidate_catalog(sender, **kwargs):
+    # Остальные воркеры узнают об изменении из NOTIFY триггера (см. catalog.py),
+    # а этот сбрасывает справочник сам, не дожидаясь доставки уведомления
+    table = sender._meta.db_table
+    transaction.on_commit(lambda: catalog.invalidate(table))
@@ -0,0 +1,103 @@
+import copy
+import threading
+
+
+class Abandoned(Exception):
+    """
+    Результат больше не нужен: запрос сменил более новый
+    """
+
+
+def _own_error(error):
+    """
+    Копия исключения первого вызова для ожидающего: каждый вызов поднимает свой
+    экземпляр, и трассировки разных запросов не смешиваются в одном объекте
+    """
+    try:
+        own = copy.copy(error)
+    except Exception:
+        return error
+    own.__cause__ = error.__cause__
+    return own
+
+
+class Call:
+    """
+    Одно выполнение функции, результат которого ждут все одинаковые вызовы
+    """
+    def __init__(self):
+        self.done = False
+        self.result = None
+        self.error = None
+        # События ожидающих вызовов, кроме первого, который сам выполняет функцию
+        self.waiters = []
+
+
+class Group:
+    """
+    Объединение одновременных одинаковых вызовов в одно выполнение (singleflight).
+
+    Работает на примитивах threading: в воркере gunicorn с gevent они
+    заменены на зеленые, и ожидание не блокирует остальные запросы воркера.
+    """
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._calls = {}
+
+    def do(self, key, fn, wakeup=None):
+        """
+        Результат fn(call) для key: первый вызов выполняет функцию,
+        остальные ждут его результат.
+
+        wakeup - threading.Event вызова. Если он установлен раньше, чем готов
+        результат, ожидающий вызов бросает Abandoned.
+        """
+        wakeup = wakeup or threading.Event()
+        with self._lock:
+            call = self._calls.get(key)
+            if call is None:
+                call = self._calls[key] = Call()
+                leader = True
+            else:
+                call.waiters.append(wakeup)
+                leader = False
+
+        if not leader:
+            wakeup.wait()
+            with self._lock:
+                if not call.done:
+                    call.waiters.remove(wakeup)
+                    raise Abandoned
+            if call.error is not None:
+                raise _own_error(call.error)
+            return call.result
+
+        try:
+            call.result = fn(call)
+        except BaseException as error:
+            call.error = error
+            raise
+        finally:
+            with self._lock:
+                call.done = True
+                self._forget(key, call)
+                for waiter in call.waiters:
+                    waiter.set()
+        return call.result
+
+    def _forget(self, key, call):
+        if self._calls.get(key) is call:
+            del self._calls[key]
+
+    def abandon(self, key, call):
+        """
+        Отказ от call, если его результат никто, кроме первого вызова, не ждет.
+
+        Следующие вызовы с key выполнят функцию заново. Возвращает False,
+        если у call есть ожидающие и его нужно довести до конца.
+        """
+        with self._lock:
+            if call.waiters:
+                return False
+            self._forget(key, call)
+            return True
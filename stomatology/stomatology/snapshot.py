@@ -0,0 +1,196 @@
+"""
+Снимок таблиц приложения и восстановление из него (замена dumpdata/loaddata
+для копии рабочей базы).
+
+Снимок - каталог с manifest.json и файлом на каждую таблицу: двоичный COPY,
+сжатый gzip. Таблицы пишутся и читаются потоком, без создания объектов
+моделей. Восстановление идет одной транзакцией: таблицы очищаются, внешние
+ключи, ограничения и индексы удаляются, данные загружаются по порядку
+зависимостей, после чего индексы и ограничения строятся заново по всей
+таблице сразу, а последовательности id сдвигаются за максимальный id.
+"""
+import datetime
+import gzip
+import json
+import os
+
+from django.apps import apps
+from django.core.management.color import no_style
+from django.db import connection, transaction
+from django.db.migrations.recorder import MigrationRecorder
+
+from .cache import bump_version
+
+SNAPSHOT_FORMAT = 1
+SNAPSHOT_APP = 'stomatology'
+MANIFEST = 'manifest.json'
+# Уровень gzip: снимок пишется быстрее, чем сжимается на высоких уровнях
+SNAPSHOT_COMPRESS_LEVEL = 3
+# Память на построение индексов и проверку внешних ключей при восстановлении
+RESTORE_MAINTENANCE_WORK_MEM = '256MB'
+
+# Ограничения, которые снимаются на время загрузки: внешние ключи, уникальность, исключение
+DEFERRED_CONSTRAINTS_SQL = """
+    SELECT conname, contype, pg_get_constraintdef(oid)
+    FROM pg_constraint
+    WHERE conrelid = %s::regclass AND contype IN ('f', 'u', 'x')
+"""
+# Индексы, не принадлежащие ограничениям (индексы ограничений создаются вместе с ними)
+DEFERRED_INDEXES_SQL = """
+    SELECT index.relname, pg_get_indexdef(index.oid)
+    FROM pg_index
+    JOIN pg_class index ON index.oid = pg_index.indexrelid
+    WHERE pg_index.indrelid = %s::regclass
+      AND NOT EXISTS (SELECT 1 FROM pg_constraint WHERE conindid = index.oid)
+"""
+
+
+class SnapshotError(Exception):
+    pass
+
+
+def snapshot_models():
+    """
+    Модели приложения так, что каждая идет после моделей, на которые ссылается
+    """
+    models = [model for model in apps.get_app_config(SNAPSHOT_APP).get_models() if not model._meta.proxy]
+    ordered = []
+
+    def visit(model):
+        if model in ordered:
+            return
+        for field in model._meta.concrete_fields:
+            related = field.related_model
+            if related is not None and related is not model and related in models:
+                visit(related)
+        ordered.append(model)
+
+    for model in models:
+        visit(model)
+    return ordered
+
+
+def _columns(model):
+    return [field.column for field in model._meta.concrete_fields]
+
+
+def _applied_migration():
+    # Двоичный COPY переносится только между одинаковыми схемами таблиц
+    return (
+        MigrationRecorder.Migration.objects.filter(app=SNAPSHOT_APP).order_by('-applied', '-id')
+        .values_list('name', flat=True).first()
+    )
+
+
+def _file_name(model):
+    return f'{model._meta.db_table}.copy.gz'
+
+
+def _copy_sql(model, direction, options):
+    quote = connection.ops.quote_name
+    columns = ', '.join(quote(column) for column in _columns(model))
+    return f"COPY {quote(model._meta.db_table)} ({columns}) {direction} WITH ({options})"
+
+
+def dump(path, level=SNAPSHOT_COMPRESS_LEVEL):
+    """
+    Снимок всех таблиц приложения в каталог path. Таблицы читаются в одной
+    транзакции REPEATABLE READ, поэтому снимок согласован между таблицами
+    """
+    os.makedirs(path, exist_ok=True)
+    tables = []
+    with transaction.atomic(), connection.cursor() as cursor:
+        cursor.execute("SET TRANSACTION ISOLATION LEVEL REPEATABLE READ, READ ONLY")
+        for model in snapshot_models():
+            with gzip.open(os.path.join(path, _file_name(model)), 'wb', compresslevel=level) as file:
+                cursor.copy_expert(_copy_sql(model, 'TO STDOUT', 'FORMAT binary'), file)
+            tables.append({
+                'model': model._meta.label_lower,
+                'table': model._meta.db_table,
+                'columns': _columns(model),
+                'rows': cursor.rowcount,
+                'file': _file_name(model),
+            })
+    manifest = {
+        'format': SNAPSHOT_FORMAT,
+        'created': datetime.datetime.now(datetime.timezone.utc).isoformat(),
+        'migration': _applied_migration(),
+        'tables': tables,
+    }
+    with open(os.path.join(path, MANIFEST), 'w', encoding='utf-8') as file:
+        json.dump(manifest, file, ensure_ascii=False, indent=2)
+    return manifest
+
+
+def read_manifest(path):
+    """
+    manifest.json снимка, проверенный на совместимость с текущей схемой
+    """
+    try:
+        with open(os.path.join(path, MANIFEST), encoding='utf-8') as file:
+            manifest = json.load(file)
+    except FileNotFoundError:
+        raise SnapshotError(f"В {path} нет {MANIFEST}")
+    if manifest.get('format') != SNAPSHOT_FORMAT:
+        raise SnapshotError(f"Неизвестный формат снимка: {manifest.get('format')}")
+    current = _applied_migration()
+    if manifest['migration'] != current:
+        raise SnapshotError(
+            f"Снимок сделан на миграции {manifest['migration']}, а в базе применена {current}: "
+            f"сначала приведите миграции к одной версии"
+        )
+    expected = {model._meta.label_lower: _columns(model) for model in snapshot_models()}
+    tables = {table['model']: table['columns'] for table in manifest['tables']}
+    if tables != expected:
+        raise SnapshotError("Таблицы снимка не совпадают с моделями приложения")
+    return manifest
+
+
+def restore(path):
+    """
+    Замена данных всех таблиц приложения данными снимка из каталога path.
+    Возвращает manifest снимка
+    """
+    manifest = read_manifest(path)
+    models = snapshot_models()
+    quote = connection.ops.quote_name
+    tables = [quote(model._meta.db_table) for model in models]
+
+    with transaction.atomic(), connection.cursor() as cursor:
+        cursor.execute(f"SET LOCAL maintenance_work_mem = '{RESTORE_MAINTENANCE_WORK_MEM}'")
+        # Таблицы очищены в этой же транзакции: COPY FREEZE пишет строки сразу
+        # замороженными, а при wal_level=minimal - и без записи в WAL
+        cursor.execute(f"TRUNCATE {', '.join(tables)}")
+
+        constraints, indexes = [], []
+        for table in tables:
+            cursor.execute(DEFERRED_CONSTRAINTS_SQL, [table])
+            for name, kind, definition in cursor.fetchall():
+                constraints.append((kind, table, name, definition))
+                cursor.execute(f"ALTER TABLE {table} DROP CONSTRAINT {quote(name)}")
+            cursor.execute(DEFERRED_INDEXES_SQL, [table])
+            for name, definition in cursor.fetchall():
+                indexes.append(definition)
+                cursor.execute(f"DROP INDEX {quote(name)}")
+            # search_vector уже есть в снимке: триггеры, которые его пересчитывают, не нужны
+            cursor.execute(f"ALTER TABLE {table} DISABLE TRIGGER USER")
+
+        for model in models:
+            with gzip.open(os.path.join(path, _file_name(model)), 'rb') as file:
+                cursor.copy_expert(_copy_sql(model, 'FROM STDIN', 'FORMAT binary, FREEZE'), file)
+
+        for table in tables:
+            cursor.execute(f"ALTER TABLE {table} ENABLE TRIGGER USER")
+        for definition in indexes:
+            cursor.execute(definition)
+        # Внешние ключи - последними: им нужны уникальные индексы таблиц, на которые они ссылаются
+        for kind, table, name, definition in sorted(constraints, key=lambda constraint: constraint[0] == 'f'):
+            cursor.execute(f"ALTER TABLE {table} ADD CONSTRAINT {quote(name)} {definition}")
+        for sql in connection.ops.sequence_reset_sql(no_style(), models):
+            cursor.execute(sql)
+        cursor.execute(f"ANALYZE {', '.join(tables)}")
+
+    # Сигналы при COPY не отправляются: закэшированный поиск сбрасывается здесь
+    for model in models:
+        bump_version(model._meta.model_name)
+    return manifest
@@ -0,0 +1,26 @@
+// Выбор варианта в виджете AutocompleteSelect: ключ уходит в скрытое поле формы,
+// подпись - в поле поиска. Если текст изменили и ничего не выбрали, выбор сбрасывается.
+document.addEventListener('click', function (event) {
+    var option = event.target.closest('[data-autocomplete] [data-value]');
+    var widgets = document.querySelectorAll('[data-autocomplete]');
+    widgets.forEach(function (widget) {
+        if (option && widget.contains(option)) {
+            var value = widget.querySelector('[data-autocomplete-value]');
+            value.value = option.dataset.value;
+            // Скрытое поле само не сообщает об изменении: зависящие от выбора блоки формы ждут change
+            value.dispatchEvent(new Event('change', {bubbles: true}));
+            var input = widget.querySelector('[data-autocomplete-input]');
+            input.value = option.dataset.label;
+        }
+        if (!widget.contains(event.target) || option) {
+            widget.querySelector('[data-autocomplete-options]').innerHTML = '';
+        }
+    });
+});
+
+document.addEventListener('input', function (event) {
+    var input = event.target.closest('[data-autocomplete-input]');
+    if (input) {
+        input.closest('[data-autocomplete]').querySelector('[data-autocomplete-value]').value = '';
+    }
+});
@@ -1,3 +1,1635 @@
-from django.test import TestCase
+import csv
+import datetime
+import decimal
+import gzip
+import io
+import json
+import random
+import re
+import shutil
+import tempfile
+import threading
+import time
+import zlib
+from unittest import mock
 
-# Create your tests here.
+import psycopg2
+from asgiref.sync import sync_to_async
+from django.contrib.auth.models import AnonymousUser, Permission, User
+from django.contrib.postgres.search import SearchQuery, TrigramSimilarity
+from django.core.cache import cache
+from django.db import IntegrityError, OperationalError, connection, connections, transaction
+from django.db.models import F
+from django.db.models.functions import Greatest
+from django.template import Template
+from django.test import AsyncClient, Client, RequestFactory, SimpleTestCase, TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils.http import http_date
+
+from app.db.postgresql_pool.pool import ConnectionPool, PoolTimeout, _pools, close_pools, get_pool
+
+from . import async_views, catalog, live, urls
+from .cache import SearchRequest, _run_search, flights, search_cache_stats
+from .models import (
+    Doctor, Patient, Reception, RevenueDaily, RevenueDailyService, Schedule, Service, Service_rendered,
+)
+from .analytics import cached_utilization, utilization
+from .availability import free_intervals, free_slots, subtract
+from .bulk_import import import_csv
+from .export import EXPORT_SOURCES
+from .forms import ScheduleForm
+from .fragments import render_rows
+from .pagination import encode_cursor, keyset_page
+from .listing import list_values
+from .revenue import rebuild
+from .snapshot import SnapshotError, dump, read_manifest, restore
+from .search import parse_query, query_canceled, search_score, trigram_threshold
+from .singleflight import Abandoned, Group
+from .views import SERVICE_ORDERING
+
+SYLLABLES = [
+    'ба', 'ве', 'го', 'ду', 'жа', 'зи', 'ка', 'ло', 'ми', 'ну', 'па', 'ре', 'си', 'то', 'фу',
+    'ха', 'це', 'ча', 'шо', 'ям', 'бор', 'вал', 'гер', 'дан', 'зор', 'кир', 'лан', 'мор', 'нег', 'рус',
+]
+NAMES = ['Алексей', 'Борис', 'Виктор', 'Глеб', 'Денис', 'Евгений', 'Игорь', 'Кирилл', 'Леонид', 'Максим']
+PATRONYMICS = ['Алексеевич', 'Борисович', 'Викторович', 'Глебович', 'Денисович', 'Игоревич', 'Кириллович']
+
+
+def synthetic_people(count, planted):
+    """
+    count случайных ФИО, среди которых planted раз встречается фамилия "Цветков" / "Шубина"
+    """
+    rnd = random.Random(0)
+    for i in range(count):
+        if i % (count // planted) == 0:
+            surname = 'Цветков' if i // (count // planted) % 2 else 'Шубина'
+        else:
+            surname = ''.join(rnd.choices(SYLLABLES, k=3)).capitalize() + rnd.choice(['ов', 'ин', 'ский'])
+        yield (
+            f"{surname} {rnd.choice(NAMES)} {rnd.choice(PATRONYMICS)}",
+            f"+7961{i:07d}",
+            f"ул.{''.join(rnd.choices(SYLLABLES, k=3)).capitalize()}ская д.{i % 300} кв.{i % 97}",
+        )
+
+
+def explain(sql, threshold):
+    with trigram_threshold(threshold), connection.cursor() as cursor:
+        cursor.execute(f"EXPLAIN {sql}")
+        return '\n'.join(row[0] for row in cursor.fetchall())
+
+
+class TrigramSearchPlanTests(TestCase):
+    """
+    Поиск по похожести на большой синтетической таблице: до перехода на
+    оператор % Postgres сканировал таблицу целиком, после - читает индекс.
+    """
+    ROWS = 50000
+
+    @classmethod
+    def setUpTestData(cls):
+        people = list(synthetic_people(cls.ROWS, planted=40))
+        Doctor.objects.bulk_create(
+            Doctor(full_name=name, phone_number=phone, office_number=str(i % 500))
+            for i, (name, phone, _) in enumerate(people)
+        )
+        Patient.objects.bulk_create(
+            Patient(full_name=name, phone_number=phone, patient_address=address)
+            for name, phone, address in people
+        )
+        with connection.cursor() as cursor:
+            # Тест идет внутри транзакции, где нельзя выполнить VACUUM: переносим
+            # строки из очереди GIN-индексов в сами индексы, как это сделал бы autovacuum
+            cursor.execute("""
+                SELECT gin_clean_pending_list(i.indexrelid)
+                FROM pg_index i
+                JOIN pg_class c ON c.oid = i.indexrelid
+                JOIN pg_am am ON am.oid = c.relam
+                WHERE am.amname = 'gin' AND i.indrelid IN ('doctor'::regclass, 'patient'::regclass)
+            """)
+            cursor.execute("ANALYZE doctor")
+            cursor.execute("ANALYZE patient")
+
+    def setUp(self):
+        # Результат из кэша поиска не дал бы увидеть запрос представления
+        cache.clear()
+
+    def view_sql(self, url_name, search, table):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(reverse(url_name), {'q': search})
+        self.assertEqual(response.status_code, 200)
+        return [q['sql'] for q in queries.captured_queries if f'FROM "{table}"' in q['sql']][-1]
+
+    def test_doctor_similarity_search_uses_trigram_index(self):
+        search = 'Цветков'
+        before = Doctor.objects.annotate(
+            similarity_full_name=TrigramSimilarity('full_name', search),
+        ).filter(similarity_full_name__gt=0.1)
+        self.assertIn('Seq Scan on doctor', before.explain())
+
+        plan = explain(self.view_sql('doctors', search, 'doctor'), 0.1)
+        self.assertIn('doctor_full_name_trgm', plan)
+        self.assertNotIn('Seq Scan on doctor', plan)
+
+    def test_patient_similarity_search_uses_trigram_index(self):
+        search = 'Шубина'
+        before = Patient.objects.annotate(
+            similarity=Greatest(
+                TrigramSimilarity('full_name', search),
+                TrigramSimilarity('phone_number', search),
+                TrigramSimilarity('patient_address', search),
+            )
+        ).filter(similarity__gt=0.6)
+        self.assertIn('Seq Scan on patient', before.explain())
+
+        plan = explain(self.view_sql('patients', search, 'patient'), 0.6)
+        self.assertIn('patient_full_name_trgm', plan)
+        self.assertIn('patient_full_name_upper_trgm', plan)
+        self.assertNotIn('Seq Scan on patient', plan)
+
+    def test_similarity_operator_keeps_results(self):
+        search = 'Цветков'
+        before = set(Doctor.objects.annotate(
+            similarity_full_name=TrigramSimilarity('full_name', search),
+            similarity_phone_number=TrigramSimilarity('phone_number', search),
+        ).filter(similarity_full_name__gt=0.1).values_list('id', flat=True))
+        with trigram_threshold(0.1):
+            after = set(Doctor.objects.filter(full_name__trigram_similar=search).values_list('id', flat=True))
+        self.assertTrue(before)
+        self.assertEqual(before, after)
+
+
+class QueryBudgetTests(TestCase):
+    """
+    Каждый список и каждая форма добавления и изменения объявляет, сколько
+    SQL-запросов ей разрешено (query_budget). Данных в таблицах больше, чем
+    бюджет: лишний запрос на строку (N+1) сразу выходит за его пределы.
+    """
+    ROWS = 20
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_superuser('budget', password='budget')
+        doctors = Doctor.objects.bulk_create(
+            Doctor(full_name=f'Иванов Врач {i}', phone_number=f'+7961000{i:04d}', office_number=str(i))
+            for i in range(cls.ROWS)
+        )
+        patients = Patient.objects.bulk_create(
+            Patient(full_name=f'Петров Пациент {i}', phone_number=f'+7962000{i:04d}', patient_address=f'ул.Ленина д.{i}')
+            for i in range(cls.ROWS)
+        )
+        services = Service.objects.bulk_create(
+            Service(service_name=f'Услуга {i}', cost=1000 + i) for i in range(cls.ROWS)
+        )
+        receptions = Reception.objects.bulk_create(
+            Reception(
+                date_reception=datetime.date(2025, 3, 1) + datetime.timedelta(days=i),
+                time_reception=datetime.time(10, 0),
+                doctor=doctors[i],
+                patient=patients[i],
+            )
+            for i in range(cls.ROWS)
+        )
+        Service_rendered.objects.bulk_create(
+            Service_rendered(service=services[i], number_reception=receptions[i], quantity=1) for i in range(cls.ROWS)
+        )
+        Schedule.objects.bulk_create(
+            Schedule(
+                doctor=doctors[i], day_week=i % 7 + 1,
+                start_reception=datetime.time(9, 0), end_reception=datetime.time(17, 0),
+            )
+            for i in range(cls.ROWS)
+        )
+
+    def setUp(self):
+        cache.clear()
+        self.client.force_login(self.user)
+
+    def budgeted_urls(self):
+        """
+        (адрес, представление) для всех списков и форм из stomatology/urls.py
+        """
+        for pattern in urls.urlpatterns:
+            name = pattern.name
+            view = pattern.callback
+            view_class = getattr(view, 'view_class', None)
+            if view_class is not None and view_class.__name__.endswith(('Add', 'Edit')):
+                model = view_class.model
+                if 'pk' in pattern.pattern.converters:
+                    yield reverse(name, kwargs={'pk': model.objects.order_by('id').first().pk}), view_class
+                else:
+                    yield reverse(name), view_class
+            elif hasattr(view, 'search_query_budget') or name in (
+                'doctors', 'patients', 'schedules', 'services', 'services_rendered', 'receptions'
+            ):
+                yield reverse(name), view
+
+    def assert_within_budget(self, url, budget, params=None):
+        response = self.client.get(url, params)
+        self.assertEqual(response.status_code, 200)
+        stats = response.query_stats
+        self.assertLessEqual(
+            stats.count, budget,
+            f"{url} {params or ''}: {stats.count} SQL при бюджете {budget}:\n" + '\n'.join(stats.signatures)
+        )
+        self.assertEqual(stats.repeated(), {}, f"{url}: повторяющиеся запросы (N+1)")
+
+    def test_views_within_query_budget(self):
+        checked = 0
+        for url, view in self.budgeted_urls():
+            with self.subTest(url=url):
+                budget = getattr(view, 'query_budget', None)
+                self.assertIsNotNone(budget, f"{url}: представление не объявило query_budget")
+                self.assert_within_budget(url, budget)
+                search_budget = getattr(view, 'search_query_budget', None)
+                if search_budget is not None:
+                    self.assert_within_budget(url, search_budget, {'q': 'Иванов'})
+                    self.assert_within_budget(url, search_budget, {'q': '5'})
+            checked += 1
+        # 6 списков, 4 подсказки для виджетов выбора, свободные окна, отчеты о выручке
+        # и о загрузке врачей, 6 форм добавления и 6 форм изменения
+        self.assertEqual(checked, 25)
+
+    def test_server_timing_header(self):
+        response = self.client.get(reverse('doctors'))
+        self.assertRegex(response['Server-Timing'], r'^db;dur=[\d.]+;desc="\d+ SQL", tpl;dur=[\d.]+, total;dur=[\d.]+$')
+        # Время запросов к БД видят только сотрудники
+        self.client.logout()
+        self.assertNotIn('Server-Timing', self.client.get(reverse('doctors')))
+        with override_settings(DEBUG=True):
+            self.assertIn('Server-Timing', self.client.get(reverse('doctors')))
+
+    @override_settings(ROOT_URLCONF='app.urls_asgi')
+    async def test_server_timing_header_async(self):
+        client = AsyncClient()
+        response = await client.get(reverse('doctors'))
+        self.assertNotIn('Server-Timing', response)
+        self.assertGreaterEqual(response.query_stats.count, 1)
+        await sync_to_async(client.force_login)(self.user)
+        self.assertIn('Server-Timing', await client.get(reverse('doctors')))
+
+
+class AutocompleteWidgetTests(TestCase):
+    """
+    Формы приема выбирают врача и пациента через подсказки, а не <select> со всей таблицей
+    """
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_superuser('widget', password='widget')
+        cls.doctor, cls.other_doctor = Doctor.objects.bulk_create([
+            Doctor(full_name='Цветков Игорь Борисович', phone_number='+79610000001', office_number='12'),
+            Doctor(full_name='Шубин Глеб Денисович', phone_number='+79610000002', office_number='14'),
+        ])
+        cls.patient = Patient.objects.create(
+            full_name='Петров Петр Петрович', phone_number='+79620000001', patient_address='ул.Ленина д.1'
+        )
+        # 15.03.2025 - суббота
+        Schedule.objects.create(
+            doctor=cls.doctor, day_week=6, start_reception=datetime.time(9, 0), end_reception=datetime.time(15, 0)
+        )
+
+    def setUp(self):
+        cache.clear()
+        self.client.force_login(self.user)
+
+    def test_form_renders_without_related_rows(self):
+        response = self.client.get(reverse('reception_add'))
+        self.assertContains(response, reverse('doctor_autocomplete'))
+        self.assertNotContains(response, 'Шубин Глеб Денисович')
+        self.assertNotContains(response, '<select name="doctor"')
+
+    def test_autocomplete_returns_matching_options(self):
+        response = self.client.get(reverse('doctor_autocomplete'), {'q': 'Цветков'})
+        self.assertContains(response, f'data-value="{self.doctor.id}"')
+        self.assertNotContains(response, f'data-value="{self.other_doctor.id}"')
+
+    def test_submit_fetches_only_selected_rows(self):
+        data = {
+            'date_reception': '2025-03-15', 'time_reception': '10:30',
+            'doctor': self.doctor.id, 'patient': self.patient.id,
+        }
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.post(reverse('reception_add'), data)
+        self.assertRedirects(response, reverse('receptions'), fetch_redirect_response=False)
+        reception = Reception.objects.get()
+        self.assertEqual((reception.doctor, reception.patient), (self.doctor, self.patient))
+        # Врач и пациент читаются по первичному ключу, без выборки всех строк таблиц
+        for query in queries.captured_queries:
+            if query['sql'].startswith('SELECT') and 'FROM "doctor"' in query['sql']:
+                self.assertIn(f'"doctor"."id" = {self.doctor.id}', query['sql'])
+
+    def test_edit_shows_selected_label(self):
+        reception = Reception.objects.create(
+            date_reception=datetime.date(2025, 3, 15), time_reception=datetime.time(10, 30),
+            doctor=self.doctor, patient=self.patient,
+        )
+        response = self.client.get(reverse('reception_edit', kwargs={'pk': reception.pk}))
+        self.assertContains(response, f'name="doctor" value="{self.doctor.id}"')
+        self.assertContains(response, 'value="Цветков Игорь Борисович"')
+
+
+class AvailabilityTests(TestCase):
+    """
+    Свободные окна врачей по расписанию и уже назначенным приемам
+    """
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_superuser('slots', password='slots')
+        cls.doctor, cls.other_doctor = Doctor.objects.bulk_create([
+            Doctor(full_name='Цветков Игорь Борисович', phone_number='+79610000001', office_number='12'),
+            Doctor(full_name='Шубин Глеб Денисович', phone_number='+79610000002', office_number='14'),
+        ])
+        # Понедельник: две смены с перерывом, вторник - одна короткая смена
+        Schedule.objects.bulk_create([
+            Schedule(doctor=cls.doctor, day_week=1, start_reception=datetime.time(9, 0), end_reception=datetime.time(12, 0)),
+            Schedule(doctor=cls.doctor, day_week=1, start_reception=datetime.time(13, 0), end_reception=datetime.time(14, 0)),
+            Schedule(doctor=cls.other_doctor, day_week=2, start_reception=datetime.time(10, 0), end_reception=datetime.time(11, 0)),
+        ])
+        # Прошедшие окна эндпоинт не показывает: берем понедельник через неделю
+        today = datetime.date.today()
+        cls.monday = today + datetime.timedelta(days=7 - today.weekday() + 7)
+        cls.patient = Patient.objects.create(
+            full_name='Петров Петр Петрович', phone_number='+79620000001', patient_address='ул.Ленина д.1'
+        )
+        cls.reception = Reception.objects.create(
+            date_reception=cls.monday, time_reception=datetime.time(10, 15), doctor=cls.doctor
+        )
+
+    def test_subtract(self):
+        self.assertEqual(
+            subtract([(0, 100), (200, 300)], [(-10, 10), (50, 60), (90, 210), (290, 400)]),
+            [(10, 50), (60, 90), (210, 290)],
+        )
+
+    def test_free_intervals_for_week_in_one_query(self):
+        with CaptureQueriesContext(connection) as queries:
+            intervals = free_intervals(self.monday, self.monday + datetime.timedelta(days=6))
+        self.assertEqual(len(queries.captured_queries), 1)
+        self.assertEqual(intervals, {
+            self.doctor.id: {self.monday: [(540, 615), (645, 720), (780, 840)]},
+            self.other_doctor.id: {self.monday + datetime.timedelta(days=1): [(600, 660)]},
+        })
+
+    def test_free_slots(self):
+        slots = free_slots(self.monday, self.monday, self.doctor.id, duration=60)
+        self.assertEqual(
+            [time for day, time in slots[self.doctor.id]],
+            [datetime.time(9, 0), datetime.time(10, 45), datetime.time(13, 0)],
+        )
+
+    def test_endpoint(self):
+        tuesday = (self.monday + datetime.timedelta(days=1)).isoformat()
+        response = self.client.get(reverse('reception_free_slots'), {
+            'doctor': self.other_doctor.id, 'start': self.monday, 'end': self.monday + datetime.timedelta(days=6),
+        })
+        self.assertEqual(response.json(), {'duration': 30, 'doctors': {
+            str(self.other_doctor.id): [{'date': tuesday, 'time': '10:00'}, {'date': tuesday, 'time': '10:30'}],
+        }})
+        response = self.client.get(reverse('reception_free_slots'), {
+            'start': self.monday, 'end': self.monday + datetime.timedelta(days=60),
+        })
+        self.assertEqual(response.status_code, 400)
+
+    def test_form_rejects_busy_or_off_schedule_time(self):
+        self.client.force_login(self.user)
+        data = {'date_reception': self.monday, 'doctor': self.doctor.id, 'patient': self.patient.id}
+        for time in ('10:30', '12:00', '13:45'):
+            with self.subTest(time=time):
+                response = self.client.post(reverse('reception_add'), {**data, 'time_reception': time})
+                self.assertFormError(response.context['form'], 'time_reception', "Врач в это время не принимает или уже занят")
+        response = self.client.post(reverse('reception_add'), {**data, 'time_reception': '10:45'})
+        self.assertEqual(response.status_code, 302)
+        # Сам прием не мешает себе при изменении
+        response = self.client.post(
+            reverse('reception_edit', kwargs={'pk': self.reception.pk}), {**data, 'time_reception': '10:00'}
+        )
+        self.assertEqual(response.status_code, 302)
+
+
+class BookingConflictTests(TransactionTestCase):
+    """
+    Одновременная запись к одному врачу на одно время: сохраняется ровно один прием
+    """
+    THREADS = 8
+
+    def setUp(self):
+        self.user = User.objects.create_superuser('booking', password='booking')
+        self.doctor = Doctor.objects.create(
+            full_name='Цветков Игорь Борисович', phone_number='+79610000001', office_number='12'
+        )
+        self.patient = Patient.objects.create(
+            full_name='Петров Петр Петрович', phone_number='+79620000001', patient_address='ул.Ленина д.1'
+        )
+        Schedule.objects.create(
+            doctor=self.doctor, day_week=1, start_reception=datetime.time(9, 0), end_reception=datetime.time(18, 0)
+        )
+        self.client.force_login(self.user)
+        self.data = {
+            'date_reception': '2030-01-07', 'time_reception': '10:00',
+            'doctor': self.doctor.id, 'patient': self.patient.id,
+        }
+
+    def test_constraint_rejects_overlap(self):
+        Reception.objects.create(
+            date_reception=datetime.date(2030, 1, 7), time_reception=datetime.time(10, 0), doctor=self.doctor
+        )
+        with self.assertRaises(IntegrityError), transaction.atomic():
+            Reception.objects.create(
+                date_reception=datetime.date(2030, 1, 7), time_reception=datetime.time(10, 29), doctor=self.doctor
+            )
+        # Соседний прием и прием без врача не мешают
+        Reception.objects.create(date_reception=datetime.date(2030, 1, 7), time_reception=datetime.time(10, 30), doctor=self.doctor)
+        Reception.objects.create(date_reception=datetime.date(2030, 1, 7), time_reception=datetime.time(10, 0))
+
+    def test_conflict_after_check_becomes_form_error(self):
+        Reception.objects.create(
+            date_reception=datetime.date(2030, 1, 7), time_reception=datetime.time(10, 0), doctor=self.doctor
+        )
+        # Проверка формы прошла до того, как другой прием был сохранен
+        with mock.patch('stomatology.forms.is_free', return_value=True):
+            response = self.client.post(reverse('reception_add'), {**self.data, 'time_reception': '10:15'})
+        self.assertFormError(response.context['form'], 'time_reception', "Врач в это время уже занят")
+        self.assertEqual(Reception.objects.count(), 1)
+
+    def test_concurrent_booking(self):
+        barrier = threading.Barrier(self.THREADS)
+        statuses = []
+
+        def book():
+            client = Client()
+            client.cookies = self.client.cookies
+            try:
+                barrier.wait()
+                statuses.append(client.post(reverse('reception_add'), self.data).status_code)
+            finally:
+                connections.close_all()
+
+        threads = [threading.Thread(target=book) for _ in range(self.THREADS)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(sorted(statuses), [200] * (self.THREADS - 1) + [302])
+        self.assertEqual(Reception.objects.filter(doctor=self.doctor).count(), 1)
+
+
+class ExportTests(TestCase):
+    """
+    Выгрузка для бухгалтерии: строки за диапазон дат вместе с врачом, пациентом и стоимостью
+    """
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_superuser('export', password='export')
+        doctor = Doctor.objects.create(full_name='Цветков Игорь Борисович', phone_number='+79610000001', office_number='12')
+        patient = Patient.objects.create(
+            full_name='Петров Петр Петрович', phone_number='+79620000001', patient_address='ул.Ленина д.1'
+        )
+        service = Service.objects.create(service_name='Пломбирование зуба', cost=2500)
+        for day in (1, 2, 3):
+            reception = Reception.objects.create(
+                date_reception=datetime.date(2025, 3, day), time_reception=datetime.time(10, 0),
+                doctor=doctor, patient=patient,
+            )
+            Service_rendered.objects.create(service=service, number_reception=reception, quantity=day)
+
+    def test_requires_permission(self):
+        self.assertEqual(self.client.get(reverse('receptions_export')).status_code, 403)
+
+    def test_csv(self):
+        self.client.force_login(self.user)
+        response = self.client.get(reverse('receptions_export'), {'start': '2025-03-02', 'end': '2025-03-03'})
+        self.assertEqual(response['Content-Disposition'], 'attachment; filename="receptions_2025-03-02_2025-03-03.csv"')
+        lines = b''.join(response.streaming_content).decode('utf-8-sig').splitlines()
+        self.assertEqual(lines[0], 'Номер приема,Дата,Время,Врач,Кабинет,Пациент,Телефон пациента')
+        self.assertEqual(len(lines), 3)
+        # Телефон начинается с "+" и уходит текстом, а не формулой
+        self.assertIn("2025-03-02,10:00:00,Цветков Игорь Борисович,12,Петров Петр Петрович,'+79620000001", lines[1])
+
+    def test_csv_formula_injection(self):
+        Patient.objects.update(full_name='=HYPERLINK("http://example.com","Петров")')
+        Service.objects.update(service_name='@SUM(1+1)', cost=-2500)
+        self.client.force_login(self.user)
+        rows = list(csv.reader(
+            b''.join(self.client.get(reverse('services_rendered_export')).streaming_content).decode('utf-8-sig').splitlines()
+        ))
+        self.assertEqual(rows[1][5:8], ["'=HYPERLINK(\"http://example.com\",\"Петров\")", "'@SUM(1+1)", '-2500.0'])
+
+    def test_json(self):
+        self.client.force_login(self.user)
+        response = self.client.get(reverse('services_rendered_export'), {'format': 'json', 'end': '2025-03-02'})
+        rows = json.loads(b''.join(response.streaming_content))
+        self.assertEqual([(row['quantity'], row['total']) for row in rows], [(1, 2500.0), (2, 5000.0)])
+        self.assertEqual(rows[0]['number_reception__patient__full_name'], 'Петров Петр Петрович')
+
+    def test_html_streaming(self):
+        self.client.force_login(self.user)
+        params = {'format': 'html', 'start': '2025-03-01', 'end': '2025-03-31', 'doctor': Doctor.objects.get().pk}
+        response = self.client.get(reverse('receptions_export'), params)
+        self.assertEqual(response['Content-Disposition'], 'inline; filename="receptions_2025-03-01_2025-03-31.html"')
+        chunks = iter(response.streaming_content)
+        # Начало страницы отдается до запроса строк
+        with self.assertNumQueries(0):
+            head = next(chunks).decode()
+        self.assertIn('<th>Пациент</th>', head)
+        self.assertNotIn('<tr id="reception_', head)
+        # Строки для печати больше никто не читает: в общий кэш строк они не пишутся
+        with mock.patch.object(cache, 'get_many') as get_many, mock.patch.object(cache, 'set_many') as set_many:
+            page = head + b''.join(chunks).decode()
+        get_many.assert_not_called()
+        set_many.assert_not_called()
+        self.assertEqual(page.count('<tr id="reception_'), 3)
+        self.assertIn('<td>Петров Петр Петрович</td>', page)
+        self.assertTrue(page.rstrip().endswith('</html>'))
+        other = self.client.get(reverse('receptions_export'), {**params, 'doctor': params['doctor'] + 1})
+        self.assertEqual(b''.join(other.streaming_content).decode().count('<tr id="reception_'), 0)
+
+    def test_html_matches_list(self):
+        self.client.force_login(self.user)
+
+        def table(content, entity, pk):
+            row = re.search(rf'<tr id="{entity}_{pk}".*?</tr>', content, re.S)[0]
+            return re.findall(r'<th>(.*?)</th>', content), re.findall(r'<td>(.*?)</td>', row, re.S)
+
+        for entity, name in (('reception', 'receptions'), ('service_rendered', 'services_rendered')):
+            with self.subTest(entity=entity):
+                pk = EXPORT_SOURCES[entity][0].objects.order_by('id').first().pk
+                listed = self.client.get(reverse(name)).content.decode()
+                printed = b''.join(self.client.get(reverse(f'{name}_export'), {'format': 'html'}).streaming_content).decode()
+                self.assertEqual(table(printed, entity, pk), table(listed, entity, pk))
+                # Кнопки изменения и удаления на печать не попадают
+                self.assertIn('bi-trash3-fill', listed)
+                self.assertNotIn('bi-trash3-fill', printed)
+
+    def test_gzip(self):
+        self.client.force_login(self.user)
+        response = self.client.get(reverse('receptions_export'), {'format': 'html'}, HTTP_ACCEPT_ENCODING='gzip, deflate')
+        self.assertEqual(response['Content-Encoding'], 'gzip')
+        self.assertIn('Accept-Encoding', response['Vary'])
+        chunks = list(response.streaming_content)
+        # Каждая порция дожата до границы: начало страницы распаковывается без остальных порций
+        self.assertIn('<thead>', zlib.decompressobj(31).decompress(chunks[0]).decode())
+        self.assertEqual(gzip.decompress(b''.join(chunks)).decode().count('<tr id="reception_'), 3)
+
+
+class ImportTests(TestCase):
+    """
+    Импорт из CSV: ошибочные строки попадают в отчет, остальные загружаются
+    """
+    @classmethod
+    def setUpTestData(cls):
+        cls.doctor = Doctor.objects.create(full_name='Цветков Игорь Борисович', phone_number='+79610000001', office_number='12')
+        cls.patient = Patient.objects.create(
+            full_name='Петров Петр Петрович', phone_number='+79620000001', patient_address='ул.Ленина д.1'
+        )
+        Reception.objects.create(
+            date_reception=datetime.date(2025, 3, 3), time_reception=datetime.time(10, 0),
+            doctor=cls.doctor, patient=cls.patient,
+        )
+
+    def test_patients(self):
+        file = io.StringIO(
+            'full_name,phone_number,patient_address\n'
+            'Сидоров Иван Иванович,+79630000001,ул.Мира д.2\n'
+            'Сидоров,+79630000002,ул.Мира д.3\n'
+            'Смирнов Олег Олегович,89620000001,ул.Мира д.4\n'
+            'Кузнецов Олег Олегович,+79630000003,ул.Мира д.5\n'
+            'Кузнецова Анна Олеговна,+79630000003,ул.Мира д.5\n'
+        )
+        # На порцию: поиск телефонов в БД и COPY в точке сохранения - без запросов на строку
+        with self.assertNumQueries(8):
+            result = import_csv(file, 'patients', batch_size=3)
+        self.assertEqual(result.imported, 2)
+        # Неверное ФИО, номер, уже записанный в БД (в другом формате), и повтор номера в самом файле
+        self.assertEqual([line for line, _ in result.errors], [3, 4, 6])
+        self.assertIn('уже используется', result.errors[1][1])
+        imported = Patient.objects.get(phone_number='+79630000003')
+        self.assertEqual(imported.full_name, 'Кузнецов Олег Олегович')
+        # COPY запускает триггер, который заполняет search_vector
+        self.assertIsNotNone(imported.search_vector)
+
+    def test_receptions(self):
+        file = io.StringIO(
+            'date_reception,time_reception,doctor_phone,patient_phone\n'
+            '2025-03-03,09:00,+79610000001,+79620000001\n'
+            '2025-03-03,10:15,+79610000001,+79620000001\n'
+            '2025-03-03,11:00,+79610000001,+79620000001\n'
+            '2025-03-03,11:15,+79610000001,+79620000001\n'
+            '2025-03-03,12:00,+79610000009,+79620000001\n'
+        )
+        result = import_csv(file, 'receptions')
+        self.assertEqual(result.imported, 2)
+        self.assertEqual([line for line, _ in result.errors], [3, 5, 6])
+        self.assertIn('не найден', result.errors[2][1])
+        self.assertEqual(
+            sorted(self.doctor.reception_set.values_list('time_reception', flat=True)),
+            [datetime.time(9, 0), datetime.time(10, 0), datetime.time(11, 0)],
+        )
+
+    def test_missing_columns(self):
+        result = import_csv(io.StringIO('full_name,phone\n'), 'patients')
+        self.assertEqual(result.imported, 0)
+        self.assertIn('patient_address, phone_number', result.errors[0][1])
+
+    def test_cp1251_upload(self):
+        User.objects.create_superuser('admin', password='admin')
+        self.client.login(username='admin', password='admin')
+        upload = io.BytesIO(
+            'full_name,phone_number,patient_address\nСидоров Иван Иванович,+79630000001,ул.Мира д.2\n'.encode('cp1251')
+        )
+        upload.name = 'patients.csv'
+        response = self.client.post(reverse('import'), {'kind': 'patients', 'file': upload})
+        self.assertEqual(response.status_code, 200)
+        result = response.context['result']
+        self.assertEqual(result.imported, 0)
+        self.assertIn('UTF-8', result.errors[0][1])
+        self.assertFalse(Patient.objects.filter(phone_number='+79630000001').exists())
+
+    def test_unreadable_line_keeps_loaded_batches(self):
+        # Первая порция загружена, во второй - байт не из UTF-8
+        data = 'full_name,phone_number,patient_address\nСидоров Иван Иванович,+79630000001,ул.Мира д.2\n'.encode()
+        data += 'Кузнецов Олег Олегович,+79630000002,ул.Мира д.3\n'.encode('cp1251')
+        file = io.TextIOWrapper(io.BytesIO(data), encoding='utf-8-sig', newline='')
+        # Маленький буфер: декодер доходит до второй строки только после загрузки первой
+        file._CHUNK_SIZE = 16
+        result = import_csv(file, 'patients', batch_size=1)
+        self.assertEqual(result.imported, 1)
+        self.assertEqual(result.errors, [(3, result.errors[0][1])])
+        self.assertIn('строки 2-2 обработаны, загружено строк: 1', result.errors[0][1])
+        self.assertTrue(Patient.objects.filter(phone_number='+79630000001').exists())
+
+    def test_upload_requires_permission(self):
+        User.objects.create_user('registry', password='registry')
+        self.client.login(username='registry', password='registry')
+        upload = io.BytesIO('full_name,phone_number,patient_address\n'.encode())
+        upload.name = 'patients.csv'
+        response = self.client.post(reverse('import'), {'kind': 'patients', 'file': upload})
+        self.assertEqual(response.status_code, 403)
+
+
+class SnapshotTests(TransactionTestCase):
+    """
+    Снимок и восстановление: те же строки, индексы и ограничения, id продолжаются за снимком
+    """
+    SCHEMA_SQL = """
+        SELECT conname FROM pg_constraint WHERE conrelid::regclass::text = ANY(%s)
+        UNION ALL
+        SELECT indexname FROM pg_indexes WHERE tablename = ANY(%s)
+    """
+    TABLES = [
+        'doctor', 'patient', 'reception', 'service', 'service_rendered', 'shedule',
+        'revenue_daily', 'revenue_daily_service',
+    ]
+
+    def schema(self):
+        with connection.cursor() as cursor:
+            cursor.execute(self.SCHEMA_SQL, [self.TABLES, self.TABLES])
+            return sorted(name for name, in cursor.fetchall())
+
+    def setUp(self):
+        self.doctor = Doctor.objects.create(full_name='Цветков Игорь Борисович', phone_number='+79610000001', office_number='12')
+        patient = Patient.objects.create(
+            full_name='Петров Петр Петрович', phone_number='+79620000001', patient_address='ул.Ленина д.1'
+        )
+        Schedule.objects.create(
+            doctor=self.doctor, day_week=1, start_reception=datetime.time(9, 0), end_reception=datetime.time(18, 0)
+        )
+        self.reception = Reception.objects.create(
+            date_reception=datetime.date(2030, 1, 7), time_reception=datetime.time(10, 0), doctor=self.doctor, patient=patient
+        )
+        service = Service.objects.create(service_name='Пломбирование зуба', cost=2500)
+        Service_rendered.objects.create(service=service, number_reception=self.reception, quantity=2)
+        self.path = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.path)
+
+    def test_restore(self):
+        schema = self.schema()
+        manifest = dump(self.path)
+        self.assertEqual({table['table']: table['rows'] for table in manifest['tables']}, dict.fromkeys(self.TABLES, 1))
+
+        Service_rendered.objects.all().delete()
+        self.reception.delete()
+        Patient.objects.create(full_name='Сидоров Иван Иванович', phone_number='+79630000001', patient_address='ул.Мира д.2')
+        restore(self.path)
+
+        self.assertEqual(self.schema(), schema)
+        self.assertEqual(list(Patient.objects.values_list('full_name', flat=True)), ['Петров Петр Петрович'])
+        rendered = Service_rendered.objects.select_related('number_reception__doctor', 'service').get()
+        self.assertEqual(rendered.number_reception.doctor.full_name, 'Цветков Игорь Борисович')
+        self.assertEqual(rendered.service.cost, 2500)
+        self.assertIsNotNone(Doctor.objects.get().search_vector)
+        # Последовательности сдвинуты за id снимка, ограничения снова проверяются
+        self.assertGreater(Patient.objects.create(full_name='Новый', phone_number='+79630000002').id, self.reception.patient_id)
+        with self.assertRaises(IntegrityError):
+            Reception.objects.create(
+                date_reception=datetime.date(2030, 1, 7), time_reception=datetime.time(10, 15), doctor=self.doctor
+            )
+
+    def test_rejects_other_migration(self):
+        dump(self.path)
+        with open(f'{self.path}/manifest.json', encoding='utf-8') as file:
+            manifest = json.load(file)
+        manifest['migration'] = '0001_initial'
+        with open(f'{self.path}/manifest.json', 'w', encoding='utf-8') as file:
+            json.dump(manifest, file)
+        with self.assertRaises(SnapshotError):
+            read_manifest(self.path)
+
+
+class RevenueSummaryTests(TestCase):
+    """
+    Сводки выручки после любых изменений приемов, оказанных услуг и услуг
+    совпадают с пересчетом по самим таблицам
+    """
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_superuser('revenue', password='revenue')
+        cls.doctors = Doctor.objects.bulk_create(
+            Doctor(full_name=f'Цветков Врач {i}', phone_number=f'+7961000000{i}', office_number=str(i)) for i in range(2)
+        )
+        cls.patient = Patient.objects.create(
+            full_name='Петров Петр Петрович', phone_number='+79620000001', patient_address='ул.Ленина д.1'
+        )
+        cls.services = Service.objects.bulk_create(
+            Service(service_name=name, cost=cost) for name, cost in (('Пломбирование зуба', 2500.5), ('Осмотр', 700))
+        )
+
+    def reception(self, doctor, day, hour=10):
+        return Reception.objects.create(
+            date_reception=datetime.date(2025, 3, day), time_reception=datetime.time(hour, 0),
+            doctor=self.doctors[doctor], patient=self.patient,
+        )
+
+    def summary(self):
+        daily = sorted(RevenueDaily.objects.values_list('doctor_id', 'day', 'visits', 'revenue'))
+        services = sorted(RevenueDailyService.objects.values_list('doctor_id', 'day', 'service_id', 'rendered', 'quantity', 'revenue'))
+        return daily, services
+
+    def expected(self):
+        daily, services = {}, {}
+        for reception in Reception.objects.filter(doctor__isnull=False):
+            key = (reception.doctor_id, reception.date_reception)
+            daily[key] = [daily.get(key, [0])[0] + 1, daily.get(key, [0, 0])[1]]
+        for rendered in Service_rendered.objects.select_related('number_reception', 'service').filter(
+            number_reception__doctor__isnull=False, service__isnull=False
+        ):
+            revenue = decimal.Decimal(str(rendered.service.cost * rendered.quantity)).quantize(decimal.Decimal('0.01'))
+            key = (rendered.number_reception.doctor_id, rendered.number_reception.date_reception)
+            daily[key][1] += revenue
+            row = services.setdefault(key + (rendered.service_id,), [0, 0, 0])
+            row[0] += 1
+            row[1] += rendered.quantity
+            row[2] += revenue
+        return (
+            sorted(key + (visits, revenue) for key, (visits, revenue) in daily.items()),
+            sorted(key + tuple(row) for key, row in services.items()),
+        )
+
+    def assertSummaryUpToDate(self):
+        summary = self.summary()
+        self.assertEqual(summary, self.expected())
+        rebuild()
+        self.assertEqual(self.summary(), summary)
+
+    def test_incremental_updates(self):
+        first = self.reception(0, 3)
+        second = self.reception(0, 3, hour=12)
+        third = self.reception(1, 4)
+        Service_rendered.objects.create(service=self.services[0], number_reception=first, quantity=2)
+        rendered = Service_rendered.objects.create(service=self.services[1], number_reception=second, quantity=1)
+        Service_rendered.objects.create(service=self.services[1], number_reception=third, quantity=3)
+        self.assertSummaryUpToDate()
+        self.assertEqual(
+            RevenueDaily.objects.get(doctor=self.doctors[0], day=datetime.date(2025, 3, 3)).revenue, decimal.Decimal('5701.00')
+        )
+
+        rendered.quantity = 4
+        rendered.save()
+        self.assertSummaryUpToDate()
+        # Прием перенесен к другому врачу на другой день вместе с услугами
+        second.doctor = self.doctors[1]
+        second.date_reception = datetime.date(2025, 3, 5)
+        second.save()
+        self.assertSummaryUpToDate()
+        Service.objects.filter(pk=self.services[1].pk).update(cost=750)
+        self.assertSummaryUpToDate()
+        rendered.delete()
+        self.assertSummaryUpToDate()
+        first.delete()
+        self.assertSummaryUpToDate()
+        self.services[1].delete()
+        self.doctors[1].delete()
+        self.assertSummaryUpToDate()
+        self.assertEqual(self.summary(), ([], []))
+
+    def test_report_reads_summary(self):
+        reception = self.reception(0, 3)
+        Service_rendered.objects.create(service=self.services[1], number_reception=reception, quantity=2)
+        self.client.force_login(self.user)
+        response = self.client.get(reverse('revenue'), {'start': '2025-03-01', 'end': '2025-03-31'})
+        self.assertContains(response, 'Приемов: 1, выручка: 1400,00 руб.')
+        self.assertContains(response, 'Осмотр: 1, 2, 1400,00')
+        signatures = '\n'.join(response.query_stats.signatures)
+        self.assertNotIn('"reception"', signatures)
+        self.assertNotIn('"service_rendered"', signatures)
+
+
+class UtilizationTests(TestCase):
+    """
+    Загрузка врачей: минуты приемов против минут по расписанию за две недели марта 2025
+    """
+    START, END = datetime.date(2025, 3, 3), datetime.date(2025, 3, 16)
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_superuser('utilization', password='utilization')
+        cls.doctor = Doctor.objects.create(full_name='Цветков Игорь Борисович', phone_number='+79610000001', office_number='12')
+        # Пересекающиеся смены в понедельник считаются один раз: 9:00-13:00
+        for start, end in ((datetime.time(9, 0), datetime.time(12, 0)), (datetime.time(11, 0), datetime.time(13, 0))):
+            Schedule.objects.create(doctor=cls.doctor, day_week=1, start_reception=start, end_reception=end)
+        for day, time in ((3, datetime.time(10, 0)), (3, datetime.time(12, 45)), (10, datetime.time(9, 0))):
+            Reception.objects.create(date_reception=datetime.date(2025, 3, day), time_reception=time, doctor=cls.doctor)
+
+    def test_utilization(self):
+        report = utilization(self.START, self.END, duration=30)
+        self.assertEqual(report['weeks'], ['2025-03-03', '2025-03-10'])
+        [doctor] = report['doctors']
+        self.assertEqual(
+            (doctor['name'], doctor['scheduled_minutes'], doctor['booked_minutes'], doctor['idle_minutes']),
+            ('Цветков Игорь Борисович', 480, 90, 390),
+        )
+        self.assertEqual(doctor['utilization'], 0.188)
+        self.assertEqual(doctor['weeks'], [0.25, 0.125])
+        monday_visits, monday = report['heatmap']['visits'][0], report['heatmap']['utilization'][0]
+        self.assertEqual((monday_visits[9], monday_visits[10], monday_visits[12]), (1, 1, 1))
+        # Прием 12:45-13:15: 15 минут из 120 по расписанию в 12 часов, 13 часов в расписании нет
+        self.assertEqual((monday[9], monday[12], monday[13]), (0.25, 0.125, None))
+        self.assertEqual(report['heatmap']['utilization'][1][10], None)
+
+    def test_cached_dashboard(self):
+        self.client.force_login(self.user)
+        params = {'start': self.START.isoformat(), 'end': self.END.isoformat(), 'format': 'json'}
+        cache.clear()
+        self.assertEqual(self.client.get(reverse('utilization'), params).json()['doctors'][0]['booked_minutes'], 90)
+        with self.assertNumQueries(0):
+            cached_utilization(self.START, self.END)
+        with self.captureOnCommitCallbacks(execute=True):
+            Reception.objects.create(date_reception=self.END, time_reception=datetime.time(10, 0), doctor=self.doctor)
+        self.assertEqual(cached_utilization(self.START, self.END)['doctors'][0]['booked_minutes'], 120)
+        self.assertContains(self.client.get(reverse('utilization'), {'start': self.START.isoformat()}), 'Цветков Игорь Борисович')
+
+
+class CatalogCacheTests(TransactionTestCase):
+    """
+    Справочники врачей и услуг: чтение из памяти без запросов, сброс по NOTIFY после фиксации
+    """
+    def setUp(self):
+        catalog._listener.poll()
+        notifications = catalog._listener.notifications
+        self.doctor = Doctor.objects.create(full_name='Цветков Игорь Борисович', phone_number='+79610000001', office_number='12')
+        self.service = Service.objects.create(service_name='Пломбирование зуба', cost=2500)
+        # Уведомления о вставках приходят асинхронно: опоздавшее сбросило бы справочник посреди теста
+        for _ in range(100):
+            if catalog._listener.poll() and catalog._listener.notifications >= notifications + 2:
+                break
+            time.sleep(0.02)
+        catalog.invalidate()
+
+    def test_read_through(self):
+        services = catalog.CATALOGS['service']
+        hits = services.hits
+        self.assertEqual(services.get(self.service.pk).cost, 2500)
+        catalog.CATALOGS['doctor'].get(self.doctor.pk)
+        with self.assertNumQueries(0):
+            self.assertEqual(services.get(self.service.pk).service_name, 'Пломбирование зуба')
+            self.assertIsNone(services.get(self.service.pk + 1))
+            # Поле формы проверяет выбранного врача тоже без запроса
+            self.assertEqual(ScheduleForm().fields['doctor'].clean(str(self.doctor.pk)), self.doctor)
+        stats = catalog.catalog_stats()['catalogs']
+        self.assertEqual((stats['service']['rows'], stats['service']['hits'] - hits), (1, 2))
+        self.assertGreater(stats['service']['bytes'], 0)
+        self.assertTrue(catalog.catalog_stats()['listener']['connected'])
+
+    def test_notify_from_other_connection(self):
+        services = catalog.CATALOGS['service']
+        services.get(self.service.pk)
+        # Изменение в другом соединении - как из другого воркера: локальные сигналы не срабатывают
+        other = connections.create_connection('default')
+        self.addCleanup(other.close)
+        with other.cursor() as cursor:
+            cursor.execute("UPDATE service SET cost = 3000 WHERE id = %s", [self.service.pk])
+        for _ in range(100):
+            if services.get(self.service.pk).cost == 3000:
+                break
+            time.sleep(0.02)
+        self.assertEqual(services.get(self.service.pk).cost, 3000)
+        self.assertGreaterEqual(catalog.catalog_stats()['listener']['notifications'], 1)
+
+    def test_not_filled_inside_transaction(self):
+        services = catalog.CATALOGS['service']
+        with transaction.atomic():
+            Service.objects.filter(pk=self.service.pk).update(cost=100)
+            self.assertEqual(services.get(self.service.pk).cost, 100)
+            transaction.set_rollback(True)
+        self.assertIsNone(services.stats()['rows'])
+        self.assertEqual(services.get(self.service.pk).cost, 2500)
+
+
+class LiveBoardTests(TransactionTestCase):
+    """
+    Живая доска: поток SSE присылает только изменившиеся строки фрагментами с hx-swap-oob
+    """
+    def next_event(self, chunks):
+        for chunk in chunks:
+            chunk = chunk.decode()
+            if chunk.startswith('event: rows'):
+                return chunk
+        self.fail('Поток закрылся без события')
+
+    def test_stream(self):
+        with mock.patch.object(live, 'LIVE_HEARTBEAT', 0.1):
+            response = self.client.get(reverse('reception_live'))
+            self.assertEqual(response['Content-Type'], 'text/event-stream')
+            chunks = iter(response.streaming_content)
+            # Первый кусок отдается после подписки: слушатель уже выполнил LISTEN
+            self.assertEqual(next(chunks), b'retry: 3000\n\n')
+            self.addCleanup(response.close)
+
+            reception = Reception.objects.create(date_reception=datetime.date(2030, 1, 7), time_reception=datetime.time(10, 0))
+            event = self.next_event(chunks)
+            self.assertIn('afterbegin:#reception_rows', event)
+            self.assertIn(f'id="reception_{reception.id}"', event)
+
+            Reception.objects.filter(pk=reception.pk).update(time_reception=datetime.time(11, 30))
+            event = self.next_event(chunks)
+            self.assertIn(f'id="reception_{reception.id}" hx-swap-oob="outerHTML"', event)
+            self.assertIn('11:30', event)
+
+            pk = reception.pk
+            reception.delete()
+            self.assertIn(f'id="reception_{pk}" hx-swap-oob="delete"', self.next_event(chunks))
+        self.assertEqual(live.hub.stats()['subscribers'], 1)
+
+    def test_search_stream(self):
+        with mock.patch.object(live, 'LIVE_HEARTBEAT', 0.1):
+            response = self.client.get(reverse('reception_live'), {'q': 'Цветков'})
+            chunks = iter(response.streaming_content)
+            next(chunks)
+            self.addCleanup(response.close)
+            # Новая строка может не подходить под поиск: таблица ее не получает, только счетчик
+            Reception.objects.create(date_reception=datetime.date(2030, 1, 7), time_reception=datetime.time(10, 0))
+            event = self.next_event(chunks)
+            self.assertNotIn('afterbegin', event)
+            self.assertIn('Новых записей: 1', event)
+            self.assertIn('href="?q=%D0%A6', event)
+            Reception.objects.create(date_reception=datetime.date(2030, 1, 8), time_reception=datetime.time(10, 0))
+            self.assertIn('Новых записей: 2', self.next_event(chunks))
+
+    def test_listener_stops_with_last_subscriber(self):
+        response = self.client.get(reverse('reception_live'))
+        next(iter(response.streaming_content))
+        thread = live.hub.thread
+        response.close()
+        # Слушателя будит канал пробуждения, а не таймаут select
+        thread.join(0.3)
+        self.assertFalse(thread.is_alive())
+        self.assertFalse(live.hub.stats()['listening'])
+
+    def test_changes(self):
+        events = [
+            {'table': 'reception', 'op': 'INSERT', 'ids': [1, 2]},
+            {'table': 'service_rendered', 'op': 'DELETE', 'ids': [3]},
+            {'table': 'reception', 'op': 'UPDATE', 'ids': [1, 4]},
+            {'table': 'reception', 'op': 'DELETE', 'ids': [2]},
+        ]
+        self.assertEqual(live.changes('reception', events), ({1: 'INSERT', 2: 'DELETE', 4: 'UPDATE'}, False))
+        self.assertEqual(live.changes('reception', [{'table': 'reception', 'op': 'INSERT', 'ids': None}]), ({}, True))
+
+
+class RowFragmentCacheTests(TestCase):
+    """
+    Кэш строк таблиц: строка отрисовывается заново, только если изменились ее колонки или права
+    """
+    TEMPLATE = 'receptions/reception_row.html'
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user('registry', password='registry')
+        cls.user.user_permissions.add(*Permission.objects.filter(codename__in=['change_reception', 'delete_reception']))
+        doctor = Doctor.objects.create(full_name='Цветков Игорь Борисович', phone_number='+79610000001', office_number='12')
+        for hour in (9, 10, 11):
+            Reception.objects.create(date_reception=datetime.date(2030, 1, 7), time_reception=datetime.time(hour, 0), doctor=doctor)
+
+    def setUp(self):
+        cache.clear()
+        self.rows = list(list_values(Reception.objects.order_by('-id'), ('-id',)))
+
+    def request(self, user):
+        request = RequestFactory().get(reverse('receptions'))
+        request.user = user
+        return request
+
+    def test_rows_rendered_once(self):
+        request = self.request(User.objects.get(pk=self.user.pk))
+        with mock.patch.object(Template, 'render', autospec=True, side_effect=Template.render) as render:
+            first = render_rows(request, 'reception', self.TEMPLATE, self.rows)
+            self.assertEqual(render.call_count, 3)
+            self.assertEqual(render_rows(request, 'reception', self.TEMPLATE, self.rows), first)
+            self.assertEqual(render.call_count, 3)
+
+            # Правка одной строки, в том числе поля связанной таблицы, меняет только ее ключ
+            self.rows[1] = {**self.rows[1], 'doctor__full_name': 'Шубина Анна Игоревна'}
+            changed = render_rows(request, 'reception', self.TEMPLATE, self.rows)
+            self.assertEqual(render.call_count, 4)
+            self.assertEqual((changed[0], changed[2]), (first[0], first[2]))
+            self.assertIn('Шубина Анна Игоревна', changed[1])
+        self.assertIn(reverse('reception_edit', args=[self.rows[0]['id']]), first[0])
+
+    def test_permissions_in_key(self):
+        render_rows(self.request(User.objects.get(pk=self.user.pk)), 'reception', self.TEMPLATE, self.rows)
+        anonymous = render_rows(self.request(AnonymousUser()), 'reception', self.TEMPLATE, self.rows)
+        self.assertNotIn(reverse('reception_edit', args=[self.rows[0]['id']]), anonymous[0])
+
+
+class ConditionalListTests(TestCase):
+    """
+    Условный GET списков: 304 без тела, пока не изменились таблицы, запрос и права
+    """
+    @classmethod
+    def setUpTestData(cls):
+        Service.objects.create(service_name='Пломбирование зуба', cost=2500)
+
+    def setUp(self):
+        cache.clear()
+
+    def test_not_modified(self):
+        response = self.client.get(reverse('services'))
+        etag = response['ETag']
+        # Время изменения таблицы не учитывает пользователя и запрос: проверка только по ETag
+        self.assertNotIn('Last-Modified', response)
+        self.assertEqual(
+            self.client.get(reverse('services'), HTTP_IF_MODIFIED_SINCE=http_date(time.time() + 60)).status_code, 200
+        )
+        self.assertEqual(response['Vary'], 'HX-Request, Cookie')
+        with self.assertNumQueries(0):
+            response = self.client.get(reverse('services'), HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual((response.status_code, response.content), (304, b''))
+
+        # Таблица HTMX-поиска и другой запрос - другие ответы
+        self.assertEqual(self.client.get(reverse('services'), HTTP_IF_NONE_MATCH=etag, HTTP_HX_REQUEST='true').status_code, 200)
+        self.assertEqual(self.client.get(reverse('services'), {'q': 'зуб'}, HTTP_IF_NONE_MATCH=etag).status_code, 200)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            Service.objects.create(service_name='Удаление зуба', cost=1500)
+        response = self.client.get(reverse('services'), HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response['ETag'], etag)
+
+    def test_permissions_change_etag(self):
+        etag = self.client.get(reverse('services'))['ETag']
+        User.objects.create_superuser('admin', password='admin')
+        self.client.login(username='admin', password='admin')
+        self.assertEqual(self.client.get(reverse('services'), HTTP_IF_NONE_MATCH=etag).status_code, 200)
+
+    def test_relative_date_etag(self):
+        def etag(search, today):
+            with mock.patch('django.utils.timezone.localdate', return_value=today):
+                return self.client.get(reverse('receptions'), {'q': search})['ETag']
+        # "Март" 31 декабря и 1 января - разные месяцы; дата с годом от сегодняшнего дня не зависит
+        for search in ('март', '12 марта', '12.03'):
+            with self.subTest(search=search):
+                self.assertNotEqual(etag(search, datetime.date(2026, 12, 31)), etag(search, datetime.date(2027, 1, 1)))
+        for search in ('март 2026', '12.03.2026', 'Иванов'):
+            with self.subTest(search=search):
+                self.assertEqual(etag(search, datetime.date(2026, 12, 31)), etag(search, datetime.date(2027, 1, 1)))
+
+
+class PaginationTests(TestCase):
+    """
+    Страницы по курсору: порядок с равными ключами, конец списка, подделанный курсор
+    """
+    @classmethod
+    def setUpTestData(cls):
+        # Пять услуг с одинаковым названием: порядок между ними задает id
+        cls.services = [Service.objects.create(service_name='Чистка', cost=1000) for _ in range(5)]
+        Service.objects.create(service_name='Анестезия', cost=500)
+
+    def page(self, cursor=None):
+        return keyset_page(list_values(Service.objects.all(), SERVICE_ORDERING), SERVICE_ORDERING, cursor, size=2)
+
+    def test_pages(self):
+        pages, cursor = [], None
+        while True:
+            page = self.page(cursor)
+            pages.append([row['id'] for row in page.object_list])
+            if not page.has_next:
+                break
+            cursor = page.next_cursor
+        ordered = [service.pk for service in Service.objects.order_by(*SERVICE_ORDERING)]
+        self.assertEqual(pages[0][0], Service.objects.get(service_name='Анестезия').pk)
+        # Строки с равным названием не теряются и не повторяются на границе страниц
+        self.assertEqual(sum(pages, []), ordered)
+        self.assertEqual([len(ids) for ids in pages], [2, 2, 2])
+        self.assertIsNone(page.next_cursor)
+
+    def test_bad_cursor(self):
+        for cursor in ('не-base64!', encode_cursor(['Чистка']), encode_cursor([None, 1]),
+                       encode_cursor([['Чистка'], 1]), encode_cursor([True, 1])):
+            with self.subTest(cursor=cursor):
+                self.assertEqual(self.client.get(reverse('services'), {'cursor': cursor}).status_code, 400)
+        cursor = self.page().next_cursor
+        self.assertEqual(self.client.get(reverse('services'), {'cursor': cursor}).status_code, 200)
+
+
+class SearchVectorTests(TestCase):
+    """
+    Векторы приемов и расписания содержат ФИО врача и пациента и пересчитываются
+    триггерами при их переименовании
+    """
+    @classmethod
+    def setUpTestData(cls):
+        cls.doctor = Doctor.objects.create(full_name='Иванов Петр Сергеевич', phone_number='+79610000001', office_number='1')
+        cls.patient = Patient.objects.create(
+            full_name='Сидорова Анна Павловна', phone_number='+79610000002', patient_address='ул. Ленина 1',
+        )
+        cls.reception = Reception.objects.create(
+            date_reception=datetime.date(2026, 3, 2), time_reception=datetime.time(10), doctor=cls.doctor, patient=cls.patient,
+        )
+        cls.schedule = Schedule.objects.create(
+            doctor=cls.doctor, day_week=1, start_reception=datetime.time(9), end_reception=datetime.time(18),
+        )
+
+    def found(self, model, text):
+        return list(model.objects.filter(search_vector=SearchQuery(text, config='russian')).values_list('id', flat=True))
+
+    def test_doctor_rename(self):
+        self.assertEqual(self.found(Reception, 'Иванов'), [self.reception.pk])
+        Doctor.objects.filter(pk=self.doctor.pk).update(full_name='Цветков Петр Сергеевич')
+        for model, pk in ((Reception, self.reception.pk), (Schedule, self.schedule.pk)):
+            with self.subTest(model=model.__name__):
+                self.assertEqual(self.found(model, 'Цветков'), [pk])
+                self.assertEqual(self.found(model, 'Иванов'), [])
+
+    def test_patient_rename(self):
+        self.patient.full_name = 'Шубина Анна Павловна'
+        self.patient.save()
+        self.assertEqual(self.found(Reception, 'Шубина'), [self.reception.pk])
+        self.assertEqual(self.found(Reception, 'Сидорова'), [])
+        # ФИО врача при этом из вектора не пропадает
+        self.assertEqual(self.found(Reception, 'Иванов'), [self.reception.pk])
+
+    def test_gin_index(self):
+        with connection.cursor() as cursor:
+            # В маленькой таблице планировщик предпочел бы Seq Scan: проверяем, что индекс применим
+            cursor.execute("SET LOCAL enable_seqscan = off")
+        for model, index in ((Reception, 'reception_search_vector_gin'), (Schedule, 'shedule_search_vector_gin')):
+            with self.subTest(model=model.__name__):
+                plan = model.objects.filter(search_vector=SearchQuery('Иванов', config='russian')).explain()
+                self.assertIn(index, plan)
+
+
+class ParseQueryTests(SimpleTestCase):
+    """
+    Разбор строки поиска на даты, время, телефоны и числа
+    """
+    def assertTokens(self, search, tokens, text=''):
+        query = parse_query(search)
+        self.assertEqual([(kind, value) for kind, raw, value in query.tokens], tokens)
+        self.assertEqual(query.text, text)
+
+    def test_dates(self):
+        day = datetime.date(2026, 3, 12)
+        march = (datetime.date(2026, 3, 1), datetime.date(2026, 3, 31))
+        year = datetime.date.today().year
+        self.assertTokens('2026-03-12', [('date', (day, day))])
+        self.assertTokens('Иванов 12 марта 2026 г.', [('date', (day, day))], 'Иванов')
+        self.assertTokens('12.03.2026', [('date', (day, day))])
+        self.assertTokens('март 2026', [('date', march)])
+        self.assertTokens('марта', [('date', (datetime.date(year, 3, 1), datetime.date(year, 3, 31)))])
+        # Сокращение месяца - только рядом с числом дня или года
+        self.assertTokens('12 мар', [('date', (datetime.date(year, 3, 12), datetime.date(year, 3, 12)))])
+        self.assertTokens('сент 2026', [('date', (datetime.date(2026, 9, 1), datetime.date(2026, 9, 30)))])
+
+    def test_relative_dates(self):
+        for search in ('март', '12 мар', '12.03', '12.03.26 март'):
+            with self.subTest(search=search):
+                self.assertTrue(parse_query(search).relative_dates)
+        for search in ('2026-03-12', '12 марта 2026', '12.03.26', 'сент 2026', 'Иванов 10:30'):
+            with self.subTest(search=search):
+                self.assertFalse(parse_query(search).relative_dates)
+
+    def test_month_prefix_is_text(self):
+        for search in ('сен', 'мар', 'дек', 'окт', 'ноя', 'Сенина'):
+            with self.subTest(search=search):
+                self.assertTokens(search, [], search)
+        self.assertTokens('12 марок', [('number', 12)], 'марок')
+
+    def test_time(self):
+        self.assertTokens('10:30', [('time', datetime.time(10, 30))])
+
+    def test_phone(self):
+        self.assertTokens('+7 961 000-00-01', [('phone', '79610000001')])
+        self.assertTokens('89610000001', [('phone', '79610000001')])
+        self.assertTokens('961-00-01', [('phone', '9610001')])
+
+    def test_bare_digits_are_number(self):
+        self.assertTokens('123456', [('number', 123456)])
+        self.assertTokens('12345678', [('number', 12345678)])
+
+    def test_decimal(self):
+        self.assertTokens('2500,50', [('decimal', 2500.5)])
+
+
+class SearchRankingTests(TestCase):
+    """
+    Результаты поиска: порядок по оценке, не больше SEARCH_RESULTS строк за раз, прерывание по времени
+    """
+    @classmethod
+    def setUpTestData(cls):
+        for name in ('Сложное удаление ретинированного зуба мудрости', 'Удаление зуба', 'Удаление зуба мудрости'):
+            Service.objects.create(service_name=name, cost=1000)
+        doctor = Doctor.objects.create(full_name='Цветков Игорь Борисович', phone_number='+79610000001', office_number='12')
+        # Приемы без пациента: похожесть по его ФИО - NULL
+        Reception.objects.bulk_create(
+            Reception(date_reception=datetime.date(2026, 3, 1) + datetime.timedelta(days=i), time_reception=datetime.time(10), doctor=doctor)
+            for i in range(25)
+        )
+        Reception.objects.create(date_reception=datetime.date(2026, 3, 1), time_reception=datetime.time(10))
+
+    def setUp(self):
+        cache.clear()
+
+    def test_score_without_related_names(self):
+        text = 'Цветков'
+        reception = Reception.objects.annotate(score=search_score(
+            F('search_vector'), SearchQuery(text, config='russian'),
+            TrigramSimilarity('doctor__full_name', text), TrigramSimilarity('patient__full_name', text),
+        )).get(doctor=None)
+        self.assertEqual(reception.score, 0.0)
+
+    def test_ranking(self):
+        response = self.client.get(reverse('services'), {'q': 'удаление зуба'})
+        rows = response.context['services']
+        self.assertEqual(
+            [row['service_name'] for row in rows],
+            ['Удаление зуба', 'Удаление зуба мудрости', 'Сложное удаление ретинированного зуба мудрости'],
+        )
+        self.assertEqual([row['score'] for row in rows], sorted((row['score'] for row in rows), reverse=True))
+
+    def test_top_results_then_next_page(self):
+        response = self.client.get(reverse('receptions'), {'q': 'Цветков'})
+        first = response.context['receptions']
+        self.assertEqual(len(first), 20)
+        self.assertTrue(all(row['score'] is not None for row in first))
+        response = self.client.get(response.context['next_page_url'])
+        self.assertEqual(response.status_code, 200)
+        rest = response.context['receptions']
+        self.assertIsNone(response.context['next_page_url'])
+        self.assertEqual(len({row['id'] for row in list(first) + list(rest)}), 25)
+
+    @override_settings(SEARCH_STATEMENT_TIMEOUT=50)
+    def test_statement_timeout(self):
+        def slow_page(*args, **kwargs):
+            with connection.cursor() as cursor:
+                cursor.execute("SELECT pg_sleep(1)")
+
+        with mock.patch('stomatology.views.keyset_page', side_effect=slow_page):
+            response = self.client.get(reverse('services'), {'q': 'удаление'})
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.context['search_timeout'])
+        self.assertEqual(list(response.context['services']), [])
+        # Прерванный поиск не кэшируется и не получает ETag: повтор выполнится заново
+        self.assertNotIn('ETag', response)
+        self.assertEqual(len(self.client.get(reverse('services'), {'q': 'удаление'}).context['services']), 3)
+
+
+class SearchCacheTests(TestCase):
+    """
+    Кэш результатов поиска: повтор без запросов к БД, сброс после фиксации изменения зависимой таблицы
+    """
+    @classmethod
+    def setUpTestData(cls):
+        cls.doctor = Doctor.objects.create(full_name='Цветков Игорь Борисович', phone_number='+79610000001', office_number='12')
+        Reception.objects.create(date_reception=datetime.date(2026, 3, 2), time_reception=datetime.time(10), doctor=cls.doctor)
+
+    def setUp(self):
+        cache.clear()
+
+    def search(self):
+        return self.client.get(reverse('receptions'), {'q': 'Цветков'})
+
+    def test_repeated_search(self):
+        first = self.search()
+        with self.assertNumQueries(0):
+            second = self.search()
+        self.assertEqual(list(second.context['receptions']), list(first.context['receptions']))
+        self.assertEqual(search_cache_stats()['reception'], {'hits': 1, 'misses': 1, 'coalesced': 0})
+
+    def test_dependency_invalidates_after_commit(self):
+        self.search()
+        with self.captureOnCommitCallbacks() as callbacks:
+            self.doctor.full_name = 'Цветков Олег Борисович'
+            self.doctor.save()
+            # До фиксации другие запросы видят старые данные - и старый кэш
+            self.assertNotContains(self.search(), 'Олег')
+        for callback in callbacks:
+            callback()
+        self.assertContains(self.search(), 'Цветков Олег Борисович')
+        self.assertEqual(search_cache_stats()['reception']['misses'], 2)
+
+
+class SingleflightTests(TestCase):
+    """
+    Одновременные одинаковые поиски: один запрос к БД, отказ от ненужного, ошибка у каждого ожидающего
+    """
+    CALLERS = 5
+
+    def run_concurrently(self, group, fn, count=CALLERS):
+        results = [None] * count
+
+        def caller(i):
+            try:
+                results[i] = group.do('key', fn)
+            except Exception as error:
+                results[i] = error
+
+        threads = [threading.Thread(target=caller, args=(i,)) for i in range(count)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join(5)
+        return results
+
+    def leader(self, result):
+        """
+        Функция, которая ждет, пока к ней присоединятся все остальные вызовы
+        """
+        calls = []
+
+        def fn(call):
+            calls.append(call)
+            for _ in range(250):
+                if len(call.waiters) == self.CALLERS - 1:
+                    break
+                time.sleep(0.02)
+            return result()
+        return fn, calls
+
+    def test_coalescing(self):
+        fn, calls = self.leader(lambda: 'page')
+        self.assertEqual(self.run_concurrently(Group(), fn), ['page'] * self.CALLERS)
+        self.assertEqual(len(calls), 1)
+
+    def test_error_for_each_waiter(self):
+        def fail():
+            try:
+                raise KeyError('cause')
+            except KeyError as cause:
+                raise ValueError('boom') from cause
+        fn, calls = self.leader(fail)
+        errors = self.run_concurrently(Group(), fn)
+        self.assertEqual(len(calls), 1)
+        self.assertTrue(all(isinstance(error, ValueError) and str(error) == 'boom' for error in errors))
+        self.assertTrue(all(isinstance(error.__cause__, KeyError) for error in errors))
+        self.assertEqual(len({id(error) for error in errors}), self.CALLERS)
+
+    def test_waiter_abandons(self):
+        group, release = Group(), threading.Event()
+        leader = threading.Thread(target=group.do, args=('key', lambda call: release.wait(5)))
+        leader.start()
+        while 'key' not in group._calls:
+            time.sleep(0.01)
+        wakeup = threading.Event()
+        wakeup.set()
+        with self.assertRaises(Abandoned):
+            group.do('key', lambda call: None, wakeup)
+        release.set()
+        leader.join(5)
+        self.assertEqual(group._calls, {})
+
+    def test_leader_abandoned_before_running(self):
+        search_request, waiter = SearchRequest(), {}
+
+        def fn(call):
+            while not call.waiters:
+                time.sleep(0.01)
+            # Новое нажатие клавиши в сессии первого вызова, пока тот не начал SQL-запрос
+            search_request.abandon()
+            try:
+                return _run_search('service', 'key', search_request, call, lambda: 'page')
+            finally:
+                connection.close()
+
+        def wait():
+            waiter['page'] = flights.do('key', lambda call: None)
+
+        thread = threading.Thread(target=wait)
+        leader = threading.Thread(target=lambda: flights.do('key', fn, search_request.wakeup))
+        leader.start()
+        while 'key' not in flights._calls:
+            time.sleep(0.01)
+        thread.start()
+        leader.join(5)
+        thread.join(5)
+        self.assertEqual(waiter, {'page': 'page'})
+        self.assertEqual(flights._calls, {})
+
+    def test_cancel_only_running_statement(self):
+        search_request = SearchRequest()
+        search_request.cancel = mock.Mock()
+        search_request.abandon()
+        search_request.cancel.assert_not_called()
+
+        # Результат ждет другой вызов: запрос доводится до конца
+        search_request = SearchRequest()
+        search_request.key, search_request.call = 'key', mock.Mock(waiters=[threading.Event()])
+        search_request.cancel, search_request.running = mock.Mock(), True
+        search_request.abandon()
+        search_request.cancel.assert_not_called()
+
+    def test_abandon_cancels_query(self):
+        search_request, outcome = SearchRequest(), {}
+
+        def compute():
+            with connection.cursor() as cursor:
+                cursor.execute("SELECT pg_sleep(5)")
+
+        def run():
+            try:
+                flights.do(
+                    'key', lambda call: _run_search('service', 'key', search_request, call, compute),
+                    search_request.wakeup,
+                )
+            except Exception as error:
+                outcome['error'] = error
+            finally:
+                connection.close()
+
+        thread = threading.Thread(target=run)
+        thread.start()
+        while not search_request.running:
+            time.sleep(0.01)
+        time.sleep(0.1)
+        started = time.monotonic()
+        search_request.abandon()
+        thread.join(5)
+        self.assertLess(time.monotonic() - started, 2)
+        self.assertIsInstance(outcome['error'], OperationalError)
+        self.assertTrue(query_canceled(outcome['error']))
+        self.assertFalse(search_request.running)
+
+
+class ConnectionPoolTests(TestCase):
+    """
+    Пул соединений процесса (app.db.postgresql_pool): выдача и возврат, очередь, сломанные соединения
+    """
+    def pool(self, **options):
+        params = connection.get_connection_params()
+        pool = ConnectionPool(lambda: psycopg2.connect(**params), **options)
+        self.addCleanup(pool.close)
+        return pool
+
+    def test_checkout_and_return(self):
+        pool = self.pool(max_size=2)
+        first = pool.getconn()
+        pool.putconn(first)
+        self.assertIs(pool.getconn(), first)
+        second = pool.getconn()
+        self.assertIsNot(second, first)
+        stats = pool.stats()
+        self.assertEqual((stats['open'], stats['in_use'], stats['connections_opened'], stats['requests']), (2, 2, 2, 3))
+        pool.putconn(first)
+        pool.putconn(second)
+        self.assertEqual(pool.stats()['idle'], 2)
+
+    def test_exhausted_pool_times_out(self):
+        pool = self.pool(max_size=1, timeout=0.1)
+        taken = pool.getconn()
+        with self.assertRaises(PoolTimeout):
+            pool.getconn()
+        self.assertEqual(pool.stats()['timeouts'], 1)
+        pool.putconn(taken)
+
+    def test_waiter_gets_returned_connection(self):
+        pool = self.pool(max_size=1, timeout=5)
+        taken, received = pool.getconn(), []
+        waiter = threading.Thread(target=lambda: received.append(pool.getconn()))
+        waiter.start()
+        while not pool.stats()['waiting']:
+            time.sleep(0.01)
+        pool.putconn(taken)
+        waiter.join(5)
+        self.assertEqual(received, [taken])
+        self.assertEqual(pool.stats()['waits'], 1)
+        pool.putconn(taken)
+
+    def test_broken_connection_discarded(self):
+        pool = self.pool(max_size=1)
+        broken = pool.getconn()
+        broken.close()
+        pool.putconn(broken)
+        self.assertEqual((pool.stats()['idle'], pool.stats()['connections_closed']), (0, 1))
+        fresh = pool.getconn()
+        self.assertFalse(fresh.closed)
+
+        # Прерванная транзакция откатывается, соединение остается в пуле
+        with fresh.cursor() as cursor:
+            with self.assertRaises(psycopg2.Error):
+                cursor.execute("SELECT 1 / 0")
+        pool.putconn(fresh)
+        self.assertIs(pool.getconn(), fresh)
+        self.assertEqual(fresh.info.transaction_status, psycopg2.extensions.TRANSACTION_STATUS_IDLE)
+        pool.putconn(fresh)
+
+    def test_dead_idle_connection_replaced(self):
+        pool = self.pool(max_size=1, check_after=0)
+        idle = pool.getconn()
+        pid = idle.info.backend_pid
+        pool.putconn(idle)
+        with connection.cursor() as cursor:
+            cursor.execute("SELECT pg_terminate_backend(%s)", [pid])
+        fresh = pool.getconn()
+        self.assertIsNot(fresh, idle)
+        self.assertEqual(pool.stats()['checks_failed'], 1)
+        pool.putconn(fresh)
+
+    def test_close_pools(self):
+        params = connection.get_connection_params()
+        database = params['dbname']
+        key = ('pool-test', database)
+        pool = get_pool(key, lambda: psycopg2.connect(**params))
+        idle, in_use = pool.getconn(), pool.getconn()
+        pool.putconn(idle)
+        close_pools(database + '-other')
+        self.assertIs(_pools[key], pool)
+        close_pools(database)
+        self.assertNotIn(key, _pools)
+        self.assertTrue(idle.closed)
+        # Занятое соединение закрывается, когда его вернут
+        pool.putconn(in_use)
+        self.assertTrue(in_use.closed)
+
+
+@override_settings(ROOT_URLCONF='app.urls_asgi')
+class AsyncViewTests(TestCase):
+    """
+    Асинхронные списки и выгрузки (async_views.py) через AsyncClient: те же ответы, бюджет запросов и 304
+    """
+    LISTS = {
+        'doctors': async_views.doctors_get,
+        'patients': async_views.patients_get,
+        'schedules': async_views.schedules_get,
+        'services': async_views.services_get,
+        'services_rendered': async_views.service_rendereds_get,
+        'receptions': async_views.receptions_get,
+    }
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_superuser('async', password='async')
+        doctor = Doctor.objects.create(full_name='Иванов Игорь Борисович', phone_number='+79610000001', office_number='12')
+        patient = Patient.objects.create(
+            full_name='Иванова Анна Павловна', phone_number='+79610000002', patient_address='ул. Ленина 1',
+        )
+        service = Service.objects.create(service_name='Иванова проба', cost=500)
+        reception = Reception.objects.create(
+            date_reception=datetime.date(2026, 3, 2), time_reception=datetime.time(10), doctor=doctor, patient=patient,
+        )
+        Service_rendered.objects.create(service=service, number_reception=reception, quantity=1)
+        Schedule.objects.create(doctor=doctor, day_week=1, start_reception=datetime.time(9), end_reception=datetime.time(18))
+
+    def setUp(self):
+        cache.clear()
+        self.async_client = AsyncClient()
+        self.async_client.force_login(self.user)
+
+    async def test_lists(self):
+        for name, view in self.LISTS.items():
+            for params, budget in (({}, view.query_budget), ({'q': 'Иванов'}, view.search_query_budget)):
+                with self.subTest(name=name, params=params):
+                    response = await self.async_client.get(reverse(name), params)
+                    self.assertEqual(response.status_code, 200)
+                    self.assertEqual(len(response.context[name]), 1)
+                    self.assertLessEqual(response.query_stats.count, budget)
+
+    async def test_not_modified(self):
+        response = await self.async_client.get(reverse('services'))
+        response = await self.async_client.get(reverse('services'), headers={'If-None-Match': response['ETag']})
+        self.assertEqual((response.status_code, response.content), (304, b''))
+
+    async def test_exports(self):
+        for name in ('receptions_export', 'services_rendered_export'):
+            with self.subTest(name=name):
+                response = await self.async_client.get(reverse(name), {'format': 'csv'})
+                self.assertEqual(response.status_code, 200)
+                content = b''.join([chunk async for chunk in response.streaming_content]).decode('utf-8-sig')
+                self.assertIn('Иванов', content)
+        response = await AsyncClient().get(reverse('receptions_export'))
+        self.assertEqual(response.status_code, 403)
+
+
+def tearDownModule():
+    # Соединения слушателей к тестовой БД иначе помешают ее удалить
+    catalog._listener.close()
+    if live.hub.thread is not None:
+        live.hub.thread.join()
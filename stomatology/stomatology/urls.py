@@ -6,13 +6,22 @@ urlpatterns = [
     path('register/', views.UserRegisterView.as_view(), name='register'),
     path('login/', views.UserLoginView.as_view(), name='login'),
     path('logout/', views.UserLogoutView.as_view(), name='logout'),
+    path('import/', views.import_upload, name='import'),
+    path('revenue/', views.revenue_get, name='revenue'),
+    path('analytics/utilization/', views.utilization_get, name='utilization'),
+    path('metrics/search-cache/', views.search_cache_metrics, name='search_cache_metrics'),
+    path('metrics/db-pool/', views.db_pool_metrics, name='db_pool_metrics'),
+    path('metrics/catalog-cache/', views.catalog_cache_metrics, name='catalog_cache_metrics'),
+    path('metrics/live/', views.live_metrics, name='live_metrics'),
 
     path('doctors/', views.doctors_get, name='doctors'),
+    path('doctors/autocomplete/', views.doctor_autocomplete, name='doctor_autocomplete'),
     path('doctor/add/', views.DoctorAdd.as_view(), name='doctor_add'),
     path('doctor/<int:pk>/edit', views.DoctorEdit.as_view(), name='doctor_edit'),
     path("doctor/<int:pk>/delete/", views.DoctorDelete.as_view(), name="doctor_delete"),
 
     path('patients/', views.patients_get, name='patients'),
+    path('patients/autocomplete/', views.patient_autocomplete, name='patient_autocomplete'),
     path('patient/add/', views.PatientAdd.as_view(), name='patient_add'),
     path('patient/<int:pk>/edit', views.PatientEdit.as_view(), name='patient_edit'),
     path("patient/<int:pk>/delete/", views.PatientDelete.as_view(), name="patient_delete"),
@@ -23,16 +32,23 @@ urlpatterns = [
     path("schedule/<int:pk>/delete/", views.ScheduleDelete.as_view(), name="schedule_delete"),
 
     path('services/', views.services_get, name='services'),
+    path('services/autocomplete/', views.service_autocomplete, name='service_autocomplete'),
     path('service/add/', views.ServiceAdd.as_view(), name='service_add'),
     path('service/<int:pk>/edit', views.ServiceEdit.as_view(), name='service_edit'),
     path("service/<int:pk>/delete/", views.ServiceDelete.as_view(), name="service_delete"),
 
     path('services_rendered/', views.service_rendereds_get, name='services_rendered'),
+    path('services_rendered/export/', views.services_rendered_export, name='services_rendered_export'),
+    path('services_rendered/live/', views.live_rows, {'entity': 'service_rendered'}, name='service_rendered_live'),
     path('service_rendered/add/', views.Service_renderedAdd.as_view(), name='service_rendered_add'),
     path('service_rendered/<int:pk>/edit', views.Service_renderedEdit.as_view(), name='service_rendered_edit'),
     path("service_rendered/<int:pk>/delete/", views.Service_renderedDelete.as_view(), name="service_rendered_delete"),
     
     path('receptions/', views.receptions_get, name='receptions'),
+    path('receptions/autocomplete/', views.reception_autocomplete, name='reception_autocomplete'),
+    path('receptions/free-slots/', views.reception_free_slots, name='reception_free_slots'),
+    path('receptions/export/', views.receptions_export, name='receptions_export'),
+    path('receptions/live/', views.live_rows, {'entity': 'reception'}, name='reception_live'),
     path('reception/add/', views.ReceptionAdd.as_view(), name='reception_add'),
     path('reception/<int:pk>/edit', views.ReceptionEdit.as_view(), name='reception_edit'),
     path("reception/<int:pk>/delete/", views.ReceptionDelete.as_view(), name="reception_delete"),
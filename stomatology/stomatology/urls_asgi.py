@@ -0,0 +1,15 @@
+from django.urls import path, include
+from . import async_views
+
+# Списки и выгрузки обслуживают асинхронные представления, остальные адреса - те же, что под WSGI
+urlpatterns = [
+    path('doctors/', async_views.doctors_get, name='doctors'),
+    path('patients/', async_views.patients_get, name='patients'),
+    path('schedules/', async_views.schedules_get, name='schedules'),
+    path('services/', async_views.services_get, name='services'),
+    path('services_rendered/', async_views.service_rendereds_get, name='services_rendered'),
+    path('receptions/', async_views.receptions_get, name='receptions'),
+    path('receptions/export/', async_views.receptions_export, name='receptions_export'),
+    path('services_rendered/export/', async_views.services_rendered_export, name='services_rendered_export'),
+    path('', include('stomatology.urls')),
+]
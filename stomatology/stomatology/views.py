@@ -1,19 +1,46 @@
+import datetime
+import io
+
 from django.shortcuts import render
-from django.http import HttpResponse
+from django.http import HttpResponse, JsonResponse, StreamingHttpResponse
 from django.urls import reverse_lazy
 from django.contrib import messages
 from django.contrib.messages.views import SuccessMessageMixin
 from django.contrib.auth import login
+from django.contrib.auth.decorators import login_required, permission_required
 from django.contrib.auth.views import LoginView, LogoutView
+from django.contrib.admin.views.decorators import staff_member_required
 from django.contrib.auth.mixins import PermissionRequiredMixin
 from django.views.generic.edit import CreateView, UpdateView, DeleteView
-from django.db.models import Q, Case, When, Value, CharField, Func, F
-from django.db.models.functions import Cast, Greatest
-from django.contrib.postgres.search import TrigramSimilarity, SearchVector
-
-
+from django.conf import settings
+from django.core.exceptions import BadRequest, PermissionDenied
+from django.db import IntegrityError, OperationalError, transaction
+from django.db.models import Q, Case, When, Value, CharField, F
+from django.contrib.postgres.search import TrigramSimilarity, SearchQuery
+from django.utils import timezone
+from django.utils.cache import patch_vary_headers
+from django.utils.http import urlencode
+
+
+from app.db.postgresql_pool.pool import pool_stats
+
+from .analytics import UTILIZATION_MAX_DAYS, cached_utilization
+from .availability import booking_conflict, free_slots
+from .export import EXPORT_FORMATS, accepts_gzip, agzip_chunks, export_chunks, export_queryset, gzip_chunks
+from .bulk_import import IMPORTERS, import_csv
+from .cache import cached_search, search_cache_stats
+from .catalog import catalog_stats
+from .conditional import conditional_list
+from .fragments import render_rows
+from .live import hub, stream
 from .forms import *
-from .models import Doctor, Patient, Schedule, Service, Reception
+from .instrumentation import query_budget
+from .listing import list_values
+from .models import RECEPTION_DURATION, Doctor, Patient, Schedule, Service, Reception
+from .pagination import KeysetPage, keyset_page
+from .revenue import REVENUE_MAX_DAYS, revenue_report
+from .search import parse_query, query_canceled, search_score, trigram_threshold, trigram_similarity
+from .singleflight import Abandoned
 
 
 def index(request):
@@ -58,27 +85,346 @@ class UserLogoutView(LogoutView):
     next_page = 'home'
 
 
-def doctors_get(request):
-    FIELDS = ["full_name", "phone_number", "office_number"]
+@staff_member_required
+def search_cache_metrics(request):
+    """
+    Попадания и промахи кэша поиска для мониторинга
+    """
+    return JsonResponse(search_cache_stats())
+
+
+@staff_member_required
+def db_pool_metrics(request):
+    """
+    Состояние пулов соединений с БД этого процесса: занято, ждут, время ожидания
+    """
+    return JsonResponse(pool_stats())
+
+
+@staff_member_required
+def catalog_cache_metrics(request):
+    """
+    Справочники врачей и услуг в памяти этого процесса: строки, байты, попадания, сбросы
+    """
+    return JsonResponse(catalog_stats())
+
+
+@staff_member_required
+def live_metrics(request):
+    """
+    Слушатель живой доски этого процесса: подключен ли, сколько потоков SSE открыто
+    """
+    return JsonResponse(hub.stats())
+
+
+def live_rows(request, entity):
+    """
+    Поток Server-Sent Events с изменившимися строками таблицы (см. live.py).
+    Поток не закрывается, поэтому бюджет запросов к нему не применяется
+    """
+    response = StreamingHttpResponse(stream(request, entity), content_type='text/event-stream')
+    response['Cache-Control'] = 'no-cache'
+    # nginx не должен копить события в буфере
+    response['X-Accel-Buffering'] = 'no'
+    return response
+
+
+def export_params(request, entity):
+    """
+    Выборка и формат выгрузки по ?format=csv|json|html&start=<дата>&end=<дата>&doctor=<id>
+    """
+    export_class = EXPORT_FORMATS.get(request.GET.get('format') or 'csv')
+    if export_class is None:
+        raise BadRequest("Неизвестный формат выгрузки")
+    start = _query_param(request, 'start', datetime.date.fromisoformat)
+    end = _query_param(request, 'end', datetime.date.fromisoformat)
+    doctor = _query_param(request, 'doctor', int)
+    export = export_class(request, entity)
+    return export.values(export_queryset(entity, start, end, doctor)), export, (start, end)
+
+
+def export_response(request, chunks, export, name, dates):
+    """
+    Потоковый ответ с файлом выгрузки, сжатый gzip, если клиент его принимает
+    """
+    period = '_'.join(day.isoformat() for day in dates if day)
+    filename = f"{name}{'_' + period if period else ''}.{export.extension}"
+    gzip = accepts_gzip(request)
+    if gzip:
+        chunks = agzip_chunks(chunks) if hasattr(chunks, '__aiter__') else gzip_chunks(chunks)
+    response = StreamingHttpResponse(chunks, content_type=export.content_type)
+    response['Content-Disposition'] = f'{export.disposition}; filename="{filename}"'
+    if gzip:
+        response['Content-Encoding'] = 'gzip'
+    patch_vary_headers(response, ('Accept-Encoding',))
+    return response
+
+
+@permission_required('stomatology.view_reception', raise_exception=True)
+def receptions_export(request):
+    queryset, export, dates = export_params(request, 'reception')
+    return export_response(request, export_chunks(queryset, export), export, 'receptions', dates)
+
+
+@permission_required('stomatology.view_service_rendered', raise_exception=True)
+def services_rendered_export(request):
+    queryset, export, dates = export_params(request, 'service_rendered')
+    return export_response(request, export_chunks(queryset, export), export, 'services_rendered', dates)
+
+
+@permission_required('stomatology.view_revenuedaily', raise_exception=True)
+@query_budget(5)
+def revenue_get(request):
+    """
+    Выручка врачей: ?start=<дата>&end=<дата>&doctor=<id>, по умолчанию - с начала месяца.
+    Читает только сводки по дням (см. revenue.py)
+    """
+    today = timezone.localdate()
+    start = _query_param(request, 'start', datetime.date.fromisoformat, today.replace(day=1))
+    end = _query_param(request, 'end', datetime.date.fromisoformat, today)
+    doctor = _query_param(request, 'doctor', int)
+    if end < start or (end - start).days >= REVENUE_MAX_DAYS:
+        raise BadRequest("Некорректный диапазон")
+
+    report = revenue_report(start, end, doctor)
+    services = {}
+    for row in report['services']:
+        services.setdefault(row['doctor_id'], []).append(row)
+    for row in report['doctors']:
+        row['services'] = services.get(row['doctor_id'], [])
+    context = {
+        'title': 'Выручка',
+        'start': start,
+        'end': end,
+        'doctors': report['doctors'],
+        'days': report['days'],
+        'total_visits': sum(row['visits'] for row in report['days']),
+        'total_revenue': sum(row['revenue'] for row in report['days']),
+    }
+    return render(request, 'revenue/revenue_main.html', context)
+
+
+@staff_member_required
+# Сессия, пользователь и ФИО врачей; COPY расписания и приемов идут мимо execute_wrapper
+@query_budget(3)
+def utilization_get(request):
+    """
+    Загрузка врачей: ?start=<дата>&end=<дата>&doctor=<id>&format=json,
+    по умолчанию - за последний год. Расчет кэшируется (см. analytics.py)
+    """
+    today = timezone.localdate()
+    end = _query_param(request, 'end', datetime.date.fromisoformat, today)
+    start = _query_param(request, 'start', datetime.date.fromisoformat, end - datetime.timedelta(days=364))
+    doctor = _query_param(request, 'doctor', int)
+    if end < start or (end - start).days >= UTILIZATION_MAX_DAYS:
+        raise BadRequest("Некорректный диапазон")
+
+    report = cached_utilization(start, end, doctor)
+    if request.GET.get('format') == 'json':
+        return JsonResponse(report)
+    weekdays = [name for _, name in Schedule.DAY_WEEK_CHOICES]
+    context = {
+        'title': 'Загрузка врачей',
+        'start': start,
+        'end': end,
+        'report': report,
+        # Строки тепловой карты: день недели и (загрузка, приемов) по часам
+        'heatmap': [
+            (weekday, list(zip(utilization, visits)))
+            for weekday, utilization, visits in zip(weekdays, report['heatmap']['utilization'], report['heatmap']['visits'])
+        ],
+    }
+    return render(request, 'analytics/utilization.html', context)
+
+
+# Сколько ошибок импорта показывать на странице
+IMPORT_ERRORS_SHOWN = 200
+
+
+@login_required
+def import_upload(request):
+    """
+    Загрузка CSV с пациентами или приемами (то же, что manage.py import_csv)
+    """
+    form = ImportForm(request.POST or None, request.FILES or None)
+    result = None
+    if request.method == 'POST' and form.is_valid():
+        kind = form.cleaned_data['kind']
+        model = IMPORTERS[kind].model._meta.model_name
+        if not request.user.has_perm(f'stomatology.add_{model}'):
+            raise PermissionDenied
+        file = io.TextIOWrapper(form.cleaned_data['file'].file, encoding='utf-8-sig', newline='')
+        result = import_csv(file, kind)
+    context = {
+        'title': 'Импорт',
+        'form': form,
+        'result': result,
+        'errors': result.errors[:IMPORT_ERRORS_SHOWN] if result else [],
+    }
+    return render(request, 'import.html', context)
+
+
+# Результаты поиска выводятся от лучших совпадений к худшим
+SEARCH_ORDERING = ('-score', 'id')
+
+
+def list_page(request, queryset, ordering, similarity_threshold=None):
+    """
+    Страница списка по курсору и признак того, что поиск не уложился во время.
+
+    similarity_threshold - порог для оператора % в фильтрах queryset.
+    Поиск возвращает SEARCH_RESULTS лучших строк за отведенное время
+    SEARCH_STATEMENT_TIMEOUT, остальные - по кнопке "Показать ещё".
+    Страницы результатов поиска кэшируются (см. cache.py).
+    """
+    search = request.GET.get('q')
+    cursor = request.GET.get('cursor')
+    queryset = list_values(queryset, ordering)
+    if not search:
+        return keyset_page(queryset, ordering, cursor), False
+
+    def get_page():
+        with trigram_threshold(similarity_threshold, statement_timeout=settings.SEARCH_STATEMENT_TIMEOUT):
+            return keyset_page(queryset, ordering, cursor, size=settings.SEARCH_RESULTS)
+
+    try:
+        return cached_search(request, queryset.model._meta.model_name, search, cursor, get_page), False
+    except OperationalError as error:
+        if not query_canceled(error):
+            raise
+        return KeysetPage([], None), True
+
+
+def list_response(request, page, search_timeout, name, context_name):
+    """
+    Обычный запрос получает всю страницу, HTMX-поиск - только таблицу,
+    а запрос с курсором (бесконечная прокрутка) - только следующие строки.
+    """
     search = request.GET.get('q')
+    cursor = request.GET.get('cursor')
+    next_page_url = None
+    if page.has_next:
+        params = {'q': search, 'cursor': page.next_cursor} if search else {'cursor': page.next_cursor}
+        next_page_url = f"{request.path}?{urlencode(params)}"
+
+    entity = name.rsplit('/', 1)[-1]
+    context = {
+        context_name: page.object_list,
+        # Строки таблицы собираются из кэша отрисованных строк (см. fragments.py)
+        'rendered_rows': render_rows(request, entity, f'{name}_row.html', page.object_list),
+        'next_page_url': next_page_url,
+        'cursor': cursor,
+        'search_timeout': search_timeout,
+    }
+    if cursor:
+        response = render(request, f'{name}_rows.html', context)
+    elif request.headers.get('HX-Request'):  # Проверка на AJAX (HTMX)
+        response = render(request, f'{name}_search.html', context)
+    else:
+        response = render(request, f'{name}_main.html', context)
+    # Для conditional_list: прерванный поиск не получает ETag
+    response.search_timeout = search_timeout
+    return response
+
+
+def render_list(request, queryset, ordering, name, context_name, similarity_threshold=None):
+    """
+    Отрисовка списка постранично по курсору
+    """
+    try:
+        page, search_timeout = list_page(request, queryset, ordering, similarity_threshold)
+    except Abandoned:
+        # Пользователь уже набрал следующий запрос: HTMX не заменяет таблицу по ответу 204
+        return HttpResponse(status=204)
+    return list_response(request, page, search_timeout, name, context_name)
+
+
+def render_autocomplete(request, queryset, ordering, option, similarity_threshold=None):
+    """
+    Варианты для виджета AutocompleteSelect: та же выборка, что у списка,
+    каждая строка превращается функцией option в {'value', 'label', 'details'}
+    """
+    try:
+        page, search_timeout = list_page(request, queryset, ordering, similarity_threshold)
+    except Abandoned:
+        return HttpResponse(status=204)
+    next_page_url = None
+    if page.has_next:
+        params = {'q': request.GET.get('q', ''), 'cursor': page.next_cursor}
+        next_page_url = f"{request.path}?{urlencode(params)}"
+    context = {
+        'options': [option(row) for row in page.object_list],
+        'next_page_url': next_page_url,
+        'cursor': request.GET.get('cursor'),
+        'search_timeout': search_timeout,
+    }
+    return render(request, 'widgets/autocomplete_options.html', context)
+
+
+DOCTOR_SIMILARITY_THRESHOLD = 0.1
+DOCTOR_ORDERING = ('full_name', 'id')
+
+def doctor_search(search):
+    """
+    queryset и сортировка списка врачей по строке поиска
+    """
     if search:
-        doctors = Doctor.objects.annotate(
-            search=SearchVector(*FIELDS),
-            similarity_full_name=TrigramSimilarity('full_name', search),
-            similarity_phone_number=TrigramSimilarity('phone_number', search)
-        ).filter(
-            Q(search=search) |
-            Q(similarity_full_name__gt=0.1) |
-            Q(similarity_phone_number__gt=0.25)
-        ).distinct('id').order_by('id')
+        query = parse_query(search)
+        text = query.free_text('number', 'phone')
+        doctors = Doctor.objects.all()
+        condition = Q()
+        # Число - это код врача или номер кабинета, цифры телефона ищутся подстрокой по индексу
+        for number in query.values('number'):
+            condition &= Q(id=number) | Q(office_number=str(number))
+        for phone in query.values('phone'):
+            condition &= Q(phone_number__contains=phone)
+        if text:
+            search_query = SearchQuery(text, config='russian')
+            doctors = doctors.annotate(
+                similarity_full_name=TrigramSimilarity('full_name', text),
+                similarity_phone_number=TrigramSimilarity('phone_number', text)
+            ).annotate(
+                score=search_score(
+                    F('search_vector'), search_query, 'similarity_full_name', 'similarity_phone_number'
+                )
+            )
+            text_condition = Q(search_vector=search_query) | Q(full_name__trigram_similar=text)
+            # Номер телефона может совпасть только с запросом, в котором есть цифры
+            if any(char.isdigit() for char in text):
+                text_condition |= Q(phone_number__trigram_similar=Value(text), similarity_phone_number__gt=0.25)
+            condition &= text_condition
+            ordering = SEARCH_ORDERING
+        else:
+            ordering = DOCTOR_ORDERING
+        doctors = doctors.filter(condition)
     else:
-        doctors = Doctor.objects.all().order_by('id')
+        doctors = Doctor.objects.all()
+        ordering = DOCTOR_ORDERING
             
-    if request.headers.get('HX-Request'):  # Проверка на AJAX (HTMX)
-        html = render(request, 'doctors/doctor_search.html', {'doctors': doctors})
-        return HttpResponse(html)
+    return doctors, ordering
+
+
+@query_budget(3, search=5)
+@conditional_list('doctor')
+def doctors_get(request):
+    doctors, ordering = doctor_search(request.GET.get('q'))
+    return render_list(
+        request, doctors, ordering, 'doctors/doctor', 'doctors',
+        similarity_threshold=DOCTOR_SIMILARITY_THRESHOLD
+    )
+
+@query_budget(1, search=2)
+def doctor_autocomplete(request):
+    doctors, ordering = doctor_search(request.GET.get('q'))
+    return render_autocomplete(
+        request, doctors, ordering,
+        lambda row: {
+            'value': row['id'], 'label': row['full_name'],
+            'details': f"каб. {row['office_number']}, {row['phone_number']}",
+        },
+        similarity_threshold=DOCTOR_SIMILARITY_THRESHOLD
+    )
 
-    return render(request, 'doctors/doctor_main.html', {'doctors': doctors})
 
 class DoctorAdd(CreateView, PermissionRequiredMixin):
     model = Doctor
@@ -86,6 +432,7 @@ class DoctorAdd(CreateView, PermissionRequiredMixin):
     template_name = 'doctors/doctor_add.html'
     success_url = reverse_lazy('doctors')
     permission_required = 'stomatology.add_doctor'
+    query_budget = 2
 
 class DoctorEdit(UpdateView):
     model = Doctor
@@ -94,6 +441,7 @@ class DoctorEdit(UpdateView):
     pk_url_kwarg = 'pk'
     success_url = reverse_lazy('doctors')
     permission_required = 'stomatology.change_doctor'
+    query_budget = 3
 
 class DoctorDelete(DeleteView):
     model = Doctor
@@ -103,39 +451,82 @@ class DoctorDelete(DeleteView):
     permission_required = 'stomatology.delete_doctor'
 
 
-def patients_get(request):
-    FIELDS = ["full_name", "phone_number", "patient_address"]
-    search = request.GET.get('q')
+PATIENT_SIMILARITY_THRESHOLD = 0.6
+PATIENT_ORDERING = ('full_name', 'id')
+
+def patient_search(search):
+    """
+    queryset и сортировка списка пациентов по строке поиска
+    """
     
     if search:
-        search_vector = SearchVector(*FIELDS)
-        
-        similarity_full_name = TrigramSimilarity('full_name', search)
-        similarity_phone_number = TrigramSimilarity('phone_number', search)
-        similarity_patient_address = TrigramSimilarity('patient_address', search)
-
-        patients = Patient.objects.annotate(
-            search=search_vector,
-            similarity=Greatest(
-                similarity_full_name,
-                similarity_phone_number,
-                similarity_patient_address
+        query = parse_query(search)
+        # Число рядом с текстом скорее номер дома в адресе, а отдельно - код пациента
+        consumed = ('phone',) if query.text else ('phone', 'number')
+        text = query.free_text(*consumed)
+        patients = Patient.objects.all()
+        condition = Q()
+        if not query.text:
+            for number in query.values('number'):
+                condition &= Q(id=number)
+        for phone in query.values('phone'):
+            condition &= Q(phone_number__contains=phone)
+        if text:
+            similarity_full_name = TrigramSimilarity('full_name', text)
+            similarity_phone_number = TrigramSimilarity('phone_number', text)
+            similarity_patient_address = TrigramSimilarity('patient_address', text)
+            search_query = SearchQuery(text, config='russian')
+
+            patients = patients.annotate(
+                score=search_score(
+                    F('search_vector'),
+                    search_query,
+                    similarity_full_name,
+                    similarity_phone_number,
+                    similarity_patient_address
+                )
+            )
+            text_condition = (
+                Q(search_vector=search_query) |
+                Q(full_name__icontains=text) |
+                Q(patient_address__icontains=text) |
+                Q(full_name__trigram_similar=text) |
+                Q(patient_address__trigram_similar=text)
             )
-        ).filter(
-            Q(search=search) | 
-            Q(full_name__icontains=search) |
-            Q(phone_number__icontains=search) |
-            Q(patient_address__icontains=search) |
-            Q(similarity__gt=0.6) 
-        ).distinct('id').order_by('id')
+            # В номере телефона только цифры: без них в запросе он не совпадет,
+            # а лишние условия мешают Postgres выбрать поиск по индексам
+            if any(char.isdigit() for char in text):
+                text_condition |= Q(phone_number__icontains=text) | Q(phone_number__trigram_similar=Value(text))
+            condition &= text_condition
+            ordering = SEARCH_ORDERING
+        else:
+            ordering = PATIENT_ORDERING
+        patients = patients.filter(condition)
     else:
-        patients = Patient.objects.all().order_by('id')
+        patients = Patient.objects.all()
+        ordering = PATIENT_ORDERING
             
-    if request.headers.get('HX-Request'):  # Проверка на AJAX (HTMX)
-        html = render(request, 'patients/patient_search.html', {'patients': patients})
-        return HttpResponse(html)
+    return patients, ordering
+
+
+@query_budget(3, search=5)
+@conditional_list('patient')
+def patients_get(request):
+    patients, ordering = patient_search(request.GET.get('q'))
+    return render_list(
+        request, patients, ordering, 'patients/patient', 'patients',
+        similarity_threshold=PATIENT_SIMILARITY_THRESHOLD
+    )
+
+@query_budget(1, search=2)
+def patient_autocomplete(request):
+    patients, ordering = patient_search(request.GET.get('q'))
+    return render_autocomplete(
+        request, patients, ordering,
+        lambda row: {'value': row['id'], 'label': row['full_name'], 'details': row['phone_number']},
+        similarity_threshold=PATIENT_SIMILARITY_THRESHOLD
+    )
 
-    return render(request, 'patients/patient_main.html', {'patients': patients})
 
 class PatientAdd(CreateView, PermissionRequiredMixin):
     model = Patient
@@ -143,6 +534,7 @@ class PatientAdd(CreateView, PermissionRequiredMixin):
     template_name = 'patients/patient_add.html'
     success_url = reverse_lazy('patients')
     permission_required = 'stomatology.add_patient'
+    query_budget = 2
 
 class PatientEdit(UpdateView):
     model = Patient
@@ -151,6 +543,7 @@ class PatientEdit(UpdateView):
     pk_url_kwarg = 'pk'
     success_url = reverse_lazy('patients')
     permission_required = 'stomatology.change_patient'
+    query_budget = 3
 
 class PatientDelete(DeleteView):
     model = Patient
@@ -159,9 +552,13 @@ class PatientDelete(DeleteView):
     success_url = reverse_lazy('patients')
     permission_required = 'stomatology.delete_patient'
 
-def schedules_get(request):
-    FIELDS = ['doctor__full_name', 'day_week', 'start_reception', 'end_reception']
-    search = request.GET.get('q')
+SCHEDULE_SIMILARITY_THRESHOLD = 0.2
+SCHEDULE_ORDERING = ('day_week', 'id')
+
+def schedule_search(search):
+    """
+    queryset и сортировка списка расписания по строке поиска
+    """
 
     DAY_WEEK = {
         1: "понедельник",
@@ -174,31 +571,59 @@ def schedules_get(request):
     }
 
     if search:
-        search_vector = SearchVector(*FIELDS)
-        similarity_doctor = TrigramSimilarity('doctor__full_name', search)
-        similarity_day_week = TrigramSimilarity(Case(
-            *[When(day_week=k, then=Value(v)) for k, v in DAY_WEEK.items()],
-            output_field=CharField()
-        ), search)
-
-        schedules = Schedule.objects.annotate(
-            search=search_vector,
-            similarity=Greatest(
-                similarity_doctor,
-                similarity_day_week
+        query = parse_query(search)
+        text = query.free_text('number', 'date', 'time')
+        schedules = Schedule.objects.all()
+        condition = Q()
+        for number in query.values('number'):
+            condition &= Q(id=number)
+        # Дата превращается в дни недели, на которые она приходится
+        for start, end in query.values('date'):
+            days = {(start + datetime.timedelta(days=i)).isoweekday() for i in range(min((end - start).days + 1, 7))}
+            condition &= Q(day_week__in=days)
+        # Время - врачи, которые в этот момент ведут прием
+        for time in query.values('time'):
+            condition &= Q(start_reception__lte=time, end_reception__gt=time)
+        if text:
+            similarity_doctor = TrigramSimilarity('doctor__full_name', text)
+            similarity_day_week = TrigramSimilarity(Case(
+                *[When(day_week=k, then=Value(v)) for k, v in DAY_WEEK.items()],
+                output_field=CharField()
+            ), text)
+            search_query = SearchQuery(text, config='russian')
+
+            schedules = schedules.annotate(
+                score=search_score(
+                    F('search_vector'),
+                    search_query,
+                    similarity_doctor,
+                    similarity_day_week
+                )
+            )
+            condition &= (
+                Q(search_vector=search_query) |
+                Q(doctor__in=Doctor.objects.filter(full_name__trigram_similar=text)) |
+                Q(day_week__in=[k for k, v in DAY_WEEK.items() if trigram_similarity(v, text) > 0.2])
             )
-        ).filter(
-            Q(search=search) |
-            Q(similarity__gt=0.2)
-        )
+            ordering = SEARCH_ORDERING
+        else:
+            ordering = SCHEDULE_ORDERING
+        schedules = schedules.filter(condition)
     else:
-        schedules = Schedule.objects.all().order_by('id')
+        schedules = Schedule.objects.all()
+        ordering = SCHEDULE_ORDERING
             
-    if request.headers.get('HX-Request'):
-        html = render(request, 'schedules/schedule_search.html', {'schedules': schedules})
-        return HttpResponse(html)
+    return schedules, ordering
+
 
-    return render(request, 'schedules/schedule_main.html', {'schedules': schedules})
+@query_budget(3, search=5)
+@conditional_list('schedule')
+def schedules_get(request):
+    schedules, ordering = schedule_search(request.GET.get('q'))
+    return render_list(
+        request, schedules, ordering, 'schedules/schedule', 'schedules',
+        similarity_threshold=SCHEDULE_SIMILARITY_THRESHOLD
+    )
 
 class ScheduleAdd(CreateView, PermissionRequiredMixin):
     model = Schedule
@@ -206,6 +631,7 @@ class ScheduleAdd(CreateView, PermissionRequiredMixin):
     template_name = 'schedules/schedule_add.html'
     success_url = reverse_lazy('schedules')
     permission_required = 'stomatology.add_schedule'
+    query_budget = 2
 
 class ScheduleEdit(UpdateView):
     model = Schedule
@@ -214,6 +640,7 @@ class ScheduleEdit(UpdateView):
     pk_url_kwarg = 'pk'
     success_url = reverse_lazy('schedules')
     permission_required = 'stomatology.change_schedule'
+    query_budget = 4
 
 class ScheduleDelete(DeleteView):
     model = Schedule
@@ -222,41 +649,59 @@ class ScheduleDelete(DeleteView):
     success_url = reverse_lazy('schedules')
     permission_required = 'stomatology.delete_schedule'
 
-def services_get(request):
-    FIELDS = ['service_name', 'cost']
-    search = request.GET.get('q')
+SERVICE_SIMILARITY_THRESHOLD = 0.25
+SERVICE_ORDERING = ('service_name', 'id')
+
+def service_search(search):
+    """
+    queryset и сортировка списка услуг по строке поиска
+    """
     
     if search:
-        search_vector = SearchVector(*FIELDS)
-        similarity_service_name = TrigramSimilarity('service_name', search)
-
-        # Попробуем преобразовать строку поиска в число для поиска по стоимости
-        try:
-            cost_search = float(search)
-            services = Service.objects.annotate(
-                search=search_vector,
-                similarity=similarity_service_name
-            ).filter(
-                Q(search=search) |
-                Q(similarity__gt=0.25) |
-                Q(cost=cost_search)  # Поиск по стоимости
-            )
-        except ValueError:
-            services = Service.objects.annotate(
-                search=search_vector,
-                similarity=similarity_service_name
-            ).filter(
-                Q(search=search) |
-                Q(similarity__gt=0.25)
+        # "12.10" в списке услуг - стоимость, а не дата
+        query = parse_query(search, dates=False, times=False)
+        text = query.free_text('number', 'decimal')
+        services = Service.objects.all()
+        condition = Q()
+        # Поиск по стоимости
+        for cost in query.values('number') + query.values('decimal'):
+            condition &= Q(cost=cost)
+        if text:
+            search_query = SearchQuery(text, config='russian')
+            services = services.annotate(
+                score=search_score(F('search_vector'), search_query, TrigramSimilarity('service_name', text))
             )
+            condition &= Q(search_vector=search_query) | Q(service_name__trigram_similar=text)
+            ordering = SEARCH_ORDERING
+        else:
+            ordering = SERVICE_ORDERING
+        services = services.filter(condition)
     else:
-        services = Service.objects.all().order_by('id')
+        services = Service.objects.all()
+        ordering = SERVICE_ORDERING
             
-    if request.headers.get('HX-Request'):
-        html = render(request, 'services/service_search.html', {'services': services})
-        return HttpResponse(html)
+    return services, ordering
+
+
+@query_budget(3, search=5)
+@conditional_list('service')
+def services_get(request):
+    services, ordering = service_search(request.GET.get('q'))
+    return render_list(
+        request, services, ordering, 'services/service', 'services',
+        similarity_threshold=SERVICE_SIMILARITY_THRESHOLD
+    )
+
+@query_budget(1, search=2)
+def service_autocomplete(request):
+    services, ordering = service_search(request.GET.get('q'))
+    # Подпись как у Service.__str__, ее же виджет показывает для выбранной услуги
+    return render_autocomplete(
+        request, services, ordering,
+        lambda row: {'value': row['id'], 'label': f"{row['service_name']}({row['cost']}руб.)"},
+        similarity_threshold=SERVICE_SIMILARITY_THRESHOLD
+    )
 
-    return render(request, 'services/service_main.html', {'services': services})
 
 class ServiceAdd(CreateView, PermissionRequiredMixin):
     model = Service
@@ -264,6 +709,7 @@ class ServiceAdd(CreateView, PermissionRequiredMixin):
     template_name = 'services/service_add.html'
     success_url = reverse_lazy('services')
     permission_required = 'stomatology.add_service'
+    query_budget = 2
 
 class ServiceEdit(UpdateView):
     model = Service
@@ -272,6 +718,7 @@ class ServiceEdit(UpdateView):
     pk_url_kwarg = 'pk'
     success_url = reverse_lazy('services')
     permission_required = 'stomatology.change_service'
+    query_budget = 3
 
 class ServiceDelete(DeleteView):
     model = Service
@@ -280,45 +727,56 @@ class ServiceDelete(DeleteView):
     success_url = reverse_lazy('services')
     permission_required = 'stomatology.delete_service'
 
-def service_rendereds_get(request):
-    FIELDS = ["service__service_name", "number_reception__id", "quantity"]
-    search = request.GET.get('q')
+SERVICE_RENDERED_SIMILARITY_THRESHOLD = 0.25
+SERVICE_RENDERED_ORDERING = ('-id',)
+
+def service_rendered_search(search):
+    """
+    queryset и сортировка списка оказанных услуг по строке поиска
+    """
     
     if search:
-        search_vector = SearchVector(*FIELDS)
-        similarity_service_name = TrigramSimilarity('service__service_name', search)
-        similarity_number_reception = TrigramSimilarity(Cast('number_reception__id', CharField()), search)
-        similarity_quantity = TrigramSimilarity(Cast('quantity', CharField()), search)
-
-        services_rendered = Service_rendered.objects.annotate(
-            search=search_vector,
-            similarity_service=similarity_service_name,
-            similarity_number_reception=similarity_number_reception,
-
-        ).filter(
-            Q(search=search) |
-            Q(similarity_service__gt=0.25) |
-            Q(similarity_number_reception__gt=0.1) 
-        ).distinct('id').order_by('id')
-        services_rendered = Service_rendered.objects.annotate(
-            search=search_vector,
-            similarity_service=similarity_service_name,
-            similarity_number_reception=similarity_number_reception,
-            similarity_quantity=similarity_quantity
-        ).filter(
-            Q(search=search) |
-            Q(similarity_service__gt=0.25) |
-            Q(similarity_number_reception__gt=0.25) |
-            Q(similarity_quantity__gt=0.25)
-        ).distinct('id').order_by('id')
+        query = parse_query(search)
+        text = query.free_text('number', 'date', 'time')
+        services_rendered = Service_rendered.objects.all()
+        condition = Q()
+        # Число - номер приема или количество
+        for number in query.values('number'):
+            condition &= Q(number_reception=number) | Q(quantity=number)
+        for start, end in query.values('date'):
+            condition &= Q(number_reception__date_reception__range=(start, end))
+        for time in query.values('time'):
+            condition &= Q(number_reception__time_reception=time)
+        if text:
+            search_query = SearchQuery(text, config='russian')
+            services_rendered = services_rendered.annotate(
+                score=search_score(
+                    F('service__search_vector'), search_query, TrigramSimilarity('service__service_name', text)
+                )
+            )
+            condition &= (
+                Q(service__search_vector=search_query) |
+                Q(service__in=Service.objects.filter(service_name__trigram_similar=text))
+            )
+            ordering = SEARCH_ORDERING
+        else:
+            ordering = SERVICE_RENDERED_ORDERING
+        services_rendered = services_rendered.filter(condition)
     else:
-        services_rendered = Service_rendered.objects.all().order_by('id')
+        services_rendered = Service_rendered.objects.all()
+        ordering = SERVICE_RENDERED_ORDERING
             
-    if request.headers.get('HX-Request'):
-        html = render(request, 'services_rendered/service_rendered_search.html', {'services_rendered': services_rendered})
-        return HttpResponse(html)
+    return services_rendered, ordering
+
 
-    return render(request, 'services_rendered/service_rendered_main.html', {'services_rendered': services_rendered})
+@query_budget(3, search=5)
+@conditional_list('service_rendered')
+def service_rendereds_get(request):
+    services_rendered, ordering = service_rendered_search(request.GET.get('q'))
+    return render_list(
+        request, services_rendered, ordering, 'services_rendered/service_rendered', 'services_rendered',
+        similarity_threshold=SERVICE_RENDERED_SIMILARITY_THRESHOLD
+    )
 
 class Service_renderedAdd(CreateView, PermissionRequiredMixin):
     model = Service_rendered
@@ -326,6 +784,7 @@ class Service_renderedAdd(CreateView, PermissionRequiredMixin):
     template_name = 'services_rendered/service_rendered_add.html'
     success_url = reverse_lazy('services_rendered')
     permission_required = 'stomatology.add_service_rendered'
+    query_budget = 2
 
 class Service_renderedEdit(UpdateView):
     model = Service_rendered
@@ -334,6 +793,7 @@ class Service_renderedEdit(UpdateView):
     pk_url_kwarg = 'pk'
     success_url = reverse_lazy('services_rendered')
     permission_required = 'stomatology.change_service_rendered'
+    query_budget = 5
 
 class Service_renderedDelete(DeleteView):
     model = Service_rendered
@@ -342,56 +802,155 @@ class Service_renderedDelete(DeleteView):
     success_url = reverse_lazy('services_rendered')
     permission_required = 'stomatology.delete_service_rendered'
 
-def receptions_get(request):
-    FIELDS = ['doctor__full_name', 'patient__full_name', 'date_reception', 'time_reception']
-    search = request.GET.get('q')
+RECEPTION_SIMILARITY_THRESHOLD = 0.4
+RECEPTION_ORDERING = ('-date_reception', '-id')
 
-    class DateFormat(Func):
-        function = 'TO_CHAR'
-        template = "%(function)s(%(expressions)s, 'DD Month YYYY \"г.\"')"
+def reception_search(search):
+    """
+    queryset и сортировка списка приемов по строке поиска
+    """
 
     if search:
-        search_vector = SearchVector(*FIELDS)
-        similarity_doctor = TrigramSimilarity('doctor__full_name', search)
-        similarity_patient = TrigramSimilarity('patient__full_name', search)
-        similarity_date_reception = TrigramSimilarity(DateFormat(F('date_reception')), search)
-        similarity_time_reception = TrigramSimilarity(Cast('time_reception', CharField()), search)
-
-        receptions = Reception.objects.annotate(
-            search=search_vector,
-            similarity=Greatest(
-                similarity_doctor,
-                similarity_patient,
-                similarity_date_reception,
-                similarity_time_reception
+        query = parse_query(search)
+        text = query.free_text('number', 'date', 'time', 'phone')
+        receptions = Reception.objects.all()
+        condition = Q()
+        for number in query.values('number'):
+            condition &= Q(id=number)
+        for start, end in query.values('date'):
+            condition &= Q(date_reception__range=(start, end))
+        for time in query.values('time'):
+            condition &= Q(time_reception=time)
+        # Телефон пациента или врача
+        for phone in query.values('phone'):
+            condition &= (
+                Q(patient__in=Patient.objects.filter(phone_number__contains=phone)) |
+                Q(doctor__in=Doctor.objects.filter(phone_number__contains=phone))
+            )
+        if text:
+            search_query = SearchQuery(text, config='russian')
+            receptions = receptions.annotate(
+                score=search_score(
+                    F('search_vector'),
+                    search_query,
+                    TrigramSimilarity('doctor__full_name', text),
+                    TrigramSimilarity('patient__full_name', text)
+                )
             )
-        ).filter(
-            Q(search=search) |
-            Q(similarity__gt=0.4)
-        )
+            condition &= (
+                Q(search_vector=search_query) |
+                Q(doctor__in=Doctor.objects.filter(full_name__trigram_similar=text)) |
+                Q(patient__in=Patient.objects.filter(full_name__trigram_similar=text))
+            )
+            ordering = SEARCH_ORDERING
+        else:
+            ordering = RECEPTION_ORDERING
+        receptions = receptions.filter(condition)
     else:
-        receptions = Reception.objects.all().order_by('id')
+        receptions = Reception.objects.all()
+        ordering = RECEPTION_ORDERING
             
-    if request.headers.get('HX-Request'):
-        html = render(request, 'receptions/reception_search.html', {'receptions': receptions})
-        return HttpResponse(html)
+    return receptions, ordering
 
-    return render(request, 'receptions/reception_main.html', {'receptions': receptions})
 
-class ReceptionAdd(CreateView, PermissionRequiredMixin):
+@query_budget(3, search=5)
+@conditional_list('reception')
+def receptions_get(request):
+    receptions, ordering = reception_search(request.GET.get('q'))
+    return render_list(
+        request, receptions, ordering, 'receptions/reception', 'receptions',
+        similarity_threshold=RECEPTION_SIMILARITY_THRESHOLD
+    )
+
+@query_budget(1, search=2)
+def reception_autocomplete(request):
+    receptions, ordering = reception_search(request.GET.get('q'))
+    return render_autocomplete(
+        request, receptions, ordering,
+        lambda row: {
+            'value': row['id'],
+            'label': f"{row['id']} ({row['date_reception']} {row['time_reception']})",
+            'details': f"{row['doctor__full_name'] or ''} — {row['patient__full_name'] or ''}",
+        },
+        similarity_threshold=RECEPTION_SIMILARITY_THRESHOLD
+    )
+
+
+# Свободные окна ищутся не дальше чем на столько дней вперед от начала диапазона
+FREE_SLOTS_MAX_DAYS = 31
+
+
+def _query_param(request, name, convert, default=None):
+    value = request.GET.get(name)
+    if not value:
+        return default
+    try:
+        return convert(value)
+    except ValueError:
+        raise BadRequest(f"Некорректный параметр {name}")
+
+
+@query_budget(1)
+def reception_free_slots(request):
+    """
+    Свободные окна врачей: ?doctor=<id>&start=<дата>&end=<дата>&duration=<минуты>.
+
+    Без doctor - по всем врачам, без дат - неделя с сегодняшнего дня.
+    Форма приема запрашивает окна одного врача на выбранную дату (date_reception)
+    через HTMX и получает кнопки для поля времени, остальные - JSON.
+    """
+    now = timezone.localtime().replace(tzinfo=None)
+    doctor = _query_param(request, 'doctor', int)
+    day = _query_param(request, 'date_reception', datetime.date.fromisoformat)
+    start = _query_param(request, 'start', datetime.date.fromisoformat, day or now.date())
+    end = _query_param(request, 'end', datetime.date.fromisoformat, day or start + datetime.timedelta(days=6))
+    duration = _query_param(request, 'duration', int, RECEPTION_DURATION)
+    if end < start or (end - start).days >= FREE_SLOTS_MAX_DAYS or not 0 < duration <= 24 * 60:
+        raise BadRequest("Некорректный диапазон")
+
+    slots = free_slots(start, end, doctor, duration, after=now)
+    if request.headers.get('HX-Request'):
+        context = {'slots': slots.get(doctor, []) if doctor else [], 'doctor': doctor, 'day': day}
+        return render(request, 'receptions/reception_slots.html', context)
+    return JsonResponse({
+        'duration': duration,
+        'doctors': {
+            doctor_id: [{'date': slot_day.isoformat(), 'time': time.strftime('%H:%M')} for slot_day, time in doctor_slots]
+            for doctor_id, doctor_slots in slots.items()
+        },
+    })
+
+class ReceptionSaveMixin:
+    """
+    Запись приема: если другой прием того же врача на это время успели
+    сохранить раньше, ограничение в БД отклоняет запись и форма показывает ошибку
+    """
+    def form_valid(self, form):
+        try:
+            with transaction.atomic():
+                return super().form_valid(form)
+        except IntegrityError as error:
+            if not booking_conflict(error):
+                raise
+            form.add_error('time_reception', "Врач в это время уже занят")
+            return self.form_invalid(form)
+
+class ReceptionAdd(ReceptionSaveMixin, CreateView, PermissionRequiredMixin):
     model = Reception
     form_class = ReceptionForm
     template_name = 'receptions/reception_add.html'
     success_url = reverse_lazy('receptions')
     permission_required = 'stomatology.add_reception'
+    query_budget = 2
 
-class ReceptionEdit(UpdateView):
+class ReceptionEdit(ReceptionSaveMixin, UpdateView):
     model = Reception
     form_class = ReceptionForm
     template_name = 'receptions/reception_edit.html'
     pk_url_kwarg = 'pk'
     success_url = reverse_lazy('receptions')
     permission_required = 'stomatology.change_reception'
+    query_budget = 5
 
 class ReceptionDelete(DeleteView):
     model = Reception
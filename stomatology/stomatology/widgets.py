@@ -0,0 +1,51 @@
+from django import forms
+from django.core.exceptions import ValidationError
+from django.urls import reverse
+
+from .catalog import catalog_for
+
+
+class AutocompleteSelect(forms.Widget):
+    """
+    Выбор связанной записи поиском по мере ввода вместо <select> со всей таблицей.
+
+    Варианты подгружаются постранично с url_name (см. views.render_autocomplete),
+    в форму уходит только первичный ключ. При отрисовке читается одна строка -
+    выбранная, а не весь queryset поля; врачи и услуги берутся из справочника
+    процесса (см. catalog.py) без запроса.
+    """
+    template_name = 'widgets/autocomplete.html'
+
+    class Media:
+        js = ('https://unpkg.com/htmx.org@1.9.6', 'js/autocomplete.js')
+
+    def __init__(self, url_name, placeholder='', attrs=None):
+        super().__init__(attrs)
+        self.url_name = url_name
+        self.placeholder = placeholder
+
+    def selected_label(self, value):
+        """
+        Подпись выбранной записи: ModelChoiceField передает в виджет свой queryset через choices
+        """
+        if value in (None, ''):
+            return ''
+        field = self.choices.field
+        catalog = catalog_for(field.queryset.model)
+        try:
+            if catalog is not None and not field.queryset.query.has_filters():
+                obj = catalog.get(int(value))
+            else:
+                obj = field.queryset.filter(pk=value).first()
+        except (ValueError, TypeError, ValidationError):
+            return ''
+        return field.label_from_instance(obj) if obj is not None else ''
+
+    def get_context(self, name, value, attrs):
+        context = super().get_context(name, value, attrs)
+        context['widget'].update({
+            'url': reverse(self.url_name),
+            'placeholder': self.placeholder,
+            'label': self.selected_label(context['widget']['value']),
+        })
+        return context